@@ -0,0 +1,201 @@
+"""
+Compact, append-only archive of completed games.
+
+Each completed game is archived as one JSON record holding its final
+story, contributors and per-round prompts. Every record is compressed
+as a gzip member of its own, and records are appended to segments, so:
+
+    * a segment is a valid gzip file of JSON lines that can be
+      streamed record by record (or read with zcat)
+    * a single record can be read by decompressing only its own bytes,
+      given the offset and length kept in the index
+
+Index entries map a game id to the segment, offset and length of its
+record, plus the date it was archived. This module holds the format
+and a directory-backed archive for the command line server; the
+Lambda backend keeps segments in S3 (see aws.s3archive).
+"""
+import gzip
+import json
+import os
+import time
+import zlib
+from StringIO import StringIO
+
+SEGMENT_BYTES = int(os.environ.get("GROUPWEAVE_ARCHIVE_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+INDEX_FILE = "index.jsonl"
+
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def archive_date(timestamp=None):
+    return time.strftime("%Y-%m-%d", time.gmtime(time.time() if timestamp is None else timestamp))
+
+
+def game_record(game, archived_at=None):
+    """
+    :return: the archive record of a completed game
+    """
+    archived_at = time.time() if archived_at is None else archived_at
+    return {
+        'gameId': game.id,
+        'archivedAt': int(archived_at),
+        'host': game.host.name,
+        'contributors': [player.name for player in game.players],
+        'story': game.story,
+        'rounds': [{'round': entry['round'], 'prompts': entry['prompts'], 'choice': entry['choice']}
+                   for entry in game.rounds]
+    }
+
+
+def encode_record(record):
+    """
+    :return: the record as a standalone gzip member
+    """
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as member:
+        member.write(json.dumps(record, separators=(',', ':')) + "\n")
+    return buf.getvalue()
+
+
+def decode_record(data):
+    return json.loads(zlib.decompress(data, _GZIP_WBITS))
+
+
+def iter_records(fileobj, chunk_size=64 * 1024):
+    """
+    Stream the records of a segment, reading it chunk by chunk. Works
+    on any object with read(), including unseekable S3 response bodies.
+    """
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    pending = ""
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        while chunk:
+            pending += decompressor.decompress(chunk)
+            # Leftover input belongs to the next gzip member
+            chunk = decompressor.unused_data
+            if chunk:
+                pending += decompressor.flush()
+                decompressor = zlib.decompressobj(_GZIP_WBITS)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield json.loads(line)
+    pending += decompressor.flush()
+    if pending.strip():
+        yield json.loads(pending)
+
+
+class SegmentWriter(object):
+    """
+    Builds a segment in memory
+    """
+
+    def __init__(self, name, start_offset=0):
+        self.name = name
+        self.size = start_offset
+        self._members = []
+
+    def add(self, record):
+        """
+        :return: the index entry of the added record
+        """
+        member = encode_record(record)
+        entry = {'gameId': record['gameId'],
+                 'date': archive_date(record['archivedAt']),
+                 'segment': self.name,
+                 'offset': self.size,
+                 'length': len(member)}
+        self._members.append(member)
+        self.size += len(member)
+        return entry
+
+    def getvalue(self):
+        return "".join(self._members)
+
+
+class DirectoryArchive(object):
+    """
+    An archive kept as segment files and an index file in a directory.
+    Segments are appended to until they reach 'segment_bytes'.
+    """
+
+    def __init__(self, directory, segment_bytes=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or SEGMENT_BYTES
+        self._index = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith("segment-"))
+
+    def append(self, records):
+        """
+        Archive records
+        :return: their index entries
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        segments = self._segments()
+        name = segments[-1] if segments else "segment-000000.gz"
+        size = os.path.getsize(self._path(name)) if segments else 0
+        if size >= self.segment_bytes:
+            name = "segment-{:06d}.gz".format(int(name[len("segment-"):-len(".gz")]) + 1)
+            size = 0
+        writer = SegmentWriter(name, size)
+        entries = [writer.add(record) for record in records]
+        with open(self._path(name), 'ab') as segment:
+            segment.write(writer.getvalue())
+        with open(self._path(INDEX_FILE), 'a') as index:
+            for entry in entries:
+                index.write(json.dumps(entry) + "\n")
+        if self._index is not None:
+            self._index.update((entry['gameId'], entry) for entry in entries)
+        return entries
+
+    def index(self):
+        """
+        :return: a dict of game id -> index entry, the latest entry winning
+        """
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self._path(INDEX_FILE)):
+                with open(self._path(INDEX_FILE)) as index:
+                    for line in index:
+                        entry = json.loads(line)
+                        self._index[entry['gameId']] = entry
+        return self._index
+
+    def lookup(self, game_id):
+        """
+        :return: the archived record of a game, or None
+        """
+        entry = self.index().get(game_id)
+        if entry is None:
+            return None
+        with open(self._path(entry['segment']), 'rb') as segment:
+            segment.seek(entry['offset'])
+            return decode_record(segment.read(entry['length']))
+
+    def games_archived_on(self, date):
+        """
+        :param date: a YYYY-MM-DD date
+        :return: the ids of the games archived on that date
+        """
+        return sorted(game_id for game_id, entry in self.index().items() if entry['date'] == date)
+
+    def stream(self):
+        """
+        Iterate over every archived record, oldest first
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in self._segments():
+            with open(self._path(name), 'rb') as segment:
+                for record in iter_records(segment):
+                    yield record
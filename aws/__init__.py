@@ -3,32 +3,129 @@ Module for AWS-specific implementations of
 game classes
 """
 
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+
 import game
-from aws import dynamo, sqs
+import metrics
+import recording
+# Importing blobs installs the S3 blob store, if one is configured
+from aws import blobs, clients, deadlines, dynamo, eventlog, gamestats, sqs
+from aws.cache import game_cache
 from aws.dynamo import GameIdGenerator
-from game import GameFactory
+from game import CompleteGame, GameFactory
 from gameutil import GameReference
 
 
+# The messages to participants of the game being changed, sent once the change is saved
+_outbox = threading.local()
+
+
+def _send_all(messages):
+    for queue_url, event in messages:
+        sqs.send_message(queue_url, event.stamped("sqs_send"))
+
+
+class Role(object):
+    """
+    The roles a participant can have in a game
+    """
+    HOST = 0
+    PLAYER = 1
+    SPECTATOR = 2
+
+
 class BasePlayer(game.Player):
+    """
+    A participant in a game, kept compact because every participant
+    is stored in the game item: its role is given by its class, its
+    token is kept as 16 bytes, and its queue URL is derived from a
+    prefix shared by all the participants of the game.
+
+    Each event sent to the participant's queue is numbered, counting
+    from 1, so that consumers can put them back in order (see aws.consumer).
+    Events published while a GameWrapper is changing the game are only
+    sent once the change is saved, so a change that loses a race with
+    another never sends the numbers the winner sends.
+    """
+
+    __slots__ = ('_name', '_token', '_queue_prefix', '_sent')
+
+    role = None
+
     def __init__(self, name, token):
         super(BasePlayer, self).__init__()
         self._name = name
-        self.token = token
-        self.queueUrl = None
+        self._token = token.bytes
+        self._queue_prefix = None
+        self._sent = 0
 
     @property
     def name(self):
         return self._name
 
+    @property
+    def token(self):
+        return uuid.UUID(bytes=self._token)
+
+    @property
+    def queueUrl(self):
+        if self._queue_prefix is None:
+            return None
+        return self._queue_prefix + sqs.queue_suffix(self.token)
+
+    def use_queue(self, game, queue_url):
+        """
+        Notify the participant through the given queue, sharing the
+        queue URL prefix of the game's host if it is the same
+        """
+        prefix = sqs.queue_prefix(queue_url, self.token)
+        host = game.host if game is not None else None
+        if host is not None and host is not self and host._queue_prefix == prefix:
+            prefix = host._queue_prefix
+        self._queue_prefix = prefix
+
     def notify(self, event):
-        sqs.send_message(self.queueUrl, event)
+        self._sent += 1
+        messages = getattr(_outbox, 'messages', None)
+        if messages is None:
+            _send_all([(self.queueUrl, event.sequenced(self._sent))])
+        else:
+            messages.append((self.queueUrl, event.sequenced(self._sent)))
+
+    def skipped(self, event):
+        # The event was sent when it was first published, so its number is taken
+        self._sent += 1
 
     def join(self, game):
-        self.queueUrl = sqs.create_queue(game.id, self.token)
+        self.use_queue(game, sqs.create_queue(game.id, self.token))
+
+    def __getstate__(self):
+        return self._name, self._token, self._queue_prefix, self._sent
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Participants stored before they were slotted
+            self._name = state['_name']
+            self._token = state['token'].bytes
+            self._queue_prefix = None
+            self._sent = 0
+            if state.get('queueUrl') is not None:
+                self._queue_prefix = sqs.queue_prefix(state['queueUrl'], state['token'])
+        elif len(state) == 3:
+            # Participants stored before their events were numbered
+            self._name, self._token, self._queue_prefix = state
+            self._sent = 0
+        else:
+            self._name, self._token, self._queue_prefix, self._sent = state
 
 
 class Player(BasePlayer):
+    __slots__ = ()
+
+    role = Role.PLAYER
+
     def join(self, game):
         super(Player, self).join(game)
         game.register_player(self)
@@ -39,11 +136,20 @@ class Host(BasePlayer):
     The host of a game
     """
 
+    __slots__ = ()
+
+    role = Role.HOST
+
+
 class Spectator(BasePlayer):
     """
     A spectator of a game
     """
 
+    __slots__ = ()
+
+    role = Role.SPECTATOR
+
     def __init__(self, token):
         super(Spectator, self).__init__("Spectator", token)
 
@@ -52,17 +158,95 @@ class Spectator(BasePlayer):
         game.register_spectator(self)
 
 
+def participants(game):
+    """
+    :return: the host, players and spectators of a game
+    """
+    return [game.host] + list(game.players) + list(game.spectators)
+
+
+class _AllocatedIds(object):
+    """
+    Hands out game ids allocated in advance
+    """
+
+    def __init__(self, game_ids):
+        self._game_ids = iter(game_ids)
+
+    def new_id(self):
+        return next(self._game_ids)
+
+
 class GameWrapperFactory(object):
+    @staticmethod
+    def new_games(hosts):
+        """
+        Create and store a game for each host at once: the ids are
+        allocated together, the hosts' queues are created concurrently
+        and the games are stored with batched writes
+        :return: the new games, in the order of their hosts
+        """
+        game_factory = GameFactory(_AllocatedIds(GameIdGenerator().new_ids(len(hosts))))
+        games = [game_factory.new_game(host) for host in hosts]
+        pool = ThreadPool(max(1, min(len(hosts), clients.POOL_SIZE)))
+        try:
+            with metrics.phase("SqsCreateQueue"):
+                pool.map(lambda host_game: host_game[0].join(host_game[1]), zip(hosts, games))
+        finally:
+            pool.close()
+        metrics.increment("SqsCalls", len(hosts))
+        if eventlog.ENABLED:
+            eventlog.create_games(games)
+        else:
+            dynamo.create_games(games)
+        return games
+
     @staticmethod
     def new_game(host):
         game = GameFactory(GameIdGenerator()).new_game(host)
-        dynamo.create_game(game)
-        return GameWrapper(game)
+        if eventlog.ENABLED:
+            # The game is stored by its first record, when the wrapper is saved
+            return GameWrapper(game, 0, is_new=True)
+        version = dynamo.create_game(game)
+        return GameWrapper(game, version)
 
     @staticmethod
     def load_game(game_id):
-        game = dynamo.load_game(game_id)
-        return GameWrapper(game)
+        """
+        Load a game, reusing this container's cached copy
+        if its version is still the stored version
+        """
+        with metrics.phase("LoadGame"):
+            cached = game_cache.get(game_id)
+            if cached is not None:
+                refreshed = GameWrapperFactory._refresh(game_id, *cached)
+                if refreshed is not None:
+                    game_cache.record_hit()
+                    metrics.increment("GameCacheHits")
+                    return GameWrapper(*refreshed)
+                game_cache.invalidate(game_id)
+            game_cache.record_miss(stale=cached is not None)
+            metrics.increment("GameCacheMisses")
+            if eventlog.ENABLED:
+                game, version = eventlog.load_game(game_id)
+            else:
+                game, version = dynamo.load_versioned_game(game_id)
+        return GameWrapper(game, version)
+
+    @staticmethod
+    def _refresh(game_id, game, version):
+        """
+        Bring a cached game up to date
+        :return: a tuple of the game and its version, or None if it is stale
+        """
+        if eventlog.ENABLED:
+            try:
+                return eventlog.catch_up(game, version)
+            except Exception:
+                return None
+        if dynamo.load_game_version(game_id) == version:
+            return game, version
+        return None
 
 
 class GameWrapper(object):
@@ -71,16 +255,84 @@ class GameWrapper(object):
     game state from DynamoDB
     """
 
-    def __init__(self, game):
-        self.game = GameReference(game)
+    def __init__(self, game, version=None, is_new=False):
+        self.game = GameReference(game, self._journal if eventlog.ENABLED else None)
+        self.version = version
+        self.is_new = is_new
+        self._actions = []
+        self._loaded_round = game.round_number
+        self._loaded_deadline = deadlines.deadline_key(game)
+        self._loaded_complete = isinstance(game, CompleteGame)
+        self._loaded_totals = game.stats.totals()
+        self._transition = None
+        self._outer_messages = None
+
+    def _journal(self, method_name, args, kwargs):
+        action = eventlog.encode_action(method_name, args)
+        if action is not None:
+            self._actions.append(action)
 
     def save(self):
-        dynamo.save_game(self.game.game)
+        game = self.game.game
+        saved_version = self.version
+        with metrics.phase("SaveGame"):
+            try:
+                if eventlog.ENABLED:
+                    self._append_actions(game)
+                else:
+                    self.version = dynamo.save_game(game, self.version)
+            except Exception:
+                game_cache.invalidate(game.id)
+                raise
+            if self.version != saved_version:
+                if dynamo.VIEWS_ENABLED:
+                    dynamo.save_view(game, self.version)
+                if deadlines.deadline_key(game) != self._loaded_deadline:
+                    deadlines.schedule(game)
+                    self._loaded_deadline = deadlines.deadline_key(game)
+                self._add_stats(game)
+        game_cache.put(game.id, game, self.version)
+        if isinstance(game, CompleteGame) and not self._loaded_complete:
+            recording.record_done(game.id, game.story)
+            self._loaded_complete = True
+
+    def _add_stats(self, game):
+        """
+        Add what the game's statistics gained since it was loaded to the global statistics
+        """
+        totals = game.stats.totals()
+        gamestats.add({name: value - self._loaded_totals.get(name, 0) for name, value in totals.items()})
+        self._loaded_totals = totals
+
+    def _append_actions(self, game):
+        actions = self._actions
+        if self.is_new:
+            actions = [eventlog.creation_action(game)] + actions
+        if not actions:
+            return
+        seq = (self.version or 0) + 1
+        eventlog.append(game.id, seq, actions)
+        self.version = seq
+        self._actions = []
+        if self.is_new or eventlog.should_snapshot(game, seq, self._loaded_round):
+            eventlog.write_snapshot(game, seq)
+        self.is_new = False
+        self._loaded_round = game.round_number
 
     def __enter__(self):
+        self._outer_messages = getattr(_outbox, 'messages', None)
+        _outbox.messages = []
+        self._transition = metrics.phase("Transition")
+        self._transition.__enter__()
         return self.game
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._transition.__exit__(exc_type, exc_val, exc_tb)
+        messages, _outbox.messages = _outbox.messages, self._outer_messages
         if exc_type is not None:
-            pass  # Don't save the game state if an exception occurred
+            # Don't save the game state if an exception occurred, nor keep a cached copy it may have changed
+            game_cache.invalidate(self.game.id)
+            return
         self.save()
+        with metrics.phase("Publish"):
+            _send_all(messages)
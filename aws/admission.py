@@ -0,0 +1,218 @@
+"""
+Submodule for admission control in front of the handlers.
+
+Before a handler touches any game state, its invocation must be
+admitted by:
+
+- a per-container cap of GROUPWEAVE_MAX_CONCURRENCY (default 32)
+  invocations in progress at once; invocations over the cap are shed
+  straight away rather than queued
+- a token bucket per game id, refilled at GROUPWEAVE_GAME_RATE actions
+  per second (default 50) up to GROUPWEAVE_GAME_BURST (default 200)
+- a token bucket per caller token, refilled at GROUPWEAVE_CALLER_RATE
+  (default 5) up to GROUPWEAVE_CALLER_BURST (default 20)
+- a token bucket per source IP, refilled at GROUPWEAVE_SOURCE_RATE
+  (default 20) up to GROUPWEAVE_SOURCE_BURST (default 60)
+
+Tokens are only checked once the game is loaded, so a caller could
+make up a new token for every call. The source's bucket is charged for
+every action, with or without a token, before the game's bucket, so
+made up or missing tokens cannot spend the game's tokens. Buckets of
+callers are keyed on a digest of their token, so the table never holds
+a token that could be used to act for a player.
+
+Buckets are kept in the groupweave_rate_limits table, so limits hold
+across containers. Each bucket is stored as its theoretical arrival
+time (the generic cell rate algorithm), so an admission is decided by
+one conditional write, or two for a busy bucket, without reading it
+first. A container that has seen a bucket reject remembers it for one
+refill interval and rejects further calls without a write, so abusive
+callers cost little capacity. Rejections raise RejectedError at once.
+
+If the limiter table cannot be reached, invocations are admitted: an
+outage of the limiter should not become an outage of every game.
+
+Every bucket an invocation is charged to costs a conditional write, so
+an admitted action costs two or three writes (its caller, its source
+and its game) before the handler does any work, more than saving the
+game itself. Admission control is therefore off unless
+GROUPWEAVE_ADMISSION is set to 1, e.g. while a deployment is being
+abused or load tested.
+"""
+import os
+import sys
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+import metrics
+from aws import clients, dynamo, idempotency
+
+ENABLED = os.environ.get("GROUPWEAVE_ADMISSION", "0") == "1"
+MAX_CONCURRENCY = int(os.environ.get("GROUPWEAVE_MAX_CONCURRENCY", "32"))
+GAME_RATE = float(os.environ.get("GROUPWEAVE_GAME_RATE", "50"))
+GAME_BURST = int(os.environ.get("GROUPWEAVE_GAME_BURST", "200"))
+CALLER_RATE = float(os.environ.get("GROUPWEAVE_CALLER_RATE", "5"))
+CALLER_BURST = int(os.environ.get("GROUPWEAVE_CALLER_BURST", "20"))
+SOURCE_RATE = float(os.environ.get("GROUPWEAVE_SOURCE_RATE", "20"))
+SOURCE_BURST = int(os.environ.get("GROUPWEAVE_SOURCE_BURST", "60"))
+# Remembered rejections are dropped once there are this many, so they cannot grow without bound
+_MAX_BLOCKED = 10000
+
+_RATE_LIMIT_TABLE = clients.table('groupweave_rate_limits')
+
+_in_flight = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_blocked_lock = threading.Lock()
+_blocked_until = {}
+
+
+class RejectedError(StandardError):
+    """
+    Raised when an invocation is not admitted; the caller may retry after 'retry_after' seconds
+    """
+
+    def __init__(self, reason, retry_after):
+        super(RejectedError, self).__init__("{}, retry after {:.2f}s".format(reason, retry_after))
+        self.retry_after = retry_after
+
+
+class TokenBucket(object):
+    """
+    A rate limit shared by every container, stored as the theoretical
+    arrival time (in milliseconds) of the next action at the limited rate
+    """
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.interval_ms = 1000.0 / rate
+        self.burst = burst
+
+    def _update(self, update, condition, values):
+        try:
+            dynamo._record_call(_RATE_LIMIT_TABLE.update_item(
+                Key={
+                    'limit_key': self.key
+                },
+                UpdateExpression=update,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+                **dynamo._capacity_args()
+            ))
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def take(self, cost=1, now=None):
+        """
+        Take 'cost' tokens from the bucket
+        :return: 0 if they were taken, or else how many seconds to wait before trying again
+        """
+        now_ms = int((time.time() if now is None else now) * 1000)
+        charge = int(self.interval_ms * cost)
+        expires_at = now_ms // 1000 + int(self.burst * self.interval_ms / 1000) + 60
+        # A bucket whose arrival time has passed is full
+        if self._update("SET tat = :tat, expires_at = :expires_at",
+                        "attribute_not_exists(tat) OR tat <= :now",
+                        {':tat': now_ms + charge, ':expires_at': expires_at, ':now': now_ms}):
+            return 0
+        # Otherwise its arrival time moves on, unless that would take it past the burst.
+        # Arrival times only ever move forward, so this cannot find the bucket full again.
+        if self._update("SET tat = tat + :charge, expires_at = :expires_at",
+                        "tat > :now AND tat <= :latest",
+                        {':charge': charge, ':expires_at': expires_at, ':now': now_ms,
+                         ':latest': now_ms + int(self.burst * self.interval_ms) - charge}):
+            return 0
+        return charge / 1000.0
+
+
+def _remembered_rejection(key, now):
+    with _blocked_lock:
+        until = _blocked_until.get(key)
+        if until is not None and until <= now:
+            del _blocked_until[key]
+            until = None
+    return until - now if until is not None else 0
+
+
+def _remember_rejection(key, until):
+    with _blocked_lock:
+        if len(_blocked_until) >= _MAX_BLOCKED:
+            _blocked_until.clear()
+        _blocked_until[key] = until
+
+
+def _buckets(event):
+    """
+    :return: a list of (bucket, cost) the event must take tokens from
+    """
+    buckets = []
+    actions = event.get("actions") or [event]
+    callers = {}
+    for action in actions:
+        if action.get("token"):
+            digest = idempotency.caller_digest(action)
+            callers[digest] = callers.get(digest, 0) + 1
+    for digest, count in sorted(callers.items()):
+        buckets.append((TokenBucket("caller:{}".format(digest), CALLER_RATE, CALLER_BURST), count))
+    source = event.get("requestContext", {}).get("identity", {}).get("sourceIp")
+    if source:
+        buckets.append((TokenBucket("source:{}".format(source), SOURCE_RATE, SOURCE_BURST), len(actions)))
+    # The game's bucket comes last, so an abusive caller is turned away before it spends the game's tokens
+    if event.get("gameId"):
+        buckets.append((TokenBucket("game:{}".format(event["gameId"]), GAME_RATE, GAME_BURST), len(actions)))
+    return buckets
+
+
+class Admission(object):
+    """
+    Context manager around the body of a handler, entered before any
+    game state is read. Raises RejectedError if the invocation is
+    not admitted.
+    """
+
+    def __init__(self, handler, event, limit=True):
+        self.handler = handler
+        self.buckets = _buckets(event) if limit and ENABLED else []
+        self._holding = False
+
+    def __enter__(self):
+        if not ENABLED:
+            return self
+        if not _in_flight.acquire(False):
+            metrics.increment("Shed")
+            raise RejectedError("Server is busy", 1.0)
+        self._holding = True
+        try:
+            with metrics.phase("Admission"):
+                self._take_tokens(time.time())
+        except:
+            self._release()
+            raise
+        return self
+
+    def _take_tokens(self, now):
+        for bucket, cost in self.buckets:
+            wait = _remembered_rejection(bucket.key, now)
+            if not wait:
+                try:
+                    wait = bucket.take(cost, now)
+                except Exception as e:
+                    metrics.increment("AdmissionErrors")
+                    print >> sys.stderr, "Admitting {} without rate limiting: {}".format(self.handler, e)
+                    return
+                if wait:
+                    _remember_rejection(bucket.key, now + wait)
+            if wait:
+                metrics.increment("RateLimited")
+                raise RejectedError("Too many requests for {}".format(bucket.key.partition(":")[0]), wait)
+
+    def _release(self):
+        if self._holding:
+            self._holding = False
+            _in_flight.release()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._release()
@@ -0,0 +1,63 @@
+"""
+Submodule for the S3 blob store that large game items and messages
+are offloaded to (see payload.py). Blobs are content-addressed, so
+writing the same payload twice stores it once.
+
+The store is used by setting GROUPWEAVE_BLOB_BUCKET. Without it, game
+items and messages over their limit are refused rather than offloaded,
+as no other container, nor the clients reading the queues, could read
+blobs kept in a container's own directory.
+
+A store remembers the keys it has written or found, and checks whether
+any other key exists before uploading it, so a blob is uploaded once
+however many times it is packed.
+"""
+import hashlib
+import os
+
+from botocore.exceptions import ClientError
+
+import payload
+from aws import clients
+
+BLOB_BUCKET = os.environ.get("GROUPWEAVE_BLOB_BUCKET")
+BLOB_PREFIX = "blobs/"
+# Remembered keys are dropped once there are this many, so they cannot grow without bound
+_MAX_KNOWN = 10000
+
+s3 = clients.client('s3')
+
+
+class S3BlobStore(object):
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._known = set()
+
+    def put(self, data):
+        """
+        :return: the key of the blob, which is the SHA-256 digest of its data
+        """
+        key = hashlib.sha256(data).hexdigest()
+        if key not in self._known:
+            if not self._exists(key):
+                s3.put_object(Bucket=self.bucket, Key=BLOB_PREFIX + key, Body=data)
+            if len(self._known) >= _MAX_KNOWN:
+                self._known.clear()
+            self._known.add(key)
+        return key
+
+    def _exists(self, key):
+        try:
+            s3.head_object(Bucket=self.bucket, Key=BLOB_PREFIX + key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+
+    def get(self, key):
+        return s3.get_object(Bucket=self.bucket, Key=BLOB_PREFIX + key)['Body'].read()
+
+
+if BLOB_BUCKET:
+    payload.set_blob_store(S3BlobStore(BLOB_BUCKET))
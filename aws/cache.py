@@ -0,0 +1,80 @@
+"""
+In-container cache of decoded games, so that a warm
+container handling consecutive calls for the same game
+can skip fetching and unpickling it
+"""
+import collections
+import os
+import threading
+import time
+
+CACHE_SIZE = int(os.environ.get("GROUPWEAVE_GAME_CACHE_SIZE", "64"))
+CACHE_TTL_SECONDS = float(os.environ.get("GROUPWEAVE_GAME_CACHE_TTL", "300"))
+
+
+class GameCache(object):
+    """
+    Bounded LRU cache of game id -> (game, version), whose
+    entries also expire a fixed time after they were stored.
+
+    Cached games must be validated against the stored version
+    before use; the cache itself knows nothing about DynamoDB.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl_seconds=CACHE_TTL_SECONDS, clock=time.time):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def get(self, game_id):
+        """
+        :return: the cached (game, version) for this game id, or None
+        """
+        with self._lock:
+            entry = self._entries.pop(game_id, None)
+            if entry is None:
+                return None
+            game, version, stored_at = entry
+            if self._clock() - stored_at > self.ttl_seconds:
+                self.evictions += 1
+                return None
+            self._entries[game_id] = entry
+            return game, version
+
+    def put(self, game_id, game, version):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries.pop(game_id, None)
+            self._entries[game_id] = (game, version, self._clock())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, game_id):
+        with self._lock:
+            self._entries.pop(game_id, None)
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, stale=False):
+        with self._lock:
+            self.misses += 1
+            if stale:
+                self.stale += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'stale': self.stale, 'evictions': self.evictions}
+
+
+game_cache = GameCache()
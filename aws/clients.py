@@ -0,0 +1,150 @@
+"""
+Submodule that builds the boto3 clients used by the other submodules.
+
+All clients come from one shared session, with one client per
+service, so connections and the adaptive retry rate limiter are shared
+by every caller in the container. Clients are tuned for fanning out
+many small calls at once:
+
+- GROUPWEAVE_AWS_POOL_SIZE (default 50) connections are kept alive
+  per service, enough for every thread of a fan-out to have its own
+- retries use botocore's adaptive mode, which backs off on throttling
+  and rate limits the client instead of hammering a hot partition,
+  up to GROUPWEAVE_AWS_MAX_ATTEMPTS (default 5) attempts per call
+- GROUPWEAVE_AWS_CONNECT_TIMEOUT and GROUPWEAVE_AWS_READ_TIMEOUT
+  (default 2 and 5 seconds) bound each attempt, rather than botocore's
+  default of 60 seconds
+
+Clients and tables are only built when first used, so importing the
+aws package needs neither credentials nor a region. Retried and
+throttled attempts are counted per process (see counters) and, when
+metrics are enabled, per invocation as AwsRetries and AwsThrottles.
+"""
+import collections
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+import metrics
+
+POOL_SIZE = int(os.environ.get("GROUPWEAVE_AWS_POOL_SIZE", "50"))
+MAX_ATTEMPTS = int(os.environ.get("GROUPWEAVE_AWS_MAX_ATTEMPTS", "5"))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("GROUPWEAVE_AWS_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT_SECONDS = float(os.environ.get("GROUPWEAVE_AWS_READ_TIMEOUT", "5"))
+
+# Error codes botocore's retry handlers treat as throttling
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled', 'SlowDown'
+])
+
+CONFIG = Config(
+    max_pool_connections=POOL_SIZE,
+    connect_timeout=CONNECT_TIMEOUT_SECONDS,
+    read_timeout=READ_TIMEOUT_SECONDS,
+    retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS}
+)
+
+_lock = threading.RLock()
+_session = None
+_clients = {}
+_resources = {}
+_counters = collections.Counter()
+
+
+def _count(name, value=1):
+    with _lock:
+        _counters[name] += value
+    metrics.increment(name, value)
+
+
+def _on_needs_retry(response=None, **kwargs):
+    """
+    Count each throttled attempt, whether or not it is retried
+    """
+    if response is not None:
+        error_code = response[1].get('Error', {}).get('Code')
+        if error_code in THROTTLING_ERROR_CODES:
+            _count("AwsThrottles")
+
+
+def _on_after_call(parsed=None, **kwargs):
+    retries = (parsed or {}).get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    if retries:
+        _count("AwsRetries", retries)
+
+
+def session():
+    """
+    :return: the boto3 session shared by all clients
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+            _session.events.register('needs-retry', _on_needs_retry)
+            _session.events.register('after-call', _on_after_call)
+        return _session
+
+
+def _config(overrides):
+    return CONFIG.merge(Config(**overrides)) if overrides else CONFIG
+
+
+def _client(service_name, overrides):
+    key = (service_name, tuple(sorted(overrides.items())))
+    with _lock:
+        if key not in _clients:
+            _clients[key] = session().client(service_name, config=_config(overrides))
+        return _clients[key]
+
+
+def _resource(service_name):
+    with _lock:
+        if service_name not in _resources:
+            _resources[service_name] = session().resource(service_name, config=CONFIG)
+        return _resources[service_name]
+
+
+class _Lazy(object):
+    """
+    Stands in for a client or table, building it when it is first used
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._target = None
+
+    def __getattr__(self, name):
+        if self._target is None:
+            with _lock:
+                if self._target is None:
+                    self._target = self._build()
+        return getattr(self._target, name)
+
+
+def client(service_name, **overrides):
+    """
+    :param overrides: botocore Config options that differ from the shared ones,
+                      e.g. a longer read_timeout for long polling
+    :return: a lazily built client for the given service
+    """
+    return _Lazy(lambda: _client(service_name, overrides))
+
+
+def table(table_name):
+    """
+    :return: a lazily built DynamoDB Table
+    """
+    return _Lazy(lambda: _resource('dynamodb').Table(table_name))
+
+
+def counters():
+    """
+    :return: a dict of the retries and throttles counted since the process started
+    """
+    with _lock:
+        return {name: _counters[name] for name in ("AwsRetries", "AwsThrottles")}
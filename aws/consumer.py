@@ -0,0 +1,136 @@
+"""
+Reference consumer of the events sent to a participant's queue.
+
+The queue is long polled for up to RECEIVE_BATCH messages at a time,
+and the messages of each receive that decode are deleted with a single
+batch request, so a busy queue costs two requests per ten events and an
+idle one a request every WAIT_SECONDS. A message that does not decode
+is counted and left on the queue, to be received again once its
+visibility timeout has passed or moved to a dead letter queue.
+
+SQS may deliver a message more than once, and not in the order it was
+sent. Every event sent to a participant's queue is numbered, counting
+from 1 (see aws.BasePlayer), so the consumer drops events it has
+already delivered and holds back an event until the ones before it
+have been delivered. An event that never arrives is given up on once
+the events after it have been held back for GAP_SECONDS. Events
+without a number are delivered as they arrive.
+
+Example:
+
+    consumer = QueueConsumer(created["queueUrl"])
+    for event in consumer.events():
+        ...
+"""
+import time
+
+from aws import clients
+from events import from_json
+
+# The most messages SQS returns, and deletes, in one request
+RECEIVE_BATCH = 10
+# The longest SQS holds a receive open waiting for messages
+WAIT_SECONDS = 20
+# How long events are held back for a missing event before it is given up on
+GAP_SECONDS = 30
+
+sqs = clients.client('sqs', read_timeout=WAIT_SECONDS + 10)
+
+
+class QueueConsumer(object):
+    """
+    Receives the events sent to one queue, in order and without duplicates
+    """
+
+    def __init__(self, queue_url, next_seq=1, wait_seconds=WAIT_SECONDS, gap_seconds=GAP_SECONDS, clock=time.time):
+        """
+        :param next_seq: the number of the first event to deliver, e.g. to resume
+                         after the events a previous consumer delivered
+        :param clock: function returning the current time in seconds
+        """
+        self.queue_url = queue_url
+        self.next_seq = next_seq
+        self.wait_seconds = wait_seconds
+        self.gap_seconds = gap_seconds
+        self.clock = clock
+        self._held = {}
+        self._held_since = None
+        self.requests = 0
+        self.received = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.malformed = 0
+
+    def poll(self):
+        """
+        Receive a batch of messages, waiting up to wait_seconds for one to
+        arrive, and delete the ones that decode
+        :return: a list of the events that can now be delivered, in order
+        """
+        response = sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=RECEIVE_BATCH,
+            WaitTimeSeconds=self.wait_seconds
+        )
+        self.requests += 1
+        messages = response.get('Messages', [])
+        self.received += len(messages)
+        events = []
+        decoded = []
+        for message in messages:
+            try:
+                events.append(from_json(message['Body']))
+            except (ValueError, KeyError, TypeError):
+                self.malformed += 1
+                continue
+            decoded.append(message)
+        if decoded:
+            sqs.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(n), 'ReceiptHandle': message['ReceiptHandle']}
+                         for n, message in enumerate(decoded)]
+            )
+            self.requests += 1
+        return self.deliver(events)
+
+    def deliver(self, events):
+        """
+        Hold back the given events until the events before them have been delivered
+        :return: a list of the events that can now be delivered, in order
+        """
+        ready = []
+        for event in events:
+            if event.seq is None:
+                ready.append(event)
+            elif event.seq < self.next_seq or event.seq in self._held:
+                self.duplicates += 1
+            else:
+                self._held[event.seq] = event
+        ready.extend(self._release())
+        if not self._held:
+            self._held_since = None
+        elif self._held_since is None:
+            self._held_since = self.clock()
+        elif self.clock() - self._held_since >= self.gap_seconds:
+            # Give up on the missing events, and carry on from the first one held
+            first = min(self._held)
+            self.skipped += first - self.next_seq
+            self.next_seq = first
+            ready.extend(self._release())
+            self._held_since = self.clock() if self._held else None
+        return ready
+
+    def _release(self):
+        released = []
+        while self.next_seq in self._held:
+            released.append(self._held.pop(self.next_seq))
+            self.next_seq += 1
+        return released
+
+    def events(self):
+        """
+        :return: a generator of the events sent to the queue, polling for more as needed
+        """
+        while True:
+            for event in self.poll():
+                yield event
@@ -0,0 +1,127 @@
+"""
+Submodule for the index of pending round deadlines.
+
+Deadlines are stored in the groupweave_round_deadlines table, keyed by
+the minute they fall due (due_bucket) and the game id, so a periodic
+tick finds everything due with one query per minute rather than a
+scan, however many games are waiting. A game has at most one live
+deadline: the table also keeps, under SCHEDULED_BUCKET, the minute of
+each game's current deadline, so that rescheduling a game removes the
+deadline it was waiting on before. Deadlines that are left behind
+anyway, e.g. by a failed write, are recognised as stale by their phase
+and round, and are removed when they fall due.
+"""
+import os
+import time
+
+import metrics
+from aws import clients, dynamo
+from game import round_deadline
+
+BUCKET_SECONDS = 60
+# How many minutes back each tick looks, to pick up deadlines missed by late or failed ticks
+LOOKBACK_BUCKETS = int(os.environ.get("GROUPWEAVE_DEADLINE_LOOKBACK", "30"))
+
+# The partition of the items that point at each game's current deadline; no deadline falls due in it
+SCHEDULED_BUCKET = -1
+
+_DEADLINE_TABLE = clients.table('groupweave_round_deadlines')
+
+
+def _bucket(timestamp):
+    return int(timestamp // BUCKET_SECONDS)
+
+
+def deadline_key(game):
+    """
+    :return: the (phase, round) of the deadline the game is waiting on, or None
+    """
+    deadline = round_deadline(game)
+    return (deadline.phase, deadline.round) if deadline is not None else None
+
+
+def schedule(game, now=None):
+    """
+    Record the deadline the game is now waiting on, if any,
+    and remove the one it was waiting on before
+    """
+    deadline = round_deadline(game)
+    if deadline is None:
+        unschedule(game.id)
+        return
+    due_at = (time.time() if now is None else now) + deadline.seconds
+    with metrics.phase("DynamoWrite"):
+        dynamo._record_call(_DEADLINE_TABLE.put_item(
+            Item={
+                'due_bucket': _bucket(due_at),
+                'game_id': game.id,
+                'due_at': int(due_at),
+                'phase': deadline.phase,
+                'round_number': deadline.round
+            },
+            **dynamo._capacity_args()
+        ))
+        response = dynamo._record_call(_DEADLINE_TABLE.put_item(
+            Item={
+                'due_bucket': SCHEDULED_BUCKET,
+                'game_id': game.id,
+                'scheduled_bucket': _bucket(due_at)
+            },
+            ReturnValues='ALL_OLD',
+            **dynamo._capacity_args()
+        ))
+        _remove_previous(game.id, response, _bucket(due_at))
+
+
+def unschedule(game_id):
+    """
+    Remove the deadline a game is waiting on, if any
+    """
+    with metrics.phase("DynamoWrite"):
+        response = dynamo._record_call(_DEADLINE_TABLE.delete_item(
+            Key={
+                'due_bucket': SCHEDULED_BUCKET,
+                'game_id': game_id
+            },
+            ReturnValues='ALL_OLD',
+            **dynamo._capacity_args()
+        ))
+        _remove_previous(game_id, response, None)
+
+
+def _remove_previous(game_id, response, due_bucket):
+    previous = response.get('Attributes', {}).get('scheduled_bucket')
+    if previous is not None and int(previous) != due_bucket:
+        remove({'due_bucket': int(previous), 'game_id': game_id})
+
+
+def due(now=None):
+    """
+    Iterate over the deadlines that have fallen due, oldest minute first
+    """
+    now = time.time() if now is None else now
+    current = _bucket(now)
+    for bucket in range(current - LOOKBACK_BUCKETS, current + 1):
+        query_args = {}
+        while True:
+            response = dynamo._record_call(_DEADLINE_TABLE.query(
+                KeyConditionExpression="due_bucket = :bucket",
+                ExpressionAttributeValues={':bucket': bucket},
+                **dict(query_args, **dynamo._capacity_args())
+            ))
+            for item in response['Items']:
+                if int(item['due_at']) <= now:
+                    yield item
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def remove(item):
+    dynamo._record_call(_DEADLINE_TABLE.delete_item(
+        Key={
+            'due_bucket': item['due_bucket'],
+            'game_id': item['game_id']
+        },
+        **dynamo._capacity_args()
+    ))
@@ -1,20 +1,82 @@
 """
 Submodule for interacting with DynamoDB
 """
+import json
+import os
 import pickle
 import random
 import string
-
-import boto3
 import time
 
-from game import CompleteGame
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
 
-dynamodb = boto3.resource('dynamodb')
+import metrics
+import payload
+from aws import clients
+from game import CompleteGame, state_view
 
-_GAME_STATE_TABLE = dynamodb.Table('groupweave_game_state')
+_GAME_STATE_TABLE = clients.table('groupweave_game_state')
+_GAME_VIEW_TABLE = clients.table('groupweave_game_views')
 GAME_ID_LENGTH = 4
 GAME_AGE_THRESHOLD_SECONDS = 5 * 60 * 60
+# DynamoDB items are limited to 400 KB; leave room for the key and the other attributes
+_MAX_GAME_STATE_BYTES = 384 * 1024
+# Whether every save also stores the game's read projection (see save_view), at the cost of a second write
+VIEWS_ENABLED = os.environ.get("GROUPWEAVE_GAME_VIEWS") == "1"
+
+
+def _capacity_args():
+    """
+    Ask DynamoDB to report consumed capacity only while metrics are being recorded
+    """
+    return {'ReturnConsumedCapacity': 'TOTAL'} if metrics.recording() else {}
+
+
+def _record_call(response):
+    metrics.increment("DynamoCalls")
+    capacity = response.get('ConsumedCapacity')
+    if capacity:
+        metrics.increment("DynamoCapacityUnits", capacity['CapacityUnits'])
+    return response
+
+
+def _dump_game(game):
+    """
+    :return: the game's state as a binary attribute value; packed states
+             are not text, so boto3 could not store them as strings
+    """
+    with metrics.phase("Pickle"):
+        game_state = payload.pack(pickle.dumps(game), _MAX_GAME_STATE_BYTES, shared=True)
+    metrics.increment("GameItemBytes", len(game_state), metrics.BYTES)
+    return Binary(game_state)
+
+
+def _game_state_bytes(game_state):
+    # boto3 returns binary attributes wrapped in a Binary, and games stored
+    # before their state was binary as the unicode of a string attribute
+    game_state = getattr(game_state, 'value', game_state)
+    if isinstance(game_state, unicode):
+        return game_state.encode('utf-8')
+    return game_state
+
+
+def _load_game_state(game_state):
+    """
+    Unpickle a stored game, fetching it from the blob store if it was offloaded
+    """
+    with metrics.phase("Unpickle"):
+        return pickle.loads(payload.unpack(_game_state_bytes(game_state)))
+
+
+class ConcurrentModificationError(StandardError):
+    """
+    Raised when a game could not be saved because it was
+    modified by somebody else since it was loaded
+    """
+
+    def __init__(self, game_id):
+        super(ConcurrentModificationError, self).__init__("Game {} was modified concurrently".format(game_id))
 
 
 class GameIdGenerator(object):
@@ -24,14 +86,24 @@ class GameIdGenerator(object):
     """
 
     def new_id(self):
-        response = _GAME_STATE_TABLE.scan(
-            ProjectionExpression="game_id"
-        )
-        existing_ids = set([item["game_id"] for item in response['Items']])
-        game_id = self.random_word(GAME_ID_LENGTH)
-        while game_id in existing_ids:
+        return self.new_ids(1)[0]
+
+    def new_ids(self, count):
+        """
+        :return: 'count' distinct new game ids, from a single scan of the existing ones
+        """
+        response = _record_call(_GAME_STATE_TABLE.scan(
+            ProjectionExpression="game_id",
+            **_capacity_args()
+        ))
+        taken_ids = set([item["game_id"] for item in response['Items']])
+        game_ids = []
+        while len(game_ids) < count:
             game_id = self.random_word(GAME_ID_LENGTH)
-        return game_id
+            if game_id not in taken_ids:
+                taken_ids.add(game_id)
+                game_ids.append(game_id)
+        return game_ids
 
     @staticmethod
     def random_word(length):
@@ -39,52 +111,214 @@ class GameIdGenerator(object):
 
 
 def create_game(game):
-    _GAME_STATE_TABLE.put_item(
-        Item={
-            'game_id': game.id,
-            'game_state': pickle.dumps(game),
-            'last_modified': int(time.time())
-        }
-    )
+    """
+    :return: the version of the newly stored game
+    """
+    game_state = _dump_game(game)
+    with metrics.phase("DynamoWrite"):
+        _record_call(_GAME_STATE_TABLE.put_item(
+            Item={
+                'game_id': game.id,
+                'game_state': game_state,
+                'game_version': 1,
+                'last_modified': int(time.time())
+            },
+            **_capacity_args()
+        ))
+    return 1
+
+
+def create_games(games):
+    """
+    Store several new games, and their read projections if VIEWS_ENABLED, with batched writes
+    :return: the version of the newly stored games
+    """
+    last_modified = int(time.time())
+    tables = 2 if VIEWS_ENABLED else 1
+    with metrics.phase("DynamoWrite"):
+        with _GAME_STATE_TABLE.batch_writer() as batch:
+            for game in games:
+                batch.put_item(Item={
+                    'game_id': game.id,
+                    'game_state': _dump_game(game),
+                    'game_version': 1,
+                    'last_modified': last_modified
+                })
+        if VIEWS_ENABLED:
+            with _GAME_VIEW_TABLE.batch_writer() as batch:
+                for game in games:
+                    batch.put_item(Item=_view_item(game, 1))
+    # Batch writes send up to 25 items per call
+    metrics.increment("DynamoCalls", tables * ((len(games) + 24) // 25))
+    return 1
 
 
 def load_game(game_id):
-    response = _GAME_STATE_TABLE.get_item(
-        Key={
-            'game_id': game_id
-        }
-    )
-    return pickle.loads(response['Item']['game_state'])
+    return load_versioned_game(game_id)[0]
 
 
-def save_game(game):
-    _GAME_STATE_TABLE.update_item(
-        Key={
-            'game_id': game.id
-        },
-        UpdateExpression="SET game_state = :game_state, last_modified=:last_modified",
-        ExpressionAttributeValues={
-            ':game_state': pickle.dumps(game),
-            ':last_modified': int(time.time())
-        }
-    )
+def load_versioned_game(game_id):
+    """
+    :return: a tuple of the stored game and its version
+    """
+    with metrics.phase("DynamoGetItem"):
+        response = _record_call(_GAME_STATE_TABLE.get_item(
+            Key={
+                'game_id': game_id
+            },
+            ConsistentRead=True,
+            **_capacity_args()
+        ))
+    item = response['Item']
+    game_state = item['game_state']
+    metrics.increment("GameItemBytes", len(_game_state_bytes(game_state)), metrics.BYTES)
+    return _load_game_state(game_state), int(item.get('game_version', 0))
+
+
+def load_game_version(game_id):
+    """
+    Read only the version of a stored game, which is much
+    cheaper to transfer than the game itself
+    :return: the version, or None if there is no such game
+    """
+    with metrics.phase("DynamoGetVersion"):
+        response = _record_call(_GAME_STATE_TABLE.get_item(
+            Key={
+                'game_id': game_id
+            },
+            ProjectionExpression="game_version",
+            ConsistentRead=True,
+            **_capacity_args()
+        ))
+    if 'Item' not in response:
+        return None
+    return int(response['Item'].get('game_version', 0))
+
+
+def save_game(game, expected_version=None):
+    """
+    Save a game, incrementing its version
+    :param expected_version: if given, only save if the stored game still has this version
+    :return: the new version of the game
+    :raises: ConcurrentModificationError if the stored version was not the expected one
+    """
+    game_state = _dump_game(game)
+    new_version = (expected_version or 0) + 1
+    condition_args = {}
+    values = {
+        ':game_state': game_state,
+        ':game_version': new_version,
+        ':last_modified': int(time.time())
+    }
+    if expected_version is not None:
+        condition_args['ConditionExpression'] = (
+            "game_version = :expected_version" if expected_version
+            else "attribute_not_exists(game_version)")
+        if expected_version:
+            values[':expected_version'] = expected_version
+    with metrics.phase("DynamoWrite"):
+        try:
+            _record_call(_GAME_STATE_TABLE.update_item(
+                Key={
+                    'game_id': game.id
+                },
+                UpdateExpression="SET game_state = :game_state, game_version = :game_version, "
+                                 "last_modified=:last_modified",
+                ExpressionAttributeValues=values,
+                **dict(condition_args, **_capacity_args())
+            ))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise ConcurrentModificationError(game.id)
+            raise
+    return new_version
+
+
+def save_view(game, version):
+    """
+    Store the read projection of a game in its own small item,
+    so that clients polling for game state never read the game itself.
+    A projection is never replaced by one of an older version.
+    Only used when VIEWS_ENABLED.
+    """
+    with metrics.phase("DynamoWrite"):
+        try:
+            _record_call(_GAME_VIEW_TABLE.put_item(
+                Item=_view_item(game, version),
+                ConditionExpression="attribute_not_exists(game_version) OR game_version < :game_version",
+                ExpressionAttributeValues={':game_version': version},
+                **_capacity_args()
+            ))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def _view_item(game, version):
+    view = json.dumps(state_view(game), separators=(',', ':'))
+    metrics.increment("GameViewBytes", len(view), metrics.BYTES)
+    return {
+        'game_id': game.id,
+        'game_view': view,
+        'game_version': version
+    }
+
+
+def load_view_version(game_id):
+    """
+    Read only the version of a game's stored read projection
+    :raises: KeyError if there is no such game
+    """
+    with metrics.phase("DynamoGetView"):
+        response = _record_call(_GAME_VIEW_TABLE.get_item(
+            Key={
+                'game_id': game_id
+            },
+            ProjectionExpression="game_version",
+            **_capacity_args()
+        ))
+    return int(response['Item']['game_version'])
+
+
+def load_view(game_id):
+    """
+    :return: a tuple of the stored read projection of a game (as a JSON string) and its version
+    :raises: KeyError if there is no such game
+    """
+    with metrics.phase("DynamoGetView"):
+        response = _record_call(_GAME_VIEW_TABLE.get_item(
+            Key={
+                'game_id': game_id
+            },
+            **_capacity_args()
+        ))
+    item = response['Item']
+    return item['game_view'], int(item['game_version'])
 
 
 def delete_game(game):
-    _GAME_STATE_TABLE.delete_item(
+    _record_call(_GAME_STATE_TABLE.delete_item(
         Key={
             'game_id': game.id
-        }
-    )
+        },
+        **_capacity_args()
+    ))
+    _record_call(_GAME_VIEW_TABLE.delete_item(
+        Key={
+            'game_id': game.id
+        },
+        **_capacity_args()
+    ))
     return game.id
 
 
 def get_old_or_finished_games():
-    response = _GAME_STATE_TABLE.scan(
-        ProjectionExpression="game_id,game_state,last_modified"
-    )
+    response = _record_call(_GAME_STATE_TABLE.scan(
+        ProjectionExpression="game_id,game_state,last_modified",
+        **_capacity_args()
+    ))
     now = int(time.time())
-    all_games = [(pickle.loads(item["game_state"]), item["last_modified"]) for item in response["Items"]]
+    all_games = [(_load_game_state(item["game_state"]), item["last_modified"]) for item in response["Items"]]
     result = filter(lambda (game, last_modified): (now - last_modified) > GAME_AGE_THRESHOLD_SECONDS
                                                 or isinstance(game, CompleteGame),
                     all_games)
@@ -0,0 +1,257 @@
+"""
+Submodule for event-sourced game persistence.
+
+When GROUPWEAVE_PERSISTENCE is set to "events", every GameWrapper
+scope appends one small record of the actions it applied (joins,
+start, prompts, choices, expired deadlines) to the
+groupweave_game_events table, instead of rewriting the whole
+pickled game. A snapshot of the game is only
+written to the game state table every SNAPSHOT_EVERY records and at
+round boundaries; loading a game replays the records written since
+its latest snapshot, with notifications muted.
+
+Records are numbered by a per-game sequence number, which doubles as
+the game's version: appending is conditional on the sequence number
+being unused, so concurrent writers cannot both succeed.
+"""
+import json
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+import aws
+import metrics
+from aws import clients, dynamo
+from events import Prompt, ChoosePrompt
+from game import CompleteGame, CreatedGame, NotificationManager, PlayerJoined, NewPrompts, Done, now, replayed_at
+from gameutil import GameReference
+
+ENABLED = os.environ.get("GROUPWEAVE_PERSISTENCE", "snapshot") == "events"
+SNAPSHOT_EVERY = int(os.environ.get("GROUPWEAVE_SNAPSHOT_EVERY", "20"))
+
+_GAME_EVENTS_TABLE = clients.table('groupweave_game_events')
+
+
+def _participant_record(participant):
+    return {'name': participant.name, 'token': participant.token.hex, 'queue': participant.queueUrl}
+
+
+def _participant(participant_class, record, game=None):
+    if participant_class is aws.Spectator:
+        participant = aws.Spectator(uuid.UUID(record['token']))
+    else:
+        participant = participant_class(record['name'], uuid.UUID(record['token']))
+    participant.use_queue(game, record['queue'])
+    return participant
+
+
+def encode_action(method_name, args):
+    """
+    Encode a game method call as a compact action record
+    :return: the action as a dict, or None if the call does not change game state
+    """
+    if method_name == "register_player":
+        return dict(_participant_record(args[0]), a="join")
+    if method_name == "register_spectator":
+        return dict(_participant_record(args[0]), a="spectate")
+    if method_name == "start":
+        return {'a': "start", 't': _timestamp()}
+    if method_name == "receive_prompt":
+        return {'a': "prompt", 'player': args[0]["player"], 'prompt': args[0]["prompt"]}
+    if method_name == "choose_prompt":
+        return {'a': "choose", 'choice': args[0]["choice"], 't': _timestamp()}
+    if method_name in ("close_round", "choose_default"):
+        return {'a': method_name, 't': _timestamp()}
+    return None
+
+
+def _timestamp():
+    # Transitions that end rounds are timed, so that replaying them gives the same statistics
+    return round(now(), 3)
+
+
+def creation_action(game):
+    """
+    :return: the action that starts the record of a new game
+    """
+    return dict(_participant_record(game.host), a="create")
+
+
+def should_snapshot(game, seq, loaded_round):
+    """
+    Snapshot every SNAPSHOT_EVERY records, whenever a round ends
+    and when the game is complete, so that cleanup can find it
+    """
+    return (seq % SNAPSHOT_EVERY == 0
+            or game.round_number != loaded_round
+            or isinstance(game, CompleteGame))
+
+
+def apply_action(game_reference, action):
+    """
+    Re-apply a recorded action to a game, without notifying anybody
+    """
+    with game_reference.game._notification_manager.muted(), replayed_at(action.get('t')):
+        kind = action['a']
+        if kind == "join":
+            game_reference.register_player(_participant(aws.Player, action, game_reference))
+        elif kind == "spectate":
+            game_reference.register_spectator(_participant(aws.Spectator, action, game_reference))
+        elif kind == "start":
+            game_reference.start()
+        elif kind == "prompt":
+            game_reference.receive_prompt(Prompt(action['prompt'], action['player']))
+        elif kind == "choose":
+            game_reference.choose_prompt(ChoosePrompt(action['choice']))
+        elif kind in ("close_round", "choose_default"):
+            getattr(game_reference, kind)()
+        else:
+            raise ValueError("Unknown action {}".format(kind))
+
+
+def new_game(game_id, host_record):
+    """
+    Recreate a game exactly as it was created, from its creation record
+    """
+    host = _participant(aws.Host, host_record)
+    notification_manager = NotificationManager()
+    notification_manager.subscribe(host, PlayerJoined, NewPrompts, Done)
+    return CreatedGame(host, game_id, notification_manager)
+
+
+def append(game_id, seq, actions):
+    """
+    Append the actions applied in one GameWrapper scope as record number 'seq'
+    :raises: dynamo.ConcurrentModificationError if that record already exists
+    """
+    payload = json.dumps(actions, separators=(',', ':'))
+    metrics.increment("GameEventBytes", len(payload), metrics.BYTES)
+    with metrics.phase("DynamoWrite"):
+        try:
+            dynamo._record_call(_GAME_EVENTS_TABLE.put_item(
+                Item={
+                    'game_id': game_id,
+                    'seq': seq,
+                    'actions': payload
+                },
+                ConditionExpression="attribute_not_exists(seq)",
+                **dynamo._capacity_args()
+            ))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise dynamo.ConcurrentModificationError(game_id)
+            raise
+
+
+def create_games(games):
+    """
+    Store the creation records and first snapshots of several new games with batched writes
+    :return: the sequence number of the newly stored games
+    """
+    with metrics.phase("DynamoWrite"):
+        with _GAME_EVENTS_TABLE.batch_writer() as batch:
+            for game in games:
+                batch.put_item(Item={
+                    'game_id': game.id,
+                    'seq': 1,
+                    'actions': json.dumps([creation_action(game)], separators=(',', ':'))
+                })
+    metrics.increment("DynamoCalls", (len(games) + 24) // 25)
+    # The first snapshot of a game is stored just as a new game is in snapshot mode
+    return dynamo.create_games(games)
+
+
+def records_after(game_id, seq):
+    """
+    :return: a list of (seq, actions) for every record after 'seq', in order
+    """
+    records = []
+    query_args = {}
+    with metrics.phase("DynamoQuery"):
+        while True:
+            response = dynamo._record_call(_GAME_EVENTS_TABLE.query(
+                KeyConditionExpression="game_id = :game_id AND seq > :seq",
+                ExpressionAttributeValues={':game_id': game_id, ':seq': seq},
+                ConsistentRead=True,
+                **dict(query_args, **dynamo._capacity_args())
+            ))
+            records.extend((int(item['seq']), json.loads(item['actions'])) for item in response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return records
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def write_snapshot(game, seq):
+    """
+    Store a snapshot of the game as of record 'seq', unless a newer one exists
+    """
+    game_state = dynamo._dump_game(game)
+    with metrics.phase("DynamoWrite"):
+        try:
+            dynamo._record_call(dynamo._GAME_STATE_TABLE.update_item(
+                Key={
+                    'game_id': game.id
+                },
+                UpdateExpression="SET game_state = :game_state, game_version = :seq, "
+                                 "last_modified = :last_modified",
+                ConditionExpression="attribute_not_exists(game_version) OR game_version < :seq",
+                ExpressionAttributeValues={
+                    ':game_state': game_state,
+                    ':seq': seq,
+                    ':last_modified': int(time.time())
+                },
+                **dynamo._capacity_args()
+            ))
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def catch_up(game, seq):
+    """
+    Apply any records written after 'seq' to a game
+    :return: a tuple of the up-to-date game and its sequence number
+    """
+    reference = GameReference(game)
+    for record_seq, actions in records_after(game.id, seq):
+        for action in actions:
+            apply_action(reference, action)
+        seq = record_seq
+    return reference.game, seq
+
+
+def load_game(game_id):
+    """
+    Load the latest snapshot of a game and replay the records written since
+    :return: a tuple of the game and its sequence number
+    """
+    game, seq = dynamo.load_versioned_game(game_id)
+    with metrics.phase("Replay"):
+        return catch_up(game, seq)
+
+
+def rebuild_game(game_id):
+    """
+    Replay a game from its very first record, ignoring snapshots
+    :return: a tuple of the game and its sequence number
+    """
+    records = records_after(game_id, 0)
+    if not records or records[0][1][0]['a'] != "create":
+        raise ValueError("No creation record for game {}".format(game_id))
+    reference = None
+    seq = 0
+    for seq, actions in records:
+        for action in actions:
+            if action['a'] == "create":
+                reference = GameReference(new_game(game_id, action))
+            else:
+                apply_action(reference, action)
+    return reference.game, seq
+
+
+def delete_records(game_id):
+    with _GAME_EVENTS_TABLE.batch_writer() as batch:
+        for seq, _ in records_after(game_id, 0):
+            batch.delete_item(Key={'game_id': game_id, 'seq': seq})
@@ -0,0 +1,89 @@
+"""
+Submodule for global gameplay statistics.
+
+Each game keeps its own statistics (see game.GameStats), stored with
+its state. Whenever a game is saved, what its statistics gained since
+it was loaded is added to global counters, so that dashboards can read
+them without scanning games.
+
+The counters are kept in the groupweave_game_stats table, split over
+GROUPWEAVE_STATS_SHARDS (default 8) items so that busy games do not
+all write the same item. Each save adds to one shard, picked at
+random, with a single atomic update; reading the counters reads every
+shard. Statistics are best effort: a failed update is counted as
+StatsErrors rather than failing a save that has already happened.
+"""
+import os
+import random
+import sys
+
+import metrics
+from aws import clients, dynamo
+
+SHARDS = int(os.environ.get("GROUPWEAVE_STATS_SHARDS", "8"))
+
+_STATS_TABLE = clients.table('groupweave_game_stats')
+
+
+def add(counters):
+    """
+    Add to the global counters
+    :param counters: a dict of counter name -> amount to add
+    """
+    counters = sorted((name, value) for name, value in counters.items() if value)
+    if not counters:
+        return
+    try:
+        with metrics.phase("DynamoWrite"):
+            dynamo._record_call(_STATS_TABLE.update_item(
+                Key={
+                    'shard': random.randrange(SHARDS)
+                },
+                UpdateExpression="ADD " + ", ".join("#{} :{}".format(name, name) for name, _ in counters),
+                ExpressionAttributeNames={'#' + name: name for name, _ in counters},
+                ExpressionAttributeValues={':' + name: value for name, value in counters},
+                **dynamo._capacity_args()
+            ))
+    except Exception as e:
+        metrics.increment("StatsErrors")
+        print >> sys.stderr, "Could not update game statistics: {}".format(e)
+
+
+def totals():
+    """
+    :return: a dict of counter name -> total over all shards
+    """
+    result = {}
+    with metrics.phase("DynamoRead"):
+        for shard in range(SHARDS):
+            item = dynamo._record_call(_STATS_TABLE.get_item(
+                Key={
+                    'shard': shard
+                },
+                **dynamo._capacity_args()
+            )).get('Item', {})
+            for name, value in item.items():
+                if name != 'shard':
+                    result[name] = result.get(name, 0) + int(value)
+    return result
+
+
+def summary(counters):
+    """
+    Derive the figures dashboards show from the global counters
+    :return: a JSON-serializable dict
+    """
+    def ratio(numerator, denominator, scale=1.0):
+        if not counters.get(denominator):
+            return None
+        return round(counters.get(numerator, 0) / scale / counters[denominator], 3)
+
+    return {
+        'totals': counters,
+        'averageRoundSeconds': ratio('RoundMillis', 'Rounds', 1000.0),
+        'promptsPerPlayer': ratio('Prompts', 'Players'),
+        'promptsPerRound': ratio('Prompts', 'Rounds'),
+        'chosenPromptRate': ratio('PromptsChosen', 'Prompts'),
+        'defaultChoiceRate': ratio('DefaultChoices', 'Rounds'),
+        'completionRate': ratio('GamesCompleted', 'GamesStarted')
+    }
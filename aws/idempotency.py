@@ -0,0 +1,153 @@
+"""
+Submodule for making retried handler invocations idempotent.
+
+A caller may include an "idempotencyKey" in a handler event. The first
+invocation with a given key claims it with a conditional put, and its
+response is stored under the key for GROUPWEAVE_IDEMPOTENCY_TTL seconds
+(default 600). Retries within that time get the stored response back
+without loading or saving the game. Failed invocations release their
+claim, so they can be retried.
+
+Keys are scoped to the caller: to a digest of the token the event
+carries or, for requests made before the caller has one, of the name
+(or host names) and the source IP, so that callers who happen to use
+the same key never get each other's responses.
+"""
+import hashlib
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+import metrics
+from aws import clients, dynamo
+
+TTL_SECONDS = int(os.environ.get("GROUPWEAVE_IDEMPOTENCY_TTL", "600"))
+CLAIM_SECONDS = 30
+
+_IDEMPOTENCY_TABLE = clients.table('groupweave_idempotency')
+
+
+class RequestInProgressError(StandardError):
+    """
+    Raised when a request is retried while the original is still in progress
+    """
+
+    def __init__(self, key):
+        super(RequestInProgressError, self).__init__("Request {} is already in progress".format(key))
+
+
+def _load_response(key, now):
+    """
+    :return: a tuple of whether a response is stored for the key, and the response
+    """
+    response = dynamo._record_call(_IDEMPOTENCY_TABLE.get_item(
+        Key={
+            'idempotency_key': key
+        },
+        ConsistentRead=True,
+        **dynamo._capacity_args()
+    ))
+    item = response.get('Item')
+    # Expired items may linger until DynamoDB's TTL sweep removes them
+    if item is None or 'response' not in item or int(item['expires_at']) < now:
+        return False, None
+    return True, json.loads(item['response'])
+
+
+def _claim(key, now):
+    """
+    :raises: RequestInProgressError if somebody else holds an unexpired claim on the key
+    """
+    try:
+        dynamo._record_call(_IDEMPOTENCY_TABLE.put_item(
+            Item={
+                'idempotency_key': key,
+                'claimed_until': now + CLAIM_SECONDS,
+                'expires_at': now + TTL_SECONDS
+            },
+            ConditionExpression="attribute_not_exists(idempotency_key) "
+                                "OR expires_at < :now OR claimed_until < :now",
+            ExpressionAttributeValues={':now': now},
+            **dynamo._capacity_args()
+        ))
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            raise RequestInProgressError(key)
+        raise
+
+
+def _store_response(key, response, now):
+    dynamo._record_call(_IDEMPOTENCY_TABLE.update_item(
+        Key={
+            'idempotency_key': key
+        },
+        UpdateExpression="SET response = :response, claimed_until = :expires_at, expires_at = :expires_at",
+        ExpressionAttributeValues={
+            ':response': json.dumps(response),
+            ':expires_at': now + TTL_SECONDS
+        },
+        **dynamo._capacity_args()
+    ))
+
+
+def _release(key):
+    dynamo._record_call(_IDEMPOTENCY_TABLE.delete_item(
+        Key={
+            'idempotency_key': key
+        },
+        **dynamo._capacity_args()
+    ))
+
+
+def caller_digest(event):
+    """
+    :return: a digest identifying the caller of a handler event
+    """
+    if event.get("token"):
+        identity = ["token", event["token"]]
+    else:
+        source = event.get("requestContext", {}).get("identity", {}).get("sourceIp")
+        identity = [event.get("name"), event.get("hosts"), source]
+    return hashlib.sha256(json.dumps(identity)).hexdigest()[:32]
+
+
+class IdempotentRequest(object):
+    """
+    Context manager around the body of a handler. If the event carries
+    an idempotency key that has already been answered, 'replayed' is
+    True and 'response' is the original response, which the handler
+    should return straight away. Otherwise the handler should set
+    'response' to what it returns; it is stored when the body
+    completes, after the game has been saved.
+    """
+
+    def __init__(self, handler, event):
+        self.key = None
+        if event.get("idempotencyKey"):
+            self.key = "{}:{}:{}:{}".format(handler, event.get("gameId", ""), caller_digest(event),
+                                            event["idempotencyKey"])
+        self.replayed = False
+        self.response = None
+
+    def __enter__(self):
+        if self.key is None:
+            return self
+        with metrics.phase("Idempotency"):
+            now = int(time.time())
+            self.replayed, self.response = _load_response(self.key, now)
+            if self.replayed:
+                metrics.increment("IdempotentReplays")
+            else:
+                _claim(self.key, now)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.key is None or self.replayed:
+            return
+        with metrics.phase("Idempotency"):
+            if exc_type is None:
+                _store_response(self.key, self.response, int(time.time()))
+            else:
+                _release(self.key)
@@ -0,0 +1,346 @@
+"""
+In-memory stand-ins for the AWS services used by the
+game backend, so handlers can be exercised locally
+(load tests, replays) without touching real AWS
+"""
+import collections
+import itertools
+import re
+import threading
+import time
+from StringIO import StringIO
+
+from botocore.exceptions import ClientError
+
+import payload
+
+from aws import admission, blobs, consumer, deadlines, dynamo, eventlog, gamestats, idempotency, s3archive, sqs
+
+# The bucket of the local S3 stand-in that large payloads are offloaded to
+LOCAL_BLOB_BUCKET = "groupweave-local-blobs"
+
+_CONDITION_CLAUSE = re.compile(r"^(attribute_exists|attribute_not_exists)\((\w+)\)$|^(\w+)\s*(=|<|<=|>|>=)\s*(:\w+)$")
+
+_COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b
+}
+
+
+def _parse_assignments(expression, values, item, names=None):
+    """
+    Parse a 'SET a = :a, b=:b, c = c + :c' or 'ADD a :a, #b :b' style
+    update expression into a dict of attribute name -> new value
+    """
+    action, _, assignments = expression.strip().partition(" ")
+    if action.upper() == "ADD":
+        result = {}
+        for assignment in assignments.split(","):
+            name, value = assignment.split()
+            name = (names or {}).get(name, name)
+            result[name] = item.get(name, 0) + values[value]
+        return result
+    if action.upper() != "SET":
+        raise ValueError("Unsupported update expression: {}".format(expression))
+    result = {}
+    for assignment in assignments.split(","):
+        name, value = [part.strip() for part in assignment.split("=")]
+        operand, _, increment = [part.strip() for part in value.partition("+")]
+        if increment:
+            result[name] = item[operand] + values[increment]
+        else:
+            result[name] = values[value]
+    return result
+
+
+def _condition_holds(item, expression, values):
+    """
+    Evaluate a condition expression made of attribute_exists(a),
+    attribute_not_exists(a) and comparison (a < :a) clauses joined by
+    OR, where each alternative may be several clauses joined by AND
+    """
+    return any(_key_conditions_hold(item, alternative, values) for alternative in expression.split(" OR "))
+
+
+def _clause_holds(item, clause, values):
+    match = _CONDITION_CLAUSE.match(clause.strip())
+    if match is None:
+        raise ValueError("Unsupported condition: {}".format(clause))
+    function, function_arg, name, operator, value_ref = match.groups()
+    if function == "attribute_exists":
+        return item is not None and function_arg in item
+    if function == "attribute_not_exists":
+        return item is None or function_arg not in item
+    return item is not None and name in item and _COMPARISONS[operator](item[name], values[value_ref])
+
+
+def _key_conditions_hold(item, expression, values):
+    """
+    Evaluate a key condition expression of comparisons joined by AND
+    """
+    return all(_clause_holds(item, clause, values) for clause in expression.split(" AND "))
+
+
+def _check_condition(item, expression, values, operation):
+    if expression is not None and not _condition_holds(item, expression, values or {}):
+        raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                     'Message': 'The conditional request failed'}}, operation)
+
+
+def _project(item, projection):
+    if projection is None:
+        return dict(item)
+    names = [name.strip() for name in projection.split(",")]
+    return {name: item[name] for name in names if name in item}
+
+
+def _returned(old, return_values):
+    if return_values == 'ALL_OLD' and old is not None:
+        return {'Attributes': dict(old)}
+    return {}
+
+
+class LocalTable(object):
+    """
+    Thread-safe, in-memory stand-in for a boto3 DynamoDB Table
+    with a hash key and an optional range key
+    """
+
+    def __init__(self, name, hash_key, range_key=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self._items = {}
+        self._partitions = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def _key(self, key):
+        if self.range_key is None:
+            return key[self.hash_key]
+        return key[self.hash_key], key[self.range_key]
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            _check_condition(self._items.get(self._key(Item)), ConditionExpression,
+                             ExpressionAttributeValues, 'PutItem')
+            old = self._items.get(self._key(Item))
+            self._items[self._key(Item)] = dict(Item)
+            self._partitions[Item[self.hash_key]].add(self._key(Item))
+        return _returned(old, kwargs.get('ReturnValues'))
+
+    def get_item(self, Key, ProjectionExpression=None, **kwargs):
+        with self._lock:
+            item = self._items.get(self._key(Key))
+            if item is None:
+                return {}
+            return {'Item': _project(item, ProjectionExpression)}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None,
+                    ExpressionAttributeNames=None, **kwargs):
+        with self._lock:
+            _check_condition(self._items.get(self._key(Key)), ConditionExpression,
+                             ExpressionAttributeValues, 'UpdateItem')
+            item = self._items.setdefault(self._key(Key), dict(Key))
+            item.update(_parse_assignments(UpdateExpression, ExpressionAttributeValues, item,
+                                           ExpressionAttributeNames))
+            self._partitions[Key[self.hash_key]].add(self._key(Key))
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._lock:
+            old = self._items.pop(self._key(Key), None)
+            self._partitions[Key[self.hash_key]].discard(self._key(Key))
+        return _returned(old, kwargs.get('ReturnValues'))
+
+    def scan(self, ProjectionExpression=None, **kwargs):
+        with self._lock:
+            return {'Items': [_project(item, ProjectionExpression) for item in self._items.values()]}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, ProjectionExpression=None,
+              ScanIndexForward=True, **kwargs):
+        partition = self._partition(KeyConditionExpression, ExpressionAttributeValues)
+        with self._lock:
+            items = [self._items[key] for key in self._partitions.get(partition, ())
+                     if _key_conditions_hold(self._items[key], KeyConditionExpression, ExpressionAttributeValues)]
+        items.sort(key=lambda item: item.get(self.range_key), reverse=not ScanIndexForward)
+        return {'Items': [_project(item, ProjectionExpression) for item in items]}
+
+    def _partition(self, expression, values):
+        """
+        Queries must name exactly one partition, as they must in DynamoDB
+        """
+        for clause in expression.split(" AND "):
+            match = _CONDITION_CLAUSE.match(clause.strip())
+            if match is not None and match.group(3) == self.hash_key and match.group(4) == '=':
+                return values[match.group(5)]
+        raise ValueError("Key condition must test {} for equality: {}".format(self.hash_key, expression))
+
+    def batch_writer(self):
+        return _LocalBatchWriter(self)
+
+
+class _LocalBatchWriter(object):
+    def __init__(self, table):
+        self.table = table
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class LocalQueueService(object):
+    """
+    Thread-safe, in-memory stand-in for a boto3 SQS client
+    """
+
+    URL_PREFIX = "local://sqs/"
+
+    def __init__(self):
+        self._queues = {}
+        self._in_flight = {}
+        self._receipts = itertools.count()
+        self._lock = threading.Lock()
+        self._arrived = threading.Condition(self._lock)
+        self.receive_calls = 0
+
+    def create_queue(self, QueueName, **kwargs):
+        queue_url = self.URL_PREFIX + QueueName
+        with self._lock:
+            self._queues.setdefault(queue_url, collections.deque())
+        return {'QueueUrl': queue_url}
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        with self._lock:
+            self._queues[QueueUrl].append(MessageBody)
+            self._arrived.notify_all()
+        return {}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, **kwargs):
+        messages = []
+        with self._lock:
+            self.receive_calls += 1
+            queue = self._queues[QueueUrl]
+            if not queue and WaitTimeSeconds:
+                # Long polling: wait for a message to arrive, as SQS does
+                deadline = time.time() + WaitTimeSeconds
+                while not queue and time.time() < deadline:
+                    self._arrived.wait(deadline - time.time())
+            while queue and len(messages) < MaxNumberOfMessages:
+                receipt = str(next(self._receipts))
+                body = queue.popleft()
+                self._in_flight[receipt] = (QueueUrl, body)
+                messages.append({'ReceiptHandle': receipt, 'Body': body})
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle, **kwargs):
+        with self._lock:
+            self._in_flight.pop(ReceiptHandle, None)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries, **kwargs):
+        with self._lock:
+            for entry in Entries:
+                self._in_flight.pop(entry['ReceiptHandle'], None)
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries]}
+
+    def delete_queue(self, QueueUrl, **kwargs):
+        with self._lock:
+            self._queues.pop(QueueUrl, None)
+        return {}
+
+    def drain(self, queue_url):
+        """
+        Remove and return every message body currently in a queue
+        """
+        with self._lock:
+            queue = self._queues.get(queue_url, collections.deque())
+            bodies = list(queue)
+            queue.clear()
+        return bodies
+
+
+class LocalObjectStore(object):
+    """
+    Thread-safe, in-memory stand-in for the parts of a boto3 S3 client we use
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        with self._lock:
+            self._objects[(Bucket, Key)] = Body
+        return {}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        with self._lock:
+            body = self._objects[(Bucket, Key)]
+        if Range is not None:
+            start, end = [int(part) for part in Range[len("bytes="):].split("-")]
+            body = body[start:end + 1]
+        return {'Body': StringIO(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            body = self._objects.get((Bucket, Key))
+        if body is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': len(body)}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        with self._lock:
+            keys = sorted(key for bucket, key in self._objects if bucket == Bucket and key.startswith(Prefix))
+        return {'Contents': [{'Key': key} for key in keys], 'IsTruncated': False}
+
+
+class LocalBackend(object):
+    """
+    The full set of local stand-ins used in place of AWS
+    """
+
+    def __init__(self):
+        self.game_state_table = LocalTable('groupweave_game_state', 'game_id')
+        self.game_events_table = LocalTable('groupweave_game_events', 'game_id', 'seq')
+        self.game_view_table = LocalTable('groupweave_game_views', 'game_id')
+        self.idempotency_table = LocalTable('groupweave_idempotency', 'idempotency_key')
+        self.archive_index_table = LocalTable('groupweave_game_archive', 'game_id')
+        self.deadline_table = LocalTable('groupweave_round_deadlines', 'due_bucket', 'game_id')
+        self.rate_limit_table = LocalTable('groupweave_rate_limits', 'limit_key')
+        self.game_stats_table = LocalTable('groupweave_game_stats', 'shard')
+        self.s3 = LocalObjectStore()
+        self.sqs = LocalQueueService()
+
+
+def install():
+    """
+    Replace the AWS clients used by the aws submodules
+    with fresh local stand-ins
+    :return: the installed LocalBackend
+    """
+    backend = LocalBackend()
+    dynamo._GAME_STATE_TABLE = backend.game_state_table
+    dynamo._GAME_VIEW_TABLE = backend.game_view_table
+    eventlog._GAME_EVENTS_TABLE = backend.game_events_table
+    idempotency._IDEMPOTENCY_TABLE = backend.idempotency_table
+    s3archive._ARCHIVE_INDEX_TABLE = backend.archive_index_table
+    s3archive.s3 = backend.s3
+    blobs.s3 = backend.s3
+    payload.set_blob_store(blobs.S3BlobStore(LOCAL_BLOB_BUCKET))
+    deadlines._DEADLINE_TABLE = backend.deadline_table
+    admission._RATE_LIMIT_TABLE = backend.rate_limit_table
+    gamestats._STATS_TABLE = backend.game_stats_table
+    sqs.sqs = backend.sqs
+    consumer.sqs = backend.sqs
+    return backend
@@ -0,0 +1,94 @@
+"""
+Submodule for archiving completed games to S3.
+
+Each cleanup run writes the games it archives as one immutable segment
+object, keyed by date so that a day's games can be streamed by listing
+a prefix. The groupweave_game_archive table indexes each game's record
+by id, so a single story is read with one ranged GET.
+
+Archiving is enabled by setting GROUPWEAVE_ARCHIVE_BUCKET.
+"""
+import os
+import time
+import uuid
+
+import archive
+import metrics
+from aws import clients, dynamo
+
+ARCHIVE_BUCKET = os.environ.get("GROUPWEAVE_ARCHIVE_BUCKET")
+ENABLED = bool(ARCHIVE_BUCKET)
+SEGMENT_PREFIX = "segments/"
+
+s3 = clients.client('s3')
+
+_ARCHIVE_INDEX_TABLE = clients.table('groupweave_game_archive')
+
+
+def archive_games(games, archived_at=None):
+    """
+    Archive completed games as a single new segment
+    :return: the ids of the archived games
+    """
+    if not games:
+        return []
+    archived_at = time.time() if archived_at is None else archived_at
+    name = "{}{}/{}-{}.gz".format(SEGMENT_PREFIX, archive.archive_date(archived_at),
+                                  int(archived_at * 1000), uuid.uuid4().hex)
+    writer = archive.SegmentWriter(name)
+    entries = [writer.add(archive.game_record(game, archived_at)) for game in games]
+    segment = writer.getvalue()
+    metrics.increment("ArchiveBytes", len(segment), metrics.BYTES)
+    with metrics.phase("Archive"):
+        s3.put_object(Bucket=ARCHIVE_BUCKET, Key=name, Body=segment)
+        # The index is written last, so it never points at a missing segment
+        with _ARCHIVE_INDEX_TABLE.batch_writer() as batch:
+            for entry in entries:
+                batch.put_item(Item={
+                    'game_id': entry['gameId'],
+                    'archived_on': entry['date'],
+                    'segment': entry['segment'],
+                    'record_offset': entry['offset'],
+                    'record_length': entry['length']
+                })
+    return [entry['gameId'] for entry in entries]
+
+
+def load_archived_game(game_id):
+    """
+    :return: the archived record of a game, or None if it was not archived
+    """
+    item = dynamo._record_call(_ARCHIVE_INDEX_TABLE.get_item(
+        Key={
+            'game_id': game_id
+        },
+        **dynamo._capacity_args()
+    )).get('Item')
+    if item is None:
+        return None
+    start = int(item['record_offset'])
+    end = start + int(item['record_length']) - 1
+    response = s3.get_object(Bucket=ARCHIVE_BUCKET, Key=item['segment'], Range="bytes={}-{}".format(start, end))
+    return archive.decode_record(response['Body'].read())
+
+
+def _segment_keys(prefix):
+    list_args = {}
+    while True:
+        response = s3.list_objects_v2(Bucket=ARCHIVE_BUCKET, Prefix=prefix, **list_args)
+        for obj in response.get('Contents', []):
+            yield obj['Key']
+        if not response.get('IsTruncated'):
+            return
+        list_args['ContinuationToken'] = response['NextContinuationToken']
+
+
+def stream_archived_games(date=None):
+    """
+    Iterate over archived records, oldest segment first
+    :param date: only games archived on this YYYY-MM-DD date, if given
+    """
+    for key in _segment_keys(SEGMENT_PREFIX + (date + "/" if date else "")):
+        body = s3.get_object(Bucket=ARCHIVE_BUCKET, Key=key)['Body']
+        for record in archive.iter_records(body):
+            yield record
@@ -1,9 +1,30 @@
 """
 Submodule for interacting with SQS
 """
-import boto3
+import metrics
+from aws import clients
 
-sqs = boto3.client('sqs')
+sqs = clients.client('sqs')
+
+# SQS rejects messages over 256 KB; leave room for the type and trace around packed properties
+_MAX_PACKED_BYTES = 248 * 1024
+
+
+def queue_suffix(token):
+    """
+    :return: the part of the URL of a participant's queue that comes from its token
+    """
+    return str(token)
+
+
+def queue_prefix(queue_url, token):
+    """
+    :return: the part of the URL of a participant's queue shared with the other participants of its game
+    """
+    suffix = queue_suffix(token)
+    if not queue_url.endswith(suffix):
+        raise ValueError("{} is not the queue of {}".format(queue_url, token))
+    return queue_url[:-len(suffix)]
 
 
 def create_queue(game_id, token):
@@ -11,22 +32,30 @@ def create_queue(game_id, token):
     Create an SQS queue for the given game id and token
     :return: the URL for the new queue
     """
-    queue_name = "groupweave-{}-{}".format(game_id, token)
-    response = sqs.create_queue(
-        QueueName=queue_name
-    )
+    queue_name = "groupweave-{}-{}".format(game_id, queue_suffix(token))
+    with metrics.phase("SqsCreateQueue"):
+        response = sqs.create_queue(
+            QueueName=queue_name
+        )
+    metrics.increment("SqsCalls")
     return response["QueueUrl"]
 
 
 def send_message(queue_url, event):
     """
-    Send an event as a message to an SQS queue
+    Send an event as a message to an SQS queue, packing
+    the properties of large events
+    :raises: payload.PayloadTooLargeError if the event is too large to send
+             and no blob store is configured
     """
-    eventJson = event.toJson()
-    sqs.send_message(
-        QueueUrl=queue_url,
-        MessageBody=eventJson
-    )
+    eventJson = event.toJson(_MAX_PACKED_BYTES, shared=True)
+    with metrics.phase("SqsSend"):
+        sqs.send_message(
+            QueueUrl=queue_url,
+            MessageBody=eventJson
+        )
+    metrics.increment("SqsCalls")
+    metrics.increment("MessageBytes", len(eventJson), metrics.BYTES)
 
 
 def delete_queue(queue_url):
@@ -36,4 +65,5 @@ def delete_queue(queue_url):
     Assuming the request succeeds, returns the queue url
     """
     sqs.delete_queue(QueueUrl=queue_url)
+    metrics.increment("SqsCalls")
     return queue_url
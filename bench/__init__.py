@@ -0,0 +1,3 @@
+"""
+Load testing and benchmarking tools for the Groupweave backend
+"""
@@ -0,0 +1,132 @@
+"""
+Benchmark of prompt moderation with a large blocklist.
+
+A round of generated prompts, some of them containing blocked terms,
+is moderated by the blocklist stage (see moderation.py) and, for
+comparison, by looping over a regular expression per term and by a
+single regular expression of every term. All three must mask the same
+prompts the same way.
+
+    python -m bench.blocklist --terms 10000 --prompts 500
+"""
+import argparse
+import json
+import random
+import re
+import string
+import sys
+import timeit
+
+from moderation import BlocklistStage, Matcher
+
+
+def generate_terms(rng, count):
+    terms = set()
+    while len(terms) < count:
+        terms.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10))))
+    return sorted(terms)
+
+
+def generate_prompts(rng, terms, count, words=12, blocked_fraction=0.1):
+    """
+    :return: a dict of player name -> prompt, where about blocked_fraction of the prompts contain a term
+    """
+    prompts = {}
+    for n in range(count):
+        text = ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8)))
+                for _ in range(words)]
+        if rng.random() < blocked_fraction:
+            text[rng.randrange(words)] = rng.choice(terms)
+        prompts["Player {}".format(n)] = u" ".join(text)
+    return prompts
+
+
+class RegexLoop(object):
+    """
+    Masks terms by trying a regular expression for each in turn
+    """
+
+    def __init__(self, terms):
+        self.patterns = [re.compile(r"\b" + re.escape(term) + r"\b", re.IGNORECASE | re.UNICODE) for term in terms]
+
+    def __call__(self, prompts):
+        moderated = {}
+        for player, prompt in prompts.items():
+            for pattern in self.patterns:
+                prompt = pattern.sub(lambda match: u"*" * len(match.group(0)), prompt)
+            moderated[player] = prompt
+        return moderated
+
+
+class RegexAlternation(object):
+    """
+    Masks terms with a single regular expression of every term
+    """
+
+    def __init__(self, terms):
+        alternatives = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+        self.pattern = re.compile(r"\b(?:" + alternatives + r")\b", re.IGNORECASE | re.UNICODE)
+
+    def __call__(self, prompts):
+        return {player: self.pattern.sub(lambda match: u"*" * len(match.group(0)), prompt)
+                for player, prompt in prompts.items()}
+
+
+def _best(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        result = func()
+        elapsed = timeit.default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(terms, prompts, repeat=3, seed=0):
+    """
+    :return: a dict of approach -> compile and per-round milliseconds
+    """
+    rng = random.Random(seed)
+    blocklist = generate_terms(rng, terms)
+    round_prompts = generate_prompts(rng, blocklist, prompts)
+    approaches = [
+        ("automaton", lambda: BlocklistStage(matcher=Matcher(blocklist))),
+        ("regex_alternation", lambda: RegexAlternation(blocklist)),
+        ("regex_loop", lambda: RegexLoop(blocklist))
+    ]
+    report = {}
+    expected = None
+    for name, compile_stage in approaches:
+        compile_seconds, stage = _best(compile_stage, 1)
+        round_seconds, moderated = _best(lambda: stage(round_prompts), repeat)
+        if expected is None:
+            expected = moderated
+        elif moderated != expected:
+            raise AssertionError("{} moderated the prompts differently".format(name))
+        report[name] = {'compile_ms': round(compile_seconds * 1000.0, 3),
+                        'round_ms': round(round_seconds * 1000.0, 3)}
+    report['masked_prompts'] = sum(expected[player] != round_prompts[player] for player in round_prompts)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark prompt moderation with a large blocklist")
+    parser.add_argument("--terms", type=int, default=10000)
+    parser.add_argument("--prompts", type=int, default=500, help="prompts per round")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = run(args.terms, args.prompts, args.repeat, args.seed)
+    print "{} terms, {} prompts per round, {} masked".format(args.terms, args.prompts, report['masked_prompts'])
+    for name in ("automaton", "regex_alternation", "regex_loop"):
+        print "{:<20} compile {:>10.1f} ms   round {:>10.1f} ms".format(
+            name, report[name]['compile_ms'], report[name]['round_ms'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
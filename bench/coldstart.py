@@ -0,0 +1,194 @@
+"""
+Compares the cold start rate of deploying each handler as its own
+Lambda function with deploying them all behind handlers.dispatch.
+
+A local invoker replays a stream of handler invocations against pools
+of simulated containers: an invocation reuses an idle container of its
+function if one was used within the keep-alive period, and otherwise
+starts a new one, paying the cold start. The cold start defaults to
+the measured time a fresh interpreter takes to import the handlers.
+
+The invocations are either taken from a recording (see recording.py)
+or generated for --games games arriving at --rate games per minute,
+with advance_deadlines scheduled every --tick seconds:
+
+    python -m bench.coldstart --games 200 --rate 2 --players 5
+    python -m bench.coldstart --trace trace.jsonl.gz --keep-alive 300
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+
+import recording
+from game import TOTAL_ROUNDS
+
+ROUTED = "dispatch"
+
+
+class Container(object):
+    __slots__ = ('busy_until',)
+
+    def __init__(self, busy_until):
+        self.busy_until = busy_until
+
+
+class LocalInvoker(object):
+    """
+    Simulates the containers of Lambda functions. Each function has a
+    pool of containers that serve one invocation at a time and are
+    reclaimed once they have been idle for longer than keep_alive seconds.
+    """
+
+    def __init__(self, route, keep_alive, init_seconds):
+        """
+        :param route: function of handler name -> name of the function serving it
+        """
+        self.route = route
+        self.keep_alive = keep_alive
+        self.init_seconds = init_seconds
+        self.pools = {}
+        self.invocations = {}
+        self.cold_starts = {}
+        self.peak_containers = 0
+
+    def invoke(self, t, handler, seconds):
+        """
+        Invoke a handler at time t, for seconds
+        :return: whether the invocation was a cold start
+        """
+        pool = self.pools.setdefault(self.route(handler), [])
+        pool[:] = [container for container in pool if t - container.busy_until <= self.keep_alive]
+        idle = [container for container in pool if container.busy_until <= t]
+        self.invocations[handler] = self.invocations.get(handler, 0) + 1
+        if idle:
+            # Lambda favours the most recently used container, letting the others expire
+            max(idle, key=lambda container: container.busy_until).busy_until = t + seconds
+            return False
+        pool.append(Container(t + self.init_seconds + seconds))
+        self.cold_starts[handler] = self.cold_starts.get(handler, 0) + 1
+        self.peak_containers = max(self.peak_containers, sum(len(p) for p in self.pools.values()))
+        return True
+
+    def report(self):
+        total = sum(self.invocations.values())
+        cold = sum(self.cold_starts.values())
+        return {
+            'invocations': total,
+            'cold_starts': cold,
+            'cold_start_rate': round(float(cold) / total, 4) if total else None,
+            'peak_containers': self.peak_containers,
+            'handlers': {handler: {'invocations': count, 'cold_starts': self.cold_starts.get(handler, 0)}
+                         for handler, count in sorted(self.invocations.items())}
+        }
+
+
+def compare(invocations, keep_alive, init_seconds):
+    """
+    Replay invocations against a function per handler and against a single routed function
+    :param invocations: a list of (time, handler name, duration in seconds), ordered by time
+    :return: a dict of deployment -> LocalInvoker report
+    """
+    deployments = {
+        'per_handler': LocalInvoker(lambda handler: handler, keep_alive, init_seconds),
+        'routed': LocalInvoker(lambda handler: ROUTED, keep_alive, init_seconds)
+    }
+    for invoker in deployments.values():
+        for t, handler, seconds in invocations:
+            invoker.invoke(t, handler, seconds)
+    return {name: invoker.report() for name, invoker in deployments.items()}
+
+
+def trace_invocations(records):
+    """
+    :return: the handler invocations of a recording, as (time, handler name, duration in seconds)
+    """
+    return [(entry['t'], entry['h'], entry.get('ms', 0) / 1000.0)
+            for entry in records if entry['op'] == "handler"]
+
+
+def synthetic_invocations(rng, games, rate, players, think, duration, tick):
+    """
+    Generate the invocations of games arriving as a Poisson process,
+    each hosted by one client and played by players more
+    :param rate: games started per minute
+    :param think: mean pause, in seconds, before each client's action
+    :param duration: duration of every invocation, in seconds
+    :param tick: seconds between scheduled advance_deadlines invocations
+    """
+    invocations = []
+    pause = lambda: rng.expovariate(1.0 / think) if think > 0 else 0.0
+    t = 0.0
+    for _ in range(games):
+        t += rng.expovariate(rate / 60.0)
+        now = t
+        invocations.append((now, "create_game", duration))
+        joined = [now + pause() for _ in range(players)]
+        invocations.extend((at, "join_game", duration) for at in joined)
+        now = max(joined) + pause()
+        invocations.append((now, "start_game", duration))
+        for _ in range(TOTAL_ROUNDS):
+            submitted = [now + pause() for _ in range(players)]
+            invocations.extend((at, "submit_prompt", duration) for at in submitted)
+            now = max(submitted) + pause()
+            invocations.append((now, "choose_prompt", duration))
+    end = max(at for at, _, _ in invocations)
+    invocations.extend((n * tick, "advance_deadlines", duration) for n in range(int(end / tick) + 1))
+    invocations.sort()
+    return invocations
+
+
+def init_seconds():
+    """
+    :return: the time a fresh interpreter takes to import the handlers
+    """
+    output = subprocess.check_output([sys.executable, "-c",
+                                      "import timeit; start = timeit.default_timer(); import handlers; "
+                                      "print timeit.default_timer() - start"])
+    return float(output.strip().splitlines()[-1])
+
+
+def print_report(report, out=sys.stdout):
+    for name in ("per_handler", "routed"):
+        result = report[name]
+        print >> out, "{:<12} {:>6} invocations {:>5} cold starts ({:.2%}), at most {} containers".format(
+            name, result['invocations'], result['cold_starts'], result['cold_start_rate'] or 0,
+            result['peak_containers'])
+        for handler, counts in sorted(result['handlers'].items()):
+            print >> out, "    {:<20} {:>6} {:>5}".format(handler, counts['invocations'], counts['cold_starts'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare cold start rates of per-handler and routed deployments")
+    parser.add_argument("--trace", help="replay the invocations of a recording instead of generating them")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="games started per minute")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--think", type=float, default=20.0, help="mean seconds before each action")
+    parser.add_argument("--duration-ms", type=float, default=50.0, help="duration of generated invocations")
+    parser.add_argument("--tick", type=float, default=60.0, help="seconds between advance_deadlines invocations")
+    parser.add_argument("--keep-alive", type=float, default=600.0,
+                        help="seconds an idle container is kept before it is reclaimed")
+    parser.add_argument("--init-ms", type=float, help="cold start penalty; measured if not given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        invocations = trace_invocations(recording.read(args.trace))
+    else:
+        invocations = synthetic_invocations(random.Random(args.seed), args.games, args.rate, args.players,
+                                            args.think, args.duration_ms / 1000.0, args.tick)
+    init = args.init_ms / 1000.0 if args.init_ms is not None else init_seconds()
+    report = compare(invocations, args.keep_alive, init)
+    report['init_ms'] = round(init * 1000.0, 3)
+    print "Cold start of {:.1f} ms, containers kept for {:.0f} s".format(report['init_ms'], args.keep_alive)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""
+Load generator that plays many simulated games of Groupweave
+concurrently, either by invoking the Lambda handlers directly
+(against local stand-ins for AWS) or by connecting bot clients
+to the TCP command line server.
+
+Example:
+
+    python -m bench.loadtest --games 1000 --concurrency 16 --players 6 \\
+        --spectators 2 --think exp:0.05 --output results.json
+"""
+import argparse
+import json
+import Queue
+import random
+import socket
+import sys
+import threading
+import time
+import timeit
+import uuid
+
+import tracing
+from bench.stats import LatencyRecorder
+from cli import SERVER_PORT
+from events import from_json, Prompt, ChoosePrompt, StartGame
+from game import TOTAL_ROUNDS
+
+CREATED = "CREATED"
+WAIT_FOR_SUBMISSIONS = "WAIT_FOR_SUBMISSIONS"
+CHOOSING = "CHOOSING"
+GAME_COMPLETE = "GAME_COMPLETE"
+
+
+def transition(from_state, to_state):
+    return "{}->{}".format(from_state or "", to_state)
+
+
+class ThinkTime(object):
+    """
+    Distribution of the pause a bot takes before each action.
+
+    Specified as one of:
+        none, constant:SECONDS, uniform:LOW:HIGH, exp:MEAN
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        parts = spec.split(":")
+        kind, args = parts[0], [float(arg) for arg in parts[1:]]
+        if kind == "none" and not args:
+            self._sample = lambda rng: 0.0
+        elif kind == "constant" and len(args) == 1:
+            self._sample = lambda rng: args[0]
+        elif kind == "uniform" and len(args) == 2:
+            self._sample = lambda rng: rng.uniform(args[0], args[1])
+        elif kind == "exp" and len(args) == 1:
+            self._sample = lambda rng: rng.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+        else:
+            raise ValueError("Invalid think time: {}".format(spec))
+
+    def pause(self, rng):
+        seconds = self._sample(rng)
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class Results(object):
+    """
+    Latencies and outcomes collected over a load test run
+    """
+
+    def __init__(self):
+        self.actions = LatencyRecorder()
+        self.transitions = LatencyRecorder()
+        self.completed = 0
+        self.failures = []
+        self._lock = threading.Lock()
+
+    def timed(self, action, state_change, func, *args, **kwargs):
+        """
+        Call func, recording its latency against the given action
+        and (if not None) state transition
+        """
+        start = timeit.default_timer()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.actions.error(action)
+            if state_change is not None:
+                self.transitions.error(state_change)
+            raise
+        elapsed = timeit.default_timer() - start
+        self.actions.record(action, elapsed)
+        if state_change is not None:
+            self.transitions.record(state_change, elapsed)
+        return result
+
+    def game_completed(self):
+        with self._lock:
+            self.completed += 1
+
+    def game_failed(self, game_number, error):
+        with self._lock:
+            self.failures.append({'game': game_number, 'error': str(error)})
+
+
+class HandlerTarget(object):
+    """
+    Plays games by calling the functions in handlers.py directly,
+    with AWS replaced by in-memory stand-ins
+    """
+
+    def __init__(self):
+        import handlers
+        from aws import local
+        self.handlers = handlers
+        self.backend = local.install()
+        self.live_games = []
+
+    def _await(self, queue_url, event_type, config):
+        for body in self.backend.sqs.drain(queue_url):
+            event = from_json(body)
+            if event.type == event_type:
+                if config.trace_log:
+                    tracing.record_receipt(event, "host", path=config.trace_log)
+                return event
+        raise RuntimeError("{} was never delivered to {}".format(event_type, queue_url))
+
+    def play(self, rng, config, results):
+        handlers = self.handlers
+        created = json.loads(results.timed("create_game", transition(None, CREATED),
+                                           handlers.create_game, {"name": "Host"}, None))
+        game_id = created["gameId"]
+        host_token = created["hostToken"]
+        host_queue = created["queueUrl"]
+        self.live_games.append(game_id)
+
+        players = []
+        for i in range(config.players):
+            config.think.pause(rng)
+            joined = json.loads(results.timed("join_game", None, handlers.join_game,
+                                              {"name": "Bot {}".format(i), "gameId": game_id}, None))
+            players.append(joined)
+        spectator_queues = []
+        for i in range(config.spectators):
+            spectated = json.loads(results.timed("spectate_game", None, handlers.spectate_game,
+                                                 {"gameId": game_id}, None))
+            spectator_queues.append(spectated["queueUrl"])
+
+        config.think.pause(rng)
+        results.timed("start_game", transition(CREATED, WAIT_FOR_SUBMISSIONS), handlers.start_game,
+                      {"gameId": game_id, "token": host_token}, None)
+
+        for round_number in range(1, TOTAL_ROUNDS + 1):
+            order = list(players)
+            rng.shuffle(order)
+            submissions = [{"action": "submit_prompt", "token": player["playerToken"],
+                            "prompt": "Round {} prompt from {}".format(round_number, player["playerToken"][:6])}
+                           for player in order]
+            if config.batch:
+                config.think.pause(rng)
+                response = json.loads(results.timed("apply_actions", transition(WAIT_FOR_SUBMISSIONS, CHOOSING),
+                                                    handlers.apply_actions,
+                                                    {"gameId": game_id, "actions": submissions}, None))
+                errors = [result["error"] for result in response["results"] if not result["ok"]]
+                if errors:
+                    raise RuntimeError(errors[0])
+            else:
+                for i, submission in enumerate(submissions):
+                    config.think.pause(rng)
+                    is_last = i == len(submissions) - 1
+                    results.timed("submit_prompt", transition(WAIT_FOR_SUBMISSIONS, CHOOSING) if is_last else None,
+                                  handlers.submit_prompt, dict(submission, gameId=game_id), None)
+            prompts = self._await(host_queue, "NewPrompts", config)["prompts"]
+
+            config.think.pause(rng)
+            next_state = GAME_COMPLETE if round_number == TOTAL_ROUNDS else WAIT_FOR_SUBMISSIONS
+            results.timed("choose_prompt", transition(CHOOSING, next_state), handlers.choose_prompt,
+                          {"gameId": game_id, "token": host_token, "prompt": rng.choice(prompts)}, None)
+
+        story = self._await(host_queue, "Done", config)["story"]
+        for queue_url in [player["queueUrl"] for player in players] + spectator_queues:
+            self.backend.sqs.drain(queue_url)
+        self.live_games.remove(game_id)
+        return story
+
+    def abuse(self, rng, results, stop):
+        """
+        Submit prompts to random games in progress, as fast as possible
+        and with a token that is not a player's, until told to stop
+        """
+        token = uuid.uuid4().hex
+        while not stop.is_set():
+            if not self.live_games:
+                time.sleep(0.001)
+                continue
+            try:
+                results.timed("abuse", None, self.handlers.submit_prompt,
+                              {"gameId": rng.choice(self.live_games), "token": token, "prompt": "Spam"}, None)
+            except Exception:
+                pass  # Rejections are counted as errors of the abuse action
+
+
+class _LineClient(object):
+    """
+    Blocking client for the line-based protocol spoken by cli/server.py
+    """
+
+    def __init__(self, address, trace_log=None):
+        self.sock = socket.create_connection(address)
+        self.reader = self.sock.makefile('r')
+        self.name = None
+        self.trace_log = trace_log
+
+    def send(self, event):
+        if event.trace is None:
+            event.start_trace("client_send")
+        self.sock.sendall(event.toJson() + "\r\n")
+
+    def expect(self, event_type):
+        """
+        Read events until one of the given type arrives
+        """
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise RuntimeError("Connection closed while waiting for {}".format(event_type))
+            event = from_json(line.strip())
+            if event.type == event_type:
+                if self.trace_log:
+                    tracing.record_receipt(event, self.name, path=self.trace_log)
+                return event
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class TcpTarget(object):
+    """
+    Plays games by connecting bot clients to a running cli/server.py.
+
+    The server hosts a single game at a time, so each server
+    address can only be used by one game at a time.
+    """
+
+    HOST_RETRIES = 50
+
+    def __init__(self, address, trace_log=None):
+        self.address = address
+        self.trace_log = trace_log
+
+    def _connect_host(self):
+        # The server only starts a new game once every client of the
+        # previous one has disconnected, which happens asynchronously
+        for _ in range(self.HOST_RETRIES):
+            host = _LineClient(self.address, self.trace_log)
+            host.name = host.expect("YourNameIs")["name"]
+            if host.name == "Host":
+                return host
+            host.close()
+            time.sleep(0.1)
+        raise RuntimeError("Server at {} never started a new game".format(self.address))
+
+    def play(self, rng, config, results):
+        host = results.timed("create_game", transition(None, CREATED), self._connect_host)
+        players = []
+        try:
+            for i in range(config.players):
+                config.think.pause(rng)
+                players.append(results.timed("join_game", None, self._join, host))
+
+            config.think.pause(rng)
+            results.timed("start_game", transition(CREATED, WAIT_FOR_SUBMISSIONS),
+                          self._broadcast, host, StartGame(), players, "GameStarted")
+
+            for round_number in range(1, TOTAL_ROUNDS + 1):
+                order = list(players)
+                rng.shuffle(order)
+                for player in order[:-1]:
+                    config.think.pause(rng)
+                    player.send(Prompt("Round {} prompt from {}".format(round_number, player.name), player.name))
+                config.think.pause(rng)
+                last = order[-1]
+                prompts = results.timed("submit_prompt", transition(WAIT_FOR_SUBMISSIONS, CHOOSING), self._submit_last,
+                                        host, last, Prompt("Round {} prompt from {}".format(round_number, last.name),
+                                                           last.name))["prompts"]
+
+                config.think.pause(rng)
+                final = round_number == TOTAL_ROUNDS
+                next_state = GAME_COMPLETE if final else WAIT_FOR_SUBMISSIONS
+                results.timed("choose_prompt", transition(CHOOSING, next_state), self._broadcast,
+                              host, ChoosePrompt(rng.choice(prompts)), players, "Done" if final else "StoryUpdate")
+            return host.expect("Done")["story"]
+        finally:
+            for client in players + [host]:
+                client.close()
+
+    def _join(self, host):
+        player = _LineClient(self.address, self.trace_log)
+        player.name = player.expect("YourNameIs")["name"]
+        host.expect("PlayerJoined")
+        return player
+
+    @staticmethod
+    def _submit_last(host, player, prompt):
+        player.send(prompt)
+        return host.expect("NewPrompts")
+
+    @staticmethod
+    def _broadcast(sender, event, recipients, expected_type):
+        sender.send(event)
+        for recipient in recipients:
+            recipient.expect(expected_type)
+
+
+class LoadTestConfig(object):
+    def __init__(self, games, concurrency, players, spectators, think, seed, trace_log=None, batch=False,
+                 abusers=0):
+        if players < 1:
+            raise ValueError("Every game needs at least one player")
+        self.games = games
+        self.concurrency = concurrency
+        self.players = players
+        self.spectators = spectators
+        self.think = think
+        self.seed = seed
+        self.trace_log = trace_log
+        self.batch = batch
+        self.abusers = abusers
+
+    def to_dict(self):
+        return {'games': self.games, 'concurrency': self.concurrency, 'players': self.players,
+                'spectators': self.spectators, 'think': self.think.spec, 'seed': self.seed,
+                'batch': self.batch, 'abusers': self.abusers}
+
+
+def run(config, targets):
+    """
+    Play config.games games, one per worker thread at a time
+    :param targets: one target per worker thread; targets may be shared
+    :return: a JSON-serializable dict of results
+    """
+    results = Results()
+    pending = Queue.Queue()
+    for game_number in range(config.games):
+        pending.put(game_number)
+
+    def worker(target):
+        while True:
+            try:
+                game_number = pending.get_nowait()
+            except Queue.Empty:
+                return
+            rng = random.Random(config.seed + game_number)
+            try:
+                target.play(rng, config, results)
+                results.game_completed()
+            except Exception as e:
+                results.game_failed(game_number, e)
+
+    stop = threading.Event()
+    abusers = [threading.Thread(target=targets[0].abuse, args=(random.Random(config.seed - i - 1), results, stop))
+               for i in range(config.abusers)]
+    started_at = time.time()
+    start = timeit.default_timer()
+    threads = [threading.Thread(target=worker, args=(target,)) for target in targets]
+    for thread in threads + abusers:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+    duration = timeit.default_timer() - start
+    stop.set()
+    for thread in abusers:
+        thread.join()
+
+    return {
+        'config': config.to_dict(),
+        'started_at': started_at,
+        'duration_seconds': round(duration, 3),
+        'games': {'completed': results.completed, 'failed': len(results.failures)},
+        'failures': results.failures[:100],
+        'throughput': {
+            'games_per_second': round(results.completed / duration, 3) if duration else 0.0,
+            'actions_per_second': round(results.actions.total / duration, 3) if duration else 0.0
+        },
+        'handlers': results.actions.summary(),
+        'transitions': results.transitions.summary()
+    }
+
+
+def print_report(report, out=sys.stdout):
+    print >> out, "Played {} games ({} failed) in {}s: {} games/s, {} actions/s".format(
+        report['games']['completed'] + report['games']['failed'], report['games']['failed'],
+        report['duration_seconds'], report['throughput']['games_per_second'],
+        report['throughput']['actions_per_second'])
+    for section in ('handlers', 'transitions'):
+        print >> out, "\n{:<48} {:>8} {:>6} {:>10} {:>10} {:>10}".format(
+            section, "count", "errors", "p50 ms", "p95 ms", "p99 ms")
+        for name, stats in sorted(report[section].items()):
+            print >> out, "{:<48} {:>8} {:>6} {:>10} {:>10} {:>10}".format(
+                name, stats['count'], stats['errors'], stats.get('p50_ms', '-'),
+                stats.get('p95_ms', '-'), stats.get('p99_ms', '-'))
+
+
+def _parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["handlers", "tcp"], default="handlers")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="games in flight at once (handlers target only)")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--spectators", type=int, default=0,
+                        help="spectators per game (handlers target only)")
+    parser.add_argument("--think", type=ThinkTime, default=ThinkTime("none"),
+                        help="think time before each action: none, constant:S, uniform:LO:HI or exp:MEAN")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server", action="append", type=_parse_address,
+                        help="HOST:PORT of a cli/server.py, may be repeated (tcp target only)")
+    parser.add_argument("--output", help="write machine-readable JSON results to this file")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit each round's prompts in one apply_actions call (handlers target only)")
+    parser.add_argument("--trace-log", help="append traces of received events to this file, for bench.tracereport")
+    parser.add_argument("--abusers", type=int, default=0,
+                        help="threads spamming games in progress with bogus prompts (handlers target only)")
+    args = parser.parse_args(argv)
+
+    if args.target == "handlers":
+        target = HandlerTarget()
+        targets = [target] * args.concurrency
+    else:
+        if args.spectators or args.abusers:
+            parser.error("the tcp target does not support spectators or abusers")
+        targets = [TcpTarget(address, args.trace_log) for address in (args.server or [("localhost", SERVER_PORT)])]
+    config = LoadTestConfig(args.games, len(targets), args.players, args.spectators, args.think, args.seed,
+                            args.trace_log, args.batch, args.abusers)
+
+    report = run(config, targets)
+    report['target'] = args.target
+    if args.target == "handlers":
+        from aws.cache import game_cache
+        report['game_cache'] = game_cache.stats()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0 if not report['games']['failed'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Deterministic microbenchmarks for the pure game engine.
+
+Each benchmark is run for every combination of the roster sizes
+and story lengths it is parameterized by, and the best time of
+several calibrated repetitions is compared against a stored baseline:
+
+    python -m bench.micro --save-baseline          # record a baseline
+    python -m bench.micro --threshold 0.2          # fail on >20% slowdowns
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import sys
+import timeit
+
+from events import StoryUpdate, NewPrompts, Prompt, ChoosePrompt, GameStarted, PlayerJoined, Done, from_json
+from game import NotificationManager, CreatedGame, WaitForSubmissionsGame, ChoosingGame, TOTAL_ROUNDS
+from gameutil import GameReference
+import game
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+_BENCHMARKS = []
+
+
+class Benchmark(object):
+    def __init__(self, name, axes, factory):
+        self.name = name
+        self.axes = axes
+        self.factory = factory
+
+    def cases(self, players, story_lengths):
+        values = {'players': players, 'story_length': story_lengths}
+        for combination in itertools.product(*[values[axis] for axis in self.axes]):
+            params = dict(zip(self.axes, combination))
+            label = ",".join("{}={}".format(axis, params[axis]) for axis in self.axes)
+            yield "{}[{}]".format(self.name, label), params
+
+
+def benchmark(*axes):
+    """
+    Register a benchmark. The decorated function performs any setup
+    for the given parameters and returns a no-argument callable to time.
+    """
+    def register(factory):
+        _BENCHMARKS.append(Benchmark(factory.__name__, axes, factory))
+        return factory
+    return register
+
+
+class BenchPlayer(game.Player):
+    """
+    A player that does nothing when notified
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def join(self, game):
+        game.register_player(self)
+
+    def notify(self, event):
+        pass
+
+
+def _players(count):
+    return [BenchPlayer("Player {}".format(i)) for i in range(count)]
+
+
+def _story(length):
+    return " ".join("word{}".format(i % 97) for i in range(length))
+
+
+def _subscribed_manager(host, players):
+    manager = NotificationManager()
+    manager.subscribe(host, PlayerJoined, NewPrompts, Done)
+    for player in players:
+        manager.subscribe(player, PlayerJoined, GameStarted, StoryUpdate, Done)
+    return manager
+
+
+def _game_kwargs(players, story_length):
+    host = BenchPlayer("Host")
+    roster = _players(players)
+    return dict(host=host, game_id="BNCH", players=roster,
+                story=_story(story_length), current_round=1, spectators=[],
+                notification_manager=_subscribed_manager(host, roster))
+
+
+@benchmark('players')
+def notification_subscribe(players):
+    roster = _players(players)
+
+    def run():
+        manager = NotificationManager()
+        for player in roster:
+            manager.subscribe(player, PlayerJoined, GameStarted, StoryUpdate, Done)
+    return run
+
+
+@benchmark('players', 'story_length')
+def notification_publish(players, story_length):
+    manager = NotificationManager()
+    for player in _players(players):
+        manager.subscribe(player, StoryUpdate)
+    event = StoryUpdate(_story(story_length))
+
+    def run():
+        for _ in range(100):
+            manager.publish(event)
+    return run
+
+
+@benchmark('players')
+def register_player(players):
+    roster = _players(players)
+
+    def run():
+        host = BenchPlayer("Host")
+        created = CreatedGame(host, "BNCH", _subscribed_manager(host, []))
+        for player in roster:
+            created.register_player(player)
+    return run
+
+
+@benchmark('players', 'story_length')
+def receive_prompt(players, story_length):
+    kwargs = _game_kwargs(players, story_length)
+    prompts = [Prompt("A prompt from {}".format(player.name), player.name) for player in kwargs['players']]
+
+    def run():
+        waiting = WaitForSubmissionsGame(**kwargs)
+        for prompt in prompts:
+            waiting = waiting.receive_prompt(prompt)
+    return run
+
+
+@benchmark('players', 'story_length')
+def choose_prompt_rounds(players, story_length):
+    kwargs = _game_kwargs(players, story_length)
+    choice = ChoosePrompt(_story(10))
+
+    def run():
+        for _ in range(10):
+            choosing = ChoosingGame(**kwargs)
+            for _ in range(TOTAL_ROUNDS - 1):
+                choosing = ChoosingGame(copy_from=choosing.choose_prompt(choice))
+    return run
+
+
+@benchmark('players')
+def copy_value_transition(players):
+    waiting = WaitForSubmissionsGame(**_game_kwargs(players, 10))
+
+    def run():
+        for _ in range(1000):
+            ChoosingGame(copy_from=waiting)
+    return run
+
+
+@benchmark('players')
+def game_reference_dispatch(players):
+    kwargs = _game_kwargs(players, 10)
+    prompts = [Prompt("A prompt from {}".format(player.name), player.name) for player in kwargs['players']]
+
+    def run():
+        reference = GameReference(WaitForSubmissionsGame(**kwargs))
+        for prompt in prompts:
+            reference.round_number
+            reference.receive_prompt(prompt)
+    return run
+
+
+@benchmark('players', 'story_length')
+def event_json_round_trip(players, story_length):
+    events = [StoryUpdate(_story(story_length), is_final_round=False),
+              NewPrompts(prompts=["A prompt from {}".format(player.name) for player in _players(players)])]
+
+    def run():
+        for _ in range(100):
+            for event in events:
+                from_json(event.toJson())
+    return run
+
+
+def _time_calls(factory, params, number):
+    runs = [factory(**params) for _ in range(number)]
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = timeit.default_timer()
+        for run in runs:
+            run()
+        return timeit.default_timer() - start
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def run_benchmarks(players, story_lengths, repeat, name_filter=None, min_time=0.02):
+    """
+    Each repetition calls a benchmark enough times to take at least
+    'min_time' seconds, with garbage collection disabled as timeit does.
+
+    :return: a dict of case name -> best time per call in seconds over 'repeat' repetitions
+    """
+    results = {}
+    for bench in _BENCHMARKS:
+        for case_name, params in bench.cases(players, story_lengths):
+            if name_filter and name_filter not in case_name:
+                continue
+            number = 1
+            while _time_calls(bench.factory, params, number) < min_time:
+                number *= 2
+            results[case_name] = min(_time_calls(bench.factory, params, number) / number
+                                     for _ in range(repeat))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline
+    :param threshold: allowed fractional slowdown, e.g. 0.2 for 20%
+    :return: a list of (case name, baseline seconds, current seconds, ratio) for every regression
+    """
+    regressions = []
+    for case_name, seconds in sorted(results.items()):
+        if case_name not in baseline:
+            continue
+        ratio = seconds / baseline[case_name] if baseline[case_name] else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((case_name, baseline[case_name], seconds, ratio))
+    return regressions
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=_int_list, default=[4, 32, 256])
+    parser.add_argument("--story-lengths", type=_int_list, default=[10, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.02,
+                        help="minimum seconds per repetition; raise it on noisy machines")
+    parser.add_argument("--filter", help="only run cases whose name contains this string")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed fractional slowdown relative to the baseline")
+    args = parser.parse_args(argv)
+
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print >> sys.stderr, "No baseline at {}; record one with --save-baseline".format(args.baseline)
+        return 2
+
+    results = run_benchmarks(args.players, args.story_lengths, args.repeat, args.filter, args.min_time)
+
+    baseline = {}
+    if not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    for case_name, seconds in sorted(results.items()):
+        if case_name in baseline:
+            print "{:<64} {:>12.1f}us  ({:+.1%} vs baseline)".format(
+                case_name, seconds * 1e6, seconds / baseline[case_name] - 1 if baseline[case_name] else 0)
+        else:
+            print "{:<64} {:>12.1f}us".format(case_name, seconds * 1e6)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print "Saved baseline to {}".format(args.baseline)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for case_name, before, after, ratio in regressions:
+        print >> sys.stderr, "REGRESSION {}: {:.1f}us -> {:.1f}us ({:.2f}x)".format(
+            case_name, before * 1e6, after * 1e6, ratio)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
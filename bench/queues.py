@@ -0,0 +1,139 @@
+"""
+Throughput benchmark of consuming a participant's queue, against the
+local stand-in for SQS with a simulated round trip per request.
+
+A producer thread sends numbered events, as fast as it can or at
+--rate, some of them out of order and some twice, while a consumer
+takes them off the queue: either the reference
+aws.consumer.QueueConsumer, or a consumer that short polls and
+deletes one message at a time, as clients used to.
+
+    python -m bench.queues --events 5000 --latency-ms 2
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import timeit
+
+from aws import consumer, local, sqs
+from aws.consumer import QueueConsumer
+from events import StoryUpdate, from_json
+
+
+class SlowQueueService(object):
+    """
+    Adds a round trip to every request made to a queue service
+    """
+
+    def __init__(self, target, latency):
+        self.target = target
+        self.latency = latency
+
+    def __getattr__(self, name):
+        call = getattr(self.target, name)
+
+        def delayed(*args, **kwargs):
+            time.sleep(self.latency)
+            return call(*args, **kwargs)
+        return delayed
+
+
+def produce(queue_url, count, rng, shuffle_window=5, duplicate_rate=0.01, rate=None):
+    """
+    Send events numbered 1 to count, shuffled within windows and with some sent twice
+    :param rate: events per second, or None to send as fast as possible
+    """
+    events = [StoryUpdate("word" * (seq % 16), is_final_round=False).sequenced(seq) for seq in range(1, count + 1)]
+    for start in range(0, count, shuffle_window):
+        window = events[start:start + shuffle_window]
+        rng.shuffle(window)
+        for event in window:
+            sqs.send_message(queue_url, event)
+            if rng.random() < duplicate_rate:
+                sqs.send_message(queue_url, event)
+            if rate:
+                time.sleep(1.0 / rate)
+
+
+class NaiveConsumer(object):
+    """
+    Short polls for one message at a time and deletes each as it is received
+    """
+
+    def __init__(self, queue_url):
+        self.queue_url = queue_url
+        self.requests = 0
+
+    def poll(self):
+        response = consumer.sqs.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=1)
+        self.requests += 1
+        events = []
+        for message in response.get('Messages', []):
+            consumer.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+            self.requests += 1
+            events.append(from_json(message['Body']))
+        return events
+
+
+def run(name, events, latency, rate=None, seed=0):
+    """
+    Consume the events of a producer with the named consumer
+    :return: a dict of figures for the run
+    """
+    local.install()
+    # Only the consumer pays the round trips; producers are many and elsewhere
+    consumer.sqs = SlowQueueService(sqs.sqs, latency)
+    queue_url = sqs.create_queue("BNCH", "consumer")
+    if name == "batched":
+        queue_consumer = QueueConsumer(queue_url, wait_seconds=1)
+    else:
+        queue_consumer = NaiveConsumer(queue_url)
+
+    producer = threading.Thread(target=produce, args=(queue_url, events, random.Random(seed)), kwargs={'rate': rate})
+    start = timeit.default_timer()
+    producer.start()
+    delivered = []
+    seen = set()
+    while len(seen) < events:
+        for event in queue_consumer.poll():
+            delivered.append(event.seq)
+            seen.add(event.seq)
+    elapsed = timeit.default_timer() - start
+    producer.join()
+
+    unique = sorted(seen)
+    return {
+        'events_per_second': round(len(unique) / elapsed, 1),
+        'requests': queue_consumer.requests,
+        'requests_per_event': round(float(queue_consumer.requests) / len(unique), 3),
+        'in_order': delivered == unique,
+        'duplicates_delivered': len(delivered) - len(unique)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark consuming a participant's queue")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="simulated round trip of each request")
+    parser.add_argument("--rate", type=float, help="events produced per second; as fast as possible if not given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = {name: run(name, args.events, args.latency_ms / 1000.0, args.rate, args.seed)
+              for name in ("batched", "naive")}
+    for name in ("batched", "naive"):
+        result = report[name]
+        print "{:<8} {:>10.1f} events/s {:>7} requests ({:.3f} per event), in order: {}, duplicates: {}".format(
+            name, result['events_per_second'], result['requests'], result['requests_per_event'],
+            result['in_order'], result['duplicates_delivered'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
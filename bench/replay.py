@@ -0,0 +1,401 @@
+"""
+Replays action streams captured with GROUPWEAVE_RECORD (see
+recording.py), either against the handlers with in-memory stand-ins
+for AWS or against a running cli/server.py. Every game is replayed on
+its own thread, in its recorded order and at its recorded pace (scaled
+by --speed, 0 meaning as fast as possible). The replay checks that
+every game that completed when recorded completes with the same story.
+
+Example:
+
+    GROUPWEAVE_RECORD=trace.jsonl.gz python -m bench.loadtest --games 50
+    python -m bench.replay trace.jsonl.gz --speed 0 --output before.json
+    # ... change the engine or persistence ...
+    python -m bench.replay trace.jsonl.gz --speed 0 --compare before.json
+
+Recordings of the CLI server are replayed against a running server
+with --server HOST:PORT. Deadlines that expired when recorded are not
+replayed, so traces are best recorded with generous deadlines.
+"""
+import argparse
+import json
+import Queue
+import socket
+import sys
+import threading
+import time
+import timeit
+
+import recording
+from bench.stats import LatencyRecorder
+from events import GetGameState, from_json
+
+_RESPONSE_IDS = ('gameId', 'hostToken', 'playerToken')
+
+
+def handler_games(records):
+    """
+    Group handler records by the game they act on
+    :return: a tuple of (dict of game id -> records in order, dict of game id -> recorded story)
+    """
+    games = {}
+    stories = {}
+    for entry in records:
+        if entry['op'] == "handler" and entry.get('g'):
+            games.setdefault(entry['g'], []).append(entry)
+        elif entry['op'] == "done":
+            stories[entry['g']] = entry['story']
+    return games, stories
+
+
+def provisioning_records(records):
+    """
+    :return: the handler records not bound to one game, such as bulk game creation, in order
+    """
+    return [entry for entry in records if entry['op'] == "handler" and not entry.get('g')]
+
+
+def tcp_sessions(records):
+    """
+    Split a CLI server recording into the games it hosted; each game
+    starts when the host (connection 0) connects
+    :return: a tuple of (list of record lists, list of recorded stories or None)
+    """
+    sessions = []
+    stories = []
+    for entry in records:
+        if entry['op'] == "connect" and entry['c'] == 0:
+            sessions.append([])
+            stories.append(None)
+        if not sessions:
+            continue
+        if entry['op'] == "done":
+            stories[-1] = entry['story']
+        elif entry['op'] in ("connect", "line", "close"):
+            sessions[-1].append(entry)
+    return sessions, stories
+
+
+class _Clock(object):
+    """
+    Maps recorded times onto replay times
+    """
+
+    def __init__(self, recorded_start, speed):
+        self.recorded_start = recorded_start
+        self.speed = speed
+        self.start = timeit.default_timer()
+
+    def wait_for(self, recorded_time):
+        if self.speed <= 0:
+            return
+        delay = (recorded_time - self.recorded_start) / self.speed - (timeit.default_timer() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HandlerReplayer(object):
+    """
+    Replays handler invocations, translating the game ids and tokens
+    handed out when recording into the ones handed out in the replay
+    """
+
+    def __init__(self):
+        import handlers
+        from aws import local
+        self.handlers = handlers
+        self.backend = local.install()
+        self.latencies = LatencyRecorder()
+        self.outcome_mismatches = []
+        self.actions = 0
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def _translate(self, value):
+        with self._lock:
+            return self._ids.get(value, value)
+
+    def _translate_event(self, event):
+        event = dict(event)
+        for key in ('gameId', 'token'):
+            if key in event:
+                event[key] = self._translate(event[key])
+        if 'actions' in event:
+            event['actions'] = [dict(action, token=self._translate(action.get('token')))
+                                for action in event['actions']]
+        return event
+
+    def _learn(self, recorded_response, response):
+        recorded_response = json.loads(recorded_response or "null") or {}
+        response = json.loads(response or "null") or {}
+        pairs = [(recorded_response, response)]
+        # Bulk creation hands out ids for each of its games
+        pairs.extend(zip(recorded_response.get('games', []), response.get('games', [])))
+        with self._lock:
+            for recorded_ids, ids in pairs:
+                for key in _RESPONSE_IDS:
+                    if key in recorded_ids and key in ids:
+                        self._ids[recorded_ids[key]] = ids[key]
+
+    def replay_game(self, entries, clock):
+        for entry in entries:
+            clock.wait_for(entry['t'])
+            handler = getattr(self.handlers, entry['h'])
+            start = timeit.default_timer()
+            try:
+                response = handler(self._translate_event(entry['e']), None)
+                ok = True
+            except Exception:
+                response = None
+                ok = False
+            elapsed = timeit.default_timer() - start
+            with self._lock:
+                self.actions += 1
+            if ok:
+                self.latencies.record(entry['h'], elapsed)
+                self._learn(entry.get('r'), response)
+            else:
+                self.latencies.error(entry['h'])
+            if ok != entry['ok']:
+                with self._lock:
+                    self.outcome_mismatches.append({'game': entry['g'], 'handler': entry['h'],
+                                                    'recorded_ok': entry['ok']})
+
+    def story(self, recorded_game_id):
+        game_id = self._translate(recorded_game_id)
+        try:
+            state = json.loads(self.handlers.get_game_state({"gameId": game_id}, None))["state"]
+        except Exception:
+            return None
+        return state['story'] if state['phase'] == "COMPLETE" else None
+
+    def run(self, records, speed):
+        games, recorded_stories = handler_games(records)
+        clock = _Clock(records[0]['t'] if records else 0, speed)
+        # Games provisioned in bulk must exist before any thread acts on them
+        self.replay_game(provisioning_records(records), clock)
+        threads = [threading.Thread(target=self.replay_game, args=(entries, clock)) for entries in games.values()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+        return {game_id: self.story(game_id) for game_id in games}, recorded_stories
+
+
+class TcpReplayer(object):
+    """
+    Replays the connections and lines received by a CLI server. The
+    server hosts one game at a time, so recorded games are replayed
+    one after the other. Lines sent on different connections can be
+    handled out of order by the server, so before switching connection
+    the replayer waits for the server to answer a GetGameState sent
+    after the last line, which is timed as "round_trip".
+    """
+
+    TIMEOUT_SECONDS = 10.0
+
+    def __init__(self, address):
+        self.address = address
+        self.latencies = LatencyRecorder()
+        self.outcome_mismatches = []
+        self.actions = 0
+
+    def _read(self, sock, states, done):
+        # readline rather than iteration, which reads ahead and would hold back events
+        try:
+            for line in iter(sock.makefile('r').readline, ""):
+                event = from_json(line.strip())
+                if event.type in ("YourNameIs", "GameState"):
+                    states.put(event)
+                elif event.type == "Done":
+                    done['story'] = event['story']
+        except socket.error:
+            pass  # Closed by the server or by the end of the session
+
+    def _connect(self, done):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        states = Queue.Queue()
+        reader = threading.Thread(target=self._read, args=(sock, states, done))
+        reader.daemon = True
+        reader.start()
+        # Wait for the server to name the client, so clients join in their recorded order
+        try:
+            states.get(timeout=self.TIMEOUT_SECONDS)
+        except Queue.Empty:
+            self.latencies.error("connect")
+        return sock, states
+
+    @staticmethod
+    def _close(connection):
+        # The reader's file keeps the socket open, so shut it down explicitly
+        sock, _ = connection
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+
+    def _sync(self, connection, since):
+        sock, states = connection
+        while not states.empty():
+            states.get_nowait()
+        try:
+            sock.sendall(GetGameState().toJson() + "\r\n")
+            states.get(timeout=self.TIMEOUT_SECONDS)
+            self.latencies.record("round_trip", timeit.default_timer() - since)
+        except (socket.error, Queue.Empty):
+            self.latencies.error("round_trip")
+
+    def replay_session(self, entries, speed):
+        clock = _Clock(entries[0]['t'], speed)
+        connections = {}
+        done = {}
+        last = None
+        start = timeit.default_timer()
+        try:
+            for entry in entries:
+                clock.wait_for(entry['t'])
+                if entry['op'] == "connect":
+                    if last is not None and last[0] in connections:
+                        self._sync(connections[last[0]], last[1])
+                        last = None
+                    connections[entry['c']] = self._connect(done)
+                elif entry['op'] == "line" and entry['c'] in connections:
+                    if last is not None and last[0] != entry['c'] and last[0] in connections:
+                        self._sync(connections[last[0]], last[1])
+                        last = None
+                    if last is None:
+                        last = (entry['c'], timeit.default_timer())
+                    try:
+                        connections[entry['c']][0].sendall(entry['l'] + "\r\n")
+                        self.actions += 1
+                    except socket.error:
+                        # The server turned the connection away, as it was when recorded
+                        self.latencies.error("line")
+                        self._close(connections.pop(entry['c']))
+                elif entry['op'] == "close" and entry['c'] in connections and entry['c'] != 0:
+                    self._close(connections.pop(entry['c']))
+            if last is not None and last[0] in connections:
+                self._sync(connections[last[0]], last[1])
+            deadline = timeit.default_timer() + self.TIMEOUT_SECONDS
+            while 'story' not in done and timeit.default_timer() < deadline:
+                time.sleep(0.01)
+        finally:
+            for connection in connections.values():
+                self._close(connection)
+        self.latencies.record("session", timeit.default_timer() - start)
+        return done.get('story')
+
+    def run(self, records, speed):
+        sessions, recorded_stories = tcp_sessions(records)
+        stories = {}
+        expected = {}
+        for number, (entries, story) in enumerate(zip(sessions, recorded_stories)):
+            key = "session-{}".format(number)
+            stories[key] = self.replay_session(entries, speed)
+            if story is not None:
+                expected[key] = story
+            # Give the server time to notice every client has gone before the next game
+            time.sleep(0.2)
+        return stories, expected
+
+
+def replay(records, replayer, speed):
+    """
+    :return: a JSON-serializable report of the replay
+    """
+    start = timeit.default_timer()
+    stories, expected = replayer.run(records, speed)
+    duration = timeit.default_timer() - start
+    mismatches = sorted(game_id for game_id, story in expected.items() if stories.get(game_id) != story)
+    actions = replayer.actions
+    return {
+        'speed': speed,
+        'duration_seconds': round(duration, 3),
+        'actions_per_second': round(actions / duration, 3) if duration else 0.0,
+        'actions': actions,
+        'games': len(stories),
+        'story_mismatches': mismatches,
+        'outcome_mismatches': replayer.outcome_mismatches[:100],
+        'latencies': replayer.latencies.summary(),
+        'stories': stories
+    }
+
+
+def compare(before, after):
+    """
+    Compare two replay reports of the same trace
+    :return: a dict of throughput ratio, per-action p50/p95 changes and games whose stories differ
+    """
+    latencies = {}
+    for name in sorted(set(before['latencies']) & set(after['latencies'])):
+        old, new = before['latencies'][name], after['latencies'][name]
+        latencies[name] = {key: {'before': old.get(key), 'after': new.get(key)}
+                           for key in ('p50_ms', 'p95_ms') if key in old and key in new}
+    return {
+        'throughput_ratio': (round(after['actions_per_second'] / before['actions_per_second'], 3)
+                             if before['actions_per_second'] else None),
+        'latencies': latencies,
+        'story_differences': sorted(game_id for game_id in set(before['stories']) | set(after['stories'])
+                                    if before['stories'].get(game_id) != after['stories'].get(game_id))
+    }
+
+
+def print_report(report, comparison=None, out=sys.stdout):
+    print >> out, "Replayed {} games in {}s: {} actions/s, {} story mismatches, {} outcome mismatches".format(
+        report['games'], report['duration_seconds'], report['actions_per_second'],
+        len(report['story_mismatches']), len(report['outcome_mismatches']))
+    print >> out, "\n{:<24} {:>8} {:>6} {:>10} {:>10} {:>10}".format("action", "count", "errors",
+                                                                    "p50 ms", "p95 ms", "p99 ms")
+    for name, stats in sorted(report['latencies'].items()):
+        print >> out, "{:<24} {:>8} {:>6} {:>10} {:>10} {:>10}".format(
+            name, stats['count'], stats['errors'], stats.get('p50_ms', '-'),
+            stats.get('p95_ms', '-'), stats.get('p99_ms', '-'))
+    if comparison is not None:
+        print >> out, "\nThroughput vs baseline: {}x".format(comparison['throughput_ratio'])
+        for name, changes in sorted(comparison['latencies'].items()):
+            print >> out, "{:<24} {}".format(name, "  ".join(
+                "{} {} -> {}".format(key, change['before'], change['after'])
+                for key, change in sorted(changes.items())))
+        if comparison['story_differences']:
+            print >> out, "Stories differ from baseline for: {}".format(", ".join(comparison['story_differences']))
+
+
+def _parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or "localhost", int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="a recording, or a log containing prefixed records")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay speed relative to the recording; 0 replays as fast as possible")
+    parser.add_argument("--server", type=_parse_address,
+                        help="HOST:PORT of a cli/server.py, to replay a recording of the TCP server")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="a previous report to compare this replay against")
+    args = parser.parse_args(argv)
+
+    records = recording.read(args.trace)
+    replayer = TcpReplayer(args.server) if args.server else HandlerReplayer()
+    report = replay(records, replayer, args.speed)
+
+    comparison = None
+    if args.compare:
+        with open(args.compare) as f:
+            comparison = compare(json.load(f), report)
+        report['comparison'] = comparison
+    print_report(report, comparison)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    failed = report['story_mismatches'] or (comparison is not None and comparison['story_differences'])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
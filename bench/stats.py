@@ -0,0 +1,74 @@
+"""
+Helpers for collecting and summarizing latency samples
+"""
+import collections
+import threading
+
+
+def percentile(sorted_values, pct):
+    """
+    Linearly interpolated percentile of an already-sorted list
+    :param sorted_values: the samples, in ascending order
+    :param pct: the percentile to compute, between 0 and 100
+    """
+    if not sorted_values:
+        raise ValueError("Cannot compute a percentile of no samples")
+    rank = (len(sorted_values) - 1) * (pct / 100.0)
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = rank - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def summarize(samples):
+    """
+    Summarize latency samples (in seconds) as a dict of millisecond statistics
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    to_ms = lambda value: round(value * 1000.0, 3)
+    return {
+        'count': len(ordered),
+        'mean_ms': to_ms(sum(ordered) / len(ordered)),
+        'p50_ms': to_ms(percentile(ordered, 50)),
+        'p95_ms': to_ms(percentile(ordered, 95)),
+        'p99_ms': to_ms(percentile(ordered, 99)),
+        'max_ms': to_ms(ordered[-1])
+    }
+
+
+class LatencyRecorder(object):
+    """
+    Thread-safe collection of named latency samples and error counts
+    """
+
+    def __init__(self):
+        self._samples = collections.defaultdict(list)
+        self._errors = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def error(self, name):
+        with self._lock:
+            self._errors[name] += 1
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(len(samples) for samples in self._samples.values())
+
+    def summary(self):
+        """
+        :return: a dict of name -> latency summary, including error counts
+        """
+        with self._lock:
+            names = set(self._samples.keys()) | set(self._errors.keys())
+            result = {}
+            for name in names:
+                result[name] = summarize(self._samples.get(name, []))
+                result[name]['errors'] = self._errors.get(name, 0)
+            return result
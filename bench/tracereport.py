@@ -0,0 +1,72 @@
+"""
+Computes per-hop and end-to-end latency distributions from
+trace logs written by receivers of traced events (see tracing.py).
+
+    python -m bench.tracereport traces.jsonl [more.jsonl ...] --output report.json
+
+Hops recorded on different machines are only as comparable as
+those machines' clocks.
+"""
+import argparse
+import collections
+import json
+import sys
+
+from bench.stats import summarize
+
+
+def read_traces(paths):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def analyze(traces):
+    """
+    :return: a dict with latency summaries for the whole journey by
+             event type ('end_to_end') and for each consecutive pair of hops ('hops')
+    """
+    end_to_end = collections.defaultdict(list)
+    hops = collections.defaultdict(list)
+    for trace in traces:
+        trace_hops = trace['hops']
+        if len(trace_hops) < 2:
+            continue
+        end_to_end[trace['type']].append(trace_hops[-1][1] - trace_hops[0][1])
+        end_to_end['all'].append(trace_hops[-1][1] - trace_hops[0][1])
+        for (from_hop, from_time), (to_hop, to_time) in zip(trace_hops, trace_hops[1:]):
+            hops["{}->{}".format(from_hop, to_hop)].append(to_time - from_time)
+    return {
+        'end_to_end': dict((name, summarize(samples)) for name, samples in end_to_end.items()),
+        'hops': dict((name, summarize(samples)) for name, samples in hops.items())
+    }
+
+
+def print_report(report, out=sys.stdout):
+    for section in ('end_to_end', 'hops'):
+        print >> out, "\n{:<48} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+            section, "count", "p50 ms", "p95 ms", "p99 ms", "max ms")
+        for name, stats in sorted(report[section].items()):
+            print >> out, "{:<48} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+                name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_logs", nargs="+")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    report = analyze(read_traces(args.trace_logs))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
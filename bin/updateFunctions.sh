@@ -1,4 +1,10 @@
 #!/bin/bash -e
+#
+# Usage: updateFunctions.sh [--routed]
+#
+# Deploys the backend to every function listed in .lambda_functions, or
+# with --routed to the single function named in .lambda_dispatch, whose
+# handler is handlers.dispatch and which serves every action.
 
 BIN_DIR=$(dirname $0)
 BASE_DIR="${BIN_DIR}/.."
@@ -11,9 +17,17 @@ update_function(){
                                     --zip-file "fileb://$ZIPFILE"
 }
 
-zip -r "$ZIPFILE" ./* -x tests/ cli/ bin/ tests/* cli/* bin/* *.txt
+zip -r "$ZIPFILE" ./* -x tests/ cli/ bin/ bench/ tests/* cli/* bin/* bench/* *.txt
 
 
+if [[ "$1" == "--routed" ]]; then
+    ROUTED_FUNCTION=$(head -n 1 ".lambda_dispatch")
+    update_function "$ROUTED_FUNCTION"
+    aws --region="us-east-1" lambda update-function-configuration --function-name "$ROUTED_FUNCTION" \
+                                    --handler "handlers.dispatch"
+    exit 0
+fi
+
 while IFS='' read -r line || [[ -n "$line" ]]; do
     update_function "$line"
-done < ".lambda_functions"
\ No newline at end of file
+done < ".lambda_functions"
@@ -1 +1,7 @@
-SERVER_PORT = 1234
\ No newline at end of file
+SERVER_PORT = 1234
+# Spectators, or relays standing in for many spectators, connect to the server here
+SPECTATOR_PORT = 1235
+# Spectators connect to a relay here
+RELAY_PORT = 1236
+# Clients send a Heartbeat this often, so the server can tell they are still there
+HEARTBEAT_SECONDS = 10
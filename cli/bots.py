@@ -0,0 +1,397 @@
+"""
+Headless client SDK for playing games on the command line Groupweave
+server with bots, e.g. for load and soak testing.
+
+Bots never block the reactor. What a bot does is decided by a strategy
+object, and the bot acts once the strategy's think time has passed,
+using callLater, so a single process can run thousands of bots.
+Strategies are provided for scripted, random and replayed (from an
+archived game record) play.
+
+Example, playing 100 games each on two servers with 5 random players,
+while 50 bots spectate through a relay:
+
+    python -m cli.bots --server localhost:1234 --server localhost:1244 \\
+        --games 100 --players 5 --strategy random --think 0.1 \\
+        --spectators 50 --relay localhost:1236
+"""
+import argparse
+import itertools
+from abc import ABCMeta, abstractmethod
+import json
+import random
+import sys
+import timeit
+
+from twisted.internet import defer, reactor, task
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.python.failure import Failure
+
+import archive
+from cli import RELAY_PORT, SERVER_PORT
+from cli.client import CommandLineGroupweaveClientProtocol
+from events import ChoosePrompt, Done, GameStarted, NewPrompts, PlayerJoined, Prompt, StartGame, StoryUpdate
+
+
+class Strategy(object):
+    """
+    Decides what a bot does. Bots wait for think_time() seconds before each action.
+    """
+
+    __metaclass__ = ABCMeta
+
+    def __init__(self, think=0.0, rng=None):
+        self.think = think
+        self.rng = rng or random.Random()
+
+    def think_time(self):
+        return self.rng.expovariate(1.0 / self.think) if self.think > 0 else 0.0
+
+
+class PlayerStrategy(Strategy):
+    @abstractmethod
+    def prompt(self, name, round_number, story):
+        """
+        :return: the prompt the named player submits in the given round
+        """
+        pass
+
+
+class HostStrategy(Strategy):
+    def should_start(self, joined, expected):
+        """
+        :param joined: how many players have joined so far
+        :param expected: how many players the game was set up for
+        :return: whether to start the game
+        """
+        return joined >= expected
+
+    @abstractmethod
+    def choose(self, prompts, round_number, story):
+        """
+        :param prompts: the prompts submitted in the round
+        :return: the prompt to choose
+        """
+        pass
+
+
+class ScriptedPlayer(PlayerStrategy):
+    """
+    Submits the given prompts in turn, starting over once they run out
+    """
+
+    def __init__(self, prompts, **kwargs):
+        super(ScriptedPlayer, self).__init__(**kwargs)
+        self.prompts = prompts
+
+    def prompt(self, name, round_number, story):
+        return self.prompts[(round_number - 1) % len(self.prompts)]
+
+
+class ScriptedHost(HostStrategy):
+    """
+    Chooses the prompt at the given index of the sorted prompts in each round,
+    starting over once the indexes run out
+    """
+
+    def __init__(self, choices=(0,), **kwargs):
+        super(ScriptedHost, self).__init__(**kwargs)
+        self.choices = choices
+
+    def choose(self, prompts, round_number, story):
+        ordered = sorted(prompts)
+        return ordered[self.choices[(round_number - 1) % len(self.choices)] % len(ordered)]
+
+
+class RandomPlayer(PlayerStrategy):
+    WORDS = ("once", "upon", "a", "time", "there", "was", "dragon", "who", "loved", "tea", "and", "never", "slept")
+
+    def __init__(self, words=3, **kwargs):
+        super(RandomPlayer, self).__init__(**kwargs)
+        self.words = words
+
+    def prompt(self, name, round_number, story):
+        return " ".join(self.rng.choice(self.WORDS) for _ in range(self.words))
+
+
+class RandomHost(HostStrategy):
+    def choose(self, prompts, round_number, story):
+        return self.rng.choice(sorted(prompts))
+
+
+class ReplayPlayer(PlayerStrategy):
+    """
+    Submits the prompts a player of the same name submitted in an archived game
+    """
+
+    def __init__(self, record, **kwargs):
+        super(ReplayPlayer, self).__init__(**kwargs)
+        self.rounds = {entry['round']: entry['prompts'] for entry in record['rounds']}
+
+    def prompt(self, name, round_number, story):
+        return self.rounds.get(round_number, {}).get(name, "...")
+
+
+class ReplayHost(HostStrategy):
+    """
+    Makes the choices made in an archived game, where the same prompt was submitted
+    """
+
+    def __init__(self, record, **kwargs):
+        super(ReplayHost, self).__init__(**kwargs)
+        self.choices = {entry['round']: entry['choice'] for entry in record['rounds']}
+
+    def choose(self, prompts, round_number, story):
+        choice = self.choices.get(round_number)
+        return choice if choice in prompts else sorted(prompts)[0]
+
+
+class Bot(CommandLineGroupweaveClientProtocol):
+    """
+    A client driven by a strategy. 'finished' fires with the final
+    story once the game is done, or fails if the connection is lost first.
+    """
+
+    def __init__(self, strategy, clock=None):
+        super(Bot, self).__init__(clock)
+        self.strategy = strategy
+        self.round_number = 0
+        self.named = defer.Deferred()
+        self.finished = defer.Deferred()
+        self._pending = None
+
+    def later(self, action, *args):
+        """
+        Take an action once the strategy's think time has passed
+        """
+        self._pending = self.clock.callLater(self.strategy.think_time(), action, *args)
+
+    def handleEvent(self, event):
+        if event.type == "YourNameIs":
+            self.name = event["name"]
+            self.named.callback(self.name)
+        elif isinstance(event, Done):
+            self.story = event["story"]
+            self.transport.loseConnection()
+            self.finished.callback(self.story)
+        else:
+            self.react(event)
+
+    def react(self, event):
+        pass
+
+    def connectionLost(self, reason):
+        super(Bot, self).connectionLost(reason)
+        if self._pending is not None and self._pending.active():
+            self._pending.cancel()
+        if not self.named.called:
+            self.named.errback(reason)
+        if not self.finished.called:
+            self.finished.errback(reason)
+
+
+class PlayerBot(Bot):
+    def react(self, event):
+        if isinstance(event, GameStarted):
+            self.round_number = 1
+            self.story = ""
+            self.later(self.submitPrompt)
+        elif isinstance(event, StoryUpdate):
+            self.round_number += 1
+            self.story = event["story"]
+            self.later(self.submitPrompt)
+
+    def submitPrompt(self):
+        self.send(Prompt(self.strategy.prompt(self.name, self.round_number, self.story), self.name))
+
+
+class HostBot(Bot):
+    def __init__(self, strategy, players, clock=None):
+        """
+        :param players: how many players the game is set up for
+        """
+        super(HostBot, self).__init__(strategy, clock)
+        self.players = players
+        self.joined = 0
+        self.story = ""
+
+    def react(self, event):
+        if isinstance(event, PlayerJoined):
+            self.joined += 1
+            if self.round_number == 0 and self.strategy.should_start(self.joined, self.players):
+                self.round_number = 1
+                self.later(self.send, StartGame())
+        elif isinstance(event, NewPrompts):
+            self.later(self.choose, event["prompts"])
+
+    def choose(self, prompts):
+        choice = self.strategy.choose(prompts, self.round_number, self.story)
+        self.send(ChoosePrompt(choice))
+        self.story = "{} {}".format(self.story, choice)
+        self.round_number += 1
+
+
+class SpectatorBot(Bot):
+    """
+    Watches games, e.g. through a relay, counting the events it receives.
+    Its connection stays open across games; 'finished' fires with the
+    number of games it saw once it is disconnected.
+    """
+
+    def __init__(self, clock=None):
+        super(SpectatorBot, self).__init__(Strategy(), clock)
+        self.events = 0
+        self.games = 0
+
+    def handleEvent(self, event):
+        if event.type == "YourNameIs":
+            self.name = event["name"]
+            self.named.callback(self.name)
+            return
+        self.events += 1
+        if isinstance(event, Done):
+            self.games += 1
+
+    def connectionLost(self, reason):
+        # A spectator is finished once it is disconnected, however that happens
+        super(Bot, self).connectionLost(reason)
+        if not self.named.called:
+            self.named.errback(reason)
+        self.finished.callback(self.games)
+
+
+HOST_RETRIES = 50
+HOST_RETRY_SECONDS = 0.1
+
+
+@defer.inlineCallbacks
+def play_game(connect, host_strategy, player_strategies, clock=None):
+    """
+    Play one game with bots
+    :param connect: a function taking a protocol and returning a Deferred
+                    that fires once it is connected to the server
+    :return: a Deferred firing with the final story
+    """
+    clock = clock or reactor
+    for _ in range(HOST_RETRIES):
+        host = HostBot(host_strategy, len(player_strategies), clock)
+        yield connect(host)
+        # The server only starts a new game once every client of the previous one has gone
+        if (yield host.named) == "Host":
+            break
+        host.transport.loseConnection()
+        yield host.finished.addErrback(lambda failure: None)
+        yield task.deferLater(clock, HOST_RETRY_SECONDS, lambda: None)
+    else:
+        raise RuntimeError("The server never started a new game")
+    players = [PlayerBot(strategy, clock) for strategy in player_strategies]
+    for player in players:
+        yield connect(player)
+    results = yield defer.gatherResults([host.finished] + [player.finished for player in players],
+                                        consumeErrors=True)
+    defer.returnValue(results[0])
+
+
+def strategies(kind, players, think, rng, record=None):
+    """
+    :return: a tuple of the host strategy and a list of player strategies of the given kind
+    """
+    if kind == "scripted":
+        return (ScriptedHost(think=think, rng=rng),
+                [ScriptedPlayer(["Prompt {} from player {}".format(i, n) for i in range(1, 4)], think=think, rng=rng)
+                 for n in range(players)])
+    if kind == "random":
+        return RandomHost(think=think, rng=rng), [RandomPlayer(think=think, rng=rng) for _ in range(players)]
+    if kind == "replay":
+        return ReplayHost(record, think=think, rng=rng), [ReplayPlayer(record, think=think, rng=rng)
+                                                          for _ in range(players)]
+    raise ValueError("Unknown strategy {}".format(kind))
+
+
+def _parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or "localhost", int(port)
+
+
+@defer.inlineCallbacks
+def _play_games(address, args, rng, records, results):
+    def connect(protocol):
+        return connectProtocol(TCP4ClientEndpoint(reactor, address[0], address[1]), protocol)
+
+    for _ in range(args.games):
+        record = next(records) if records is not None else None
+        host, players = strategies(args.strategy, args.players, args.think, rng, record)
+        start = timeit.default_timer()
+        try:
+            yield play_game(connect, host, players)
+            results['games'] += 1
+            results['seconds'].append(timeit.default_timer() - start)
+        except Exception as e:
+            results['errors'] += 1
+            print >> sys.stderr, "Game on {}:{} failed: {}".format(address[0], address[1], e)
+
+
+@defer.inlineCallbacks
+def _run(args):
+    rng = random.Random(args.seed)
+    records = None
+    if args.strategy == "replay":
+        records = itertools.cycle(list(archive.DirectoryArchive(args.archive).stream()))
+    spectators = [SpectatorBot() for _ in range(args.spectators)]
+    for spectator in spectators:
+        yield connectProtocol(TCP4ClientEndpoint(reactor, args.relay[0], args.relay[1]), spectator)
+    results = {'games': 0, 'errors': 0, 'seconds': []}
+    start = timeit.default_timer()
+    yield defer.gatherResults([_play_games(address, args, rng, records, results)
+                               for address in args.server or [("localhost", SERVER_PORT)]])
+    elapsed = timeit.default_timer() - start
+    seconds = sorted(results['seconds'])
+    report = {
+        'games': results['games'],
+        'errors': results['errors'],
+        'duration': round(elapsed, 3),
+        'games_per_second': round(results['games'] / elapsed, 3) if elapsed else None,
+        'median_game_seconds': round(seconds[len(seconds) // 2], 3) if seconds else None,
+        'spectator_events': sum(spectator.events for spectator in spectators)
+    }
+    for spectator in spectators:
+        spectator.transport.loseConnection()
+    print json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", action="append", type=_parse_address,
+                        help="HOST:PORT of a CLI server; may be repeated, each plays its games concurrently")
+    parser.add_argument("--games", type=int, default=10, help="games to play on each server, one after the other")
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--strategy", choices=["scripted", "random", "replay"], default="random")
+    parser.add_argument("--archive", help="directory of archived games to replay, for --strategy replay")
+    parser.add_argument("--think", type=float, default=0.0, help="mean seconds bots think before each action")
+    parser.add_argument("--spectators", type=int, default=0, help="spectator bots to connect to --relay")
+    parser.add_argument("--relay", type=_parse_address, default=("localhost", RELAY_PORT),
+                        help="HOST:PORT of a spectator relay, or of a server's spectator port")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write machine-readable JSON results to this file")
+    args = parser.parse_args(argv)
+    if args.strategy == "replay" and not args.archive:
+        parser.error("--strategy replay needs --archive")
+
+    failures = []
+
+    def stop(result):
+        if isinstance(result, Failure):
+            failures.append(result)
+            result.printTraceback()
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: _run(args).addBoth(stop))
+    reactor.run()
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
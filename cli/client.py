@@ -5,24 +5,56 @@ Used for testing game logic locally
 
 from abc import ABCMeta, abstractmethod
 
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
 from twisted.protocols.basic import LineReceiver
 
-from events import from_json
+import tracing
+from cli import HEARTBEAT_SECONDS
+from events import from_json, GameState, GetGameState, Heartbeat
 
 
 class CommandLineGroupweaveClientProtocol(LineReceiver, object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self):
+    def __init__(self, clock=None):
         self.story = None
         self.name = None
+        self.game_state = None
+        self.game_state_etag = None
+        self.clock = clock or reactor
+        self.heartbeat = LoopingCall(self.sendHeartbeat)
+        self.heartbeat.clock = self.clock
+
+    def connectionMade(self):
+        self.heartbeat.start(HEARTBEAT_SECONDS, now=False)
+
+    def connectionLost(self, reason):
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+
+    def sendHeartbeat(self):
+        self.sendLine(Heartbeat().toJson())
 
     def lineReceived(self, line):
         event = from_json(line)
+        tracing.record_receipt(event, self.name)
+        if isinstance(event, GameState) and not event["not_modified"]:
+            self.game_state = event["state"]
+            self.game_state_etag = event["etag"]
         self.handleEvent(event)
 
+    def requestGameState(self):
+        """
+        Ask the server for the current game state, which is only
+        sent back if it has changed since it was last received
+        """
+        self.send(GetGameState(self.game_state_etag))
+
     def send(self, event):
+        if event.trace is None:
+            event.start_trace("client_send")
         self.sendLine(event.toJson())
 
     @abstractmethod
@@ -1,5 +1,4 @@
 import os
-import time
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 
@@ -17,9 +16,8 @@ class Player(CommandLineGroupweaveClientProtocol):
             print "{} has joined the game!".format(event["player_name"])
         elif isinstance(event, GameStarted):
             print "The game is starting!"
-            time.sleep(3)
-            os.system('clear')
-            self.submitPrompt()
+            # Pause without blocking the reactor
+            reactor.callLater(3, self.startPlaying)
         elif isinstance(event, StoryUpdate):
             self.story = event["story"]
             os.system('clear')
@@ -35,6 +33,10 @@ class Player(CommandLineGroupweaveClientProtocol):
             self.transport.loseConnection()
             reactor.stop()
 
+    def startPlaying(self):
+        os.system('clear')
+        self.submitPrompt()
+
     def submitPrompt(self):
         print "The story so far:\n\n{}\n\n".format(self.story)
         prompt = raw_input("Please type a sentence or phrase to continue the story:\n")
@@ -0,0 +1,182 @@
+"""
+Spectator relay for the command line Groupweave server.
+
+A relay holds a single spectator connection to the server and
+re-broadcasts each event it receives to the spectators connected to
+it, so the server's fan-out cost stays the same however large the
+audience grows. Each event is parsed and serialized once per relay,
+not once per spectator. Spectators of a relay may ask for the game
+state; the relay answers them from its copy, refreshing it with at
+most one request to the server at a time. The relay reconnects to
+the server if the connection is lost, and carries on relaying the
+server's next game.
+"""
+import argparse
+
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ServerEndpoint
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+from twisted.internet.task import LoopingCall
+from twisted.protocols.basic import LineReceiver
+
+from cli import HEARTBEAT_SECONDS, RELAY_PORT, SPECTATOR_PORT
+from events import Event, from_json, GameState, GetGameState, Heartbeat
+
+
+class RelayUpstream(LineReceiver):
+    """
+    The relay's connection to the server, kept alive with heartbeats
+    so that the server does not drop it as idle between events
+    """
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.heartbeat = LoopingCall(lambda: self.sendLine(Heartbeat().toJson()))
+
+    def connectionMade(self):
+        self.heartbeat.start(HEARTBEAT_SECONDS, now=False)
+        self.relay.upstreamConnected(self)
+
+    def lineReceived(self, line):
+        self.relay.upstreamLineReceived(line)
+
+    def connectionLost(self, reason):
+        if self.heartbeat.running:
+            self.heartbeat.stop()
+        self.relay.upstreamLost(self)
+
+
+class RelayedSpectator(LineReceiver):
+    """
+    A spectator connected to the relay
+    """
+
+    def __init__(self, relay):
+        self.relay = relay
+
+    def connectionMade(self):
+        self.relay.addSpectator(self)
+
+    def lineReceived(self, line):
+        event = from_json(line)
+        if isinstance(event, GetGameState):
+            self.relay.requestGameState(self, event["if_none_match"])
+
+    def connectionLost(self, reason):
+        self.relay.removeSpectator(self)
+
+
+class SpectatorRelay(Factory):
+    """
+    Accepts spectator connections and relays the events of the server's game to them
+    """
+
+    def __init__(self):
+        self.spectators = []
+        self.upstream = None
+        self.gameState = None
+        self.pendingStates = []
+        self.relayedEvents = 0
+
+    def buildProtocol(self, addr):
+        return RelayedSpectator(self)
+
+    def upstreamFactory(self):
+        """
+        :return: a client factory for connecting the relay to the server
+        """
+        return RelayUpstreamFactory(self)
+
+    def upstreamConnected(self, upstream):
+        print "Connected to the server"
+        self.upstream = upstream
+        if self.pendingStates:
+            self.upstream.sendLine(GetGameState(self.etag()).toJson())
+
+    def upstreamLost(self, upstream):
+        if self.upstream is upstream:
+            print "Lost the connection to the server"
+            self.upstream = None
+
+    def upstreamLineReceived(self, line):
+        event = from_json(line)
+        if event.type == "YourNameIs":
+            return
+        if isinstance(event, GameState):
+            self.answerGameStates(event)
+            return
+        if event.trace is not None:
+            event.mark("relay_receive")
+            line = event.stamped("relay_send").toJson()
+        self.relayedEvents += 1
+        self.broadcast(line)
+
+    def broadcast(self, line):
+        for spectator in self.spectators:
+            spectator.sendLine(line)
+
+    def addSpectator(self, spectator):
+        self.spectators.append(spectator)
+        spectator.sendLine(Event("YourNameIs", name="Spectator").toJson())
+
+    def removeSpectator(self, spectator):
+        self.spectators.remove(spectator)
+        self.pendingStates = [(pending, etag) for pending, etag in self.pendingStates if pending is not spectator]
+
+    def etag(self):
+        return self.gameState["etag"] if self.gameState is not None else None
+
+    def requestGameState(self, spectator, if_none_match):
+        """
+        Answer a spectator's GetGameState once the server has confirmed the
+        relay's copy of the state; requests made meanwhile share the answer
+        """
+        self.pendingStates.append((spectator, if_none_match))
+        if len(self.pendingStates) == 1 and self.upstream is not None:
+            self.upstream.sendLine(GetGameState(self.etag()).toJson())
+
+    def answerGameStates(self, response):
+        pending, self.pendingStates = self.pendingStates, []
+        if response["etag"] is None:
+            # The server has no game yet
+            self.gameState = None
+            for spectator, if_none_match in pending:
+                spectator.sendLine(response.toJson())
+            return
+        if not response["not_modified"]:
+            self.gameState = response
+        if self.gameState is None:
+            return
+        full = self.gameState.toJson()
+        not_modified = GameState(self.etag(), not_modified=True).toJson()
+        for spectator, if_none_match in pending:
+            spectator.sendLine(not_modified if if_none_match == self.etag() else full)
+
+
+class RelayUpstreamFactory(ReconnectingClientFactory):
+    maxDelay = 5
+
+    def __init__(self, relay):
+        self.relay = relay
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return RelayUpstream(self.relay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay a Groupweave CLI server's game to many spectators")
+    parser.add_argument("--server", default="localhost", help="host of the CLI server")
+    parser.add_argument("--server-port", type=int, default=SPECTATOR_PORT,
+                        help="the server's spectator port")
+    parser.add_argument("--port", type=int, default=RELAY_PORT, help="port spectators connect to")
+    args = parser.parse_args()
+
+    relay = SpectatorRelay()
+    reactor.connectTCP(args.server, args.server_port, relay.upstreamFactory())
+    TCP4ServerEndpoint(reactor, args.port).listen(relay)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
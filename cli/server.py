@@ -2,17 +2,29 @@
 Command line runner for the Groupweave backend,
 to be used for local testing
 """
+import os
 import sys
+import time
 
 from twisted.internet import reactor
 from twisted.internet.endpoints import TCP4ServerEndpoint
 from twisted.internet.protocol import Factory
+from twisted.internet.task import LoopingCall
 from twisted.protocols.basic import LineReceiver
 
+import archive
 import game
-from cli import SERVER_PORT
-from events import Event, Prompt, from_json, StartGame, ChoosePrompt
+import profiling
+import recording
+from cli import HEARTBEAT_SECONDS, SERVER_PORT, SPECTATOR_PORT
+from events import Event, Prompt, from_json, StartGame, ChoosePrompt, GetGameState, GameState, Heartbeat
 from gameutil import GameReference
+from timerwheel import TimerWheel
+
+ARCHIVE_DIR = os.environ.get("GROUPWEAVE_ARCHIVE_DIR")
+DEADLINE_TICK_SECONDS = 0.5
+# Connections nothing has been received on for this long are dropped (0 to never drop them)
+IDLE_TIMEOUT_SECONDS = float(os.environ.get("GROUPWEAVE_IDLE_TIMEOUT", "300"))
 
 
 class CommandLineGroupweaveBackend(LineReceiver):
@@ -21,18 +33,23 @@ class CommandLineGroupweaveBackend(LineReceiver):
     as a TCP server
     """
 
-    def __init__(self, factory, game):
+    def __init__(self, factory, game, number):
         self.game = game
         self.factory = factory
         self.player = None
+        self.number = number
+        self.lastSeen = time.time()
 
     def attachPlayer(self, player):
         self.player = player
 
     def connectionMade(self):
+        recording.record({'op': "connect", 'c': self.number})
+        self.keepAlive()
         self.player.notify(Event("YourNameIs", name=self.player.name))
         try:
-            self.player.join(self.game)
+            with self.factory.profiling():
+                self.player.join(self.game)
         except RuntimeError:
             print >> sys.stderr, "Rejecting new connection because game has already started"
             self.transport.loseConnection()
@@ -42,14 +59,61 @@ class CommandLineGroupweaveBackend(LineReceiver):
         print "[raw data] {}".format(data)
         LineReceiver.dataReceived(self, data)
 
+    def keepAlive(self):
+        # Let the OS detect peers that vanished without closing their connection
+        if hasattr(self.transport, "setTcpKeepAlive"):
+            self.transport.setTcpKeepAlive(True)
+
     def lineReceived(self, line):
+        self.lastSeen = time.time()
+        recording.record({'op': "line", 'c': self.number, 'l': line})
         event = from_json(line)
-        self.factory.handleEvent(event)
+        if event.trace is None:
+            event.start_trace("server_receive")
+        else:
+            event.mark("server_receive")
+        self.factory.handleEvent(event, self)
 
     def connectionLost(self, reason):
+        recording.record({'op': "close", 'c': self.number})
         self.factory.removeClient(self)
 
 
+class SpectatorConnection(CommandLineGroupweaveBackend):
+    """
+    A spectator connected to the server, which is typically a relay
+    (see cli.relay) re-broadcasting to many spectators of its own.
+    Spectators can only ask for the game state, and are not recorded.
+    """
+
+    def __init__(self, factory):
+        CommandLineGroupweaveBackend.__init__(self, factory, None, None)
+        self.player = Spectator(self)
+
+    def connectionMade(self):
+        self.keepAlive()
+        self.player.notify(Event("YourNameIs", name=self.player.name))
+        self.factory.addSpectator(self)
+
+    def joinGame(self, current_game):
+        """
+        Watch the given game, if it has not started yet; otherwise wait for the next one
+        """
+        if isinstance(current_game.game, game.CreatedGame):
+            self.player.join(current_game)
+
+    def lineReceived(self, line):
+        self.lastSeen = time.time()
+        event = from_json(line)
+        if isinstance(event, GetGameState):
+            self.factory.sendGameState(event, self)
+        elif not isinstance(event, Heartbeat):
+            print >> sys.stderr, "Ignoring {} from a spectator".format(event.type)
+
+    def connectionLost(self, reason):
+        self.factory.removeSpectator(self)
+
+
 class Player(game.Player):
     def __init__(self, name, protocol):
         self._name = name
@@ -60,7 +124,7 @@ class Player(game.Player):
         return self._name
 
     def notify(self, event):
-        self._protocol.sendLine(event.toJson())
+        self._protocol.sendLine(event.stamped("socket_send").toJson())
 
     def join(self, game):
         game.register_player(self)
@@ -71,6 +135,14 @@ class Host(Player):
         pass
 
 
+class Spectator(Player):
+    def __init__(self, protocol):
+        super(Spectator, self).__init__("Spectator", protocol)
+
+    def join(self, game):
+        game.register_spectator(self)
+
+
 class DummyIdFactory(object):
     def new_id(self):
         return "0001"
@@ -80,42 +152,153 @@ class CommandLineGroupweaveFactory(Factory):
     def __init__(self):
         self.game = None
         self.clients = []
+        self.spectators = []
+        self.profiler = None
+        # Players are numbered as they connect, so names are not reused once players leave
+        self.playersConnected = 0
+        self.version = 0
+        self.completed = False
+        self.deadlines = TimerWheel(DEADLINE_TICK_SECONDS, start=time.time())
+        self.deadlineTimer = None
+        self.deadlineKey = None
+        self.deadlineLoop = LoopingCall(self.tickDeadlines)
+        self.presenceLoop = LoopingCall(self.dropIdleClients)
 
     def startFactory(self):
         print "Starting up Groupweave server"
+        self.deadlineLoop.start(DEADLINE_TICK_SECONDS, now=False)
+        if IDLE_TIMEOUT_SECONDS > 0:
+            self.presenceLoop.start(HEARTBEAT_SECONDS, now=False)
         Factory.startFactory(self)
 
     def stopFactory(self):
         print "Stopping Groupweave server"
+        if self.deadlineLoop.running:
+            self.deadlineLoop.stop()
+        if self.presenceLoop.running:
+            self.presenceLoop.stop()
+        self.writeProfile()
         for client in self.clients:
             client.sendMessage("Server is shutting down!")
             client.transport.loseConnection()
+        for spectator in self.spectators:
+            spectator.transport.loseConnection()
         Factory.stopFactory(self)
 
     def buildProtocol(self, addr):
-        protocol = CommandLineGroupweaveBackend(self, self.game)
+        protocol = CommandLineGroupweaveBackend(self, self.game, self.numClients)
         if self.numClients == 0:
             print "Host connected!"
             host = Host("Host", protocol)
             protocol.attachPlayer(host)
-            self.game = GameReference(game.GameFactory(DummyIdFactory()).new_game(host))
+            self.game = GameReference(game.GameFactory(DummyIdFactory()).new_game(host), self.gameChanged)
+            self.version = 1
+            self.completed = False
+            self.playersConnected = 0
+            for spectator in self.spectators:
+                spectator.joinGame(self.game)
+            if profiling.should_profile_game(self.game.id):
+                print "Profiling game {}".format(self.game.id)
+                self.profiler = profiling.Profiler()
         else:
             print "Player connected!"
-            player_name = "Player {}".format(len(self.game.players))
+            player_name = "Player {}".format(self.playersConnected)
+            self.playersConnected += 1
             player = Player(player_name, protocol)
             protocol.attachPlayer(player)
         self.clients.append(protocol)
         return protocol
 
-    def handleEvent(self, event):
-        if isinstance(event, StartGame):
-            self.game.start()
-        elif isinstance(event, Prompt):
-            self.game.receive_prompt(event)
-        elif isinstance(event, ChoosePrompt):
-            self.game.choose_prompt(event)
+    def gameChanged(self, method_name, args, kwargs):
+        self.version += 1
+        self.scheduleDeadline()
+
+    def scheduleDeadline(self):
+        """
+        Start the clock on the round deadline the game is now waiting on, if it changed
+        """
+        deadline = game.round_deadline(self.game.game)
+        key = (deadline.phase, deadline.round) if deadline is not None else None
+        if key == self.deadlineKey:
+            return
+        if self.deadlineTimer is not None:
+            self.deadlineTimer.cancel()
+            self.deadlineTimer = None
+        self.deadlineKey = key
+        if deadline is not None:
+            self.deadlineTimer = self.deadlines.schedule(deadline.seconds, self.expireDeadline, deadline)
+
+    def tickDeadlines(self):
+        self.deadlines.advance(time.time())
+
+    def expireDeadline(self, deadline):
+        current = game.round_deadline(self.game.game)
+        if current is None or (current.phase, current.round) != (deadline.phase, deadline.round):
+            return
+        print "Round {} deadline passed while {}".format(deadline.round, deadline.phase)
+        self.deadlineTimer = None
+        with self.profiling():
+            getattr(self.game, deadline.action)()
+        self.afterTransition()
+
+    def handleEvent(self, event, sender=None):
+        if isinstance(event, GetGameState):
+            self.sendGameState(event, sender)
+            return
+        if isinstance(event, Heartbeat):
+            return
+        with self.profiling():
+            if isinstance(event, StartGame):
+                self.game.start()
+            elif isinstance(event, Prompt):
+                self.game.receive_prompt(event)
+            elif isinstance(event, ChoosePrompt):
+                self.game.choose_prompt(event)
+            else:
+                print "Unhandled event received: {}".format(event)
+        self.afterTransition()
+
+    def afterTransition(self):
+        if isinstance(self.game.game, game.CompleteGame) and not self.completed:
+            self.completed = True
+            recording.record_done(self.game.id, self.game.story)
+            self.writeProfile()
+            self.archiveGame()
+
+    def sendGameState(self, request, client):
+        """
+        Answer a GetGameState request, with only the etag if the
+        client's copy of the state is still current, or with neither
+        an etag nor a state if there is no game yet
+        """
+        if self.game is None:
+            client.sendLine(GameState(None).toJson())
+            return
+        etag = "{}-{}".format(self.game.id, self.version)
+        if request["if_none_match"] == etag:
+            response = GameState(etag, not_modified=True)
         else:
-            print "Unhandled event received: {}".format(event)
+            response = GameState(etag, game.state_view(self.game.game))
+        client.sendLine(response.toJson())
+
+    def archiveGame(self):
+        """
+        Archive the completed game, if GROUPWEAVE_ARCHIVE_DIR is set
+        """
+        if ARCHIVE_DIR:
+            archive.DirectoryArchive(ARCHIVE_DIR).append([archive.game_record(self.game.game)])
+            print "Archived game {} to {}".format(self.game.id, ARCHIVE_DIR)
+
+    def profiling(self):
+        """
+        :return: a context manager that profiles the current game, if it is being profiled
+        """
+        return self.profiler if self.profiler is not None else profiling.NOT_PROFILING
+
+    def writeProfile(self):
+        if self.profiler is not None:
+            print "Wrote profile {}".format(self.profiler.write("server-{}".format(self.game.id)))
+            self.profiler = None
 
     @property
     def numClients(self):
@@ -123,9 +306,57 @@ class CommandLineGroupweaveFactory(Factory):
 
     def removeClient(self, client):
         self.clients.remove(client)
+        self.evict(client)
+
+    def addSpectator(self, spectator):
+        self.spectators.append(spectator)
+        if self.game is not None:
+            spectator.joinGame(self.game)
+
+    def removeSpectator(self, spectator):
+        self.spectators.remove(spectator)
+        self.evict(spectator)
+
+    def evict(self, client):
+        """
+        Stop notifying a client that has gone, and stop waiting for it to play
+        """
+        participant = client.player
+        current = self.game
+        if current is None or not (participant is current.host or participant in current.players
+                                   or participant in current.spectators):
+            return
+        print "{} has left the game".format(participant.name)
+        with self.profiling():
+            current.evict(participant)
+        self.afterTransition()
+
+    def dropIdleClients(self, now=None):
+        """
+        Drop connections nothing has been received on, not even a Heartbeat,
+        for IDLE_TIMEOUT_SECONDS; dropping them evicts their participants
+        """
+        now = time.time() if now is None else now
+        for client in self.clients + self.spectators:
+            if now - client.lastSeen > IDLE_TIMEOUT_SECONDS:
+                print "Dropping idle connection of {}".format(client.player.name)
+                client.transport.abortConnection()
+
+
+class SpectatorFactory(Factory):
+    """
+    Accepts spectator connections to the game run by a CommandLineGroupweaveFactory
+    """
+
+    def __init__(self, game_factory):
+        self.game_factory = game_factory
+
+    def buildProtocol(self, addr):
+        return SpectatorConnection(self.game_factory)
 
 
 if __name__ == "__main__":
-    endpoint = TCP4ServerEndpoint(reactor, SERVER_PORT)
-    endpoint.listen(CommandLineGroupweaveFactory())
+    groupweave_factory = CommandLineGroupweaveFactory()
+    TCP4ServerEndpoint(reactor, SERVER_PORT).listen(groupweave_factory)
+    TCP4ServerEndpoint(reactor, SPECTATOR_PORT).listen(SpectatorFactory(groupweave_factory))
     reactor.run()
@@ -3,17 +3,51 @@ Events that are used to communicate game state
 between the host and the players
 """
 
+import copy
 import json
+import time
+import uuid
+
+import payload
 
 
 class Event(object):
     """
     Base class for in-game events
+
+    An event may carry a trace: a correlation id plus the
+    (hop, timestamp) pairs recorded as the action that caused
+    it travelled from the caller towards each recipient.
+    Traces are not considered when comparing events.
+
+    An event sent to a participant's queue also carries its sequence
+    number among the events sent to that queue (see aws.consumer),
+    which is not considered when comparing events either.
+
+    The properties of a large event may be packed (see payload.py)
+    when it is serialized, in which case they are only unpacked
+    when they are first used. Copies of an event made for its
+    recipients share its packed properties, so an event sent to
+    many recipients is packed once.
     """
 
     def __init__(self, event_type, **properties):
         self.type = event_type
         self._properties = properties
+        self.trace = None
+        self.seq = None
+
+    @property
+    def _properties(self):
+        if self._packed is not None:
+            self._unpacked = json.loads(payload.unpack_text(self._packed))
+            self._packed = None
+        return self._unpacked
+
+    @_properties.setter
+    def _properties(self, properties):
+        self._unpacked = properties
+        self._packed = None
 
     def __getitem__(self, item):
         return self._properties[item]
@@ -26,13 +60,86 @@ class Event(object):
                 and (other.type == self.type)
                 and (other._properties == self._properties))
 
-    def toJson(self):
+    def start_trace(self, hop, trace_id=None, at=None):
+        """
+        Begin a new trace at this event
+        :param hop: the name of the first hop, e.g. "submit_prompt"
+        :param trace_id: a caller-supplied correlation id, or None to generate one
+        :param at: when the first hop happened, defaults to now
+        :return: this Event
+        """
+        self.trace = {'id': trace_id or uuid.uuid4().hex, 'hops': [[hop, at or time.time()]]}
+        return self
+
+    def continue_trace(self, cause, hop):
+        """
+        Continue the trace (if any) of the event that caused this one
+        :return: this Event
+        """
+        if cause is not None and cause.trace is not None:
+            self.trace = {'id': cause.trace['id'], 'hops': [list(h) for h in cause.trace['hops']]}
+            self.mark(hop)
+        return self
+
+    def mark(self, hop):
+        """
+        Record that this event has reached the given hop, if it is traced
+        """
+        if self.trace is not None:
+            self.trace['hops'].append([hop, time.time()])
+
+    def stamped(self, hop):
+        """
+        :return: a copy of this event with the given hop added to its trace,
+                 for recording per-recipient hops without affecting other recipients,
+                 or this event itself if it is not traced
+        """
+        if self.trace is None:
+            return self
+        stamped = self._copy()
+        stamped.trace = {'id': self.trace['id'], 'hops': self.trace['hops'] + [[hop, time.time()]]}
+        return stamped
+
+    def sequenced(self, seq):
+        """
+        :return: a copy of this event with the given sequence number
+        """
+        sequenced = self._copy()
+        sequenced.seq = seq
+        return sequenced
+
+    def _copy(self):
+        if getattr(self, '_packings', None) is None:
+            self._packings = {}
+        return copy.copy(self)
+
+    def _pack(self, max_bytes, shared):
+        packings = getattr(self, '_packings', None)
+        if packings is None:
+            packings = self._packings = {}
+        if (max_bytes, shared) not in packings:
+            packings[(max_bytes, shared)] = payload.pack_text(json.dumps(self._properties), max_bytes, shared)
+        return packings[(max_bytes, shared)]
+
+    def toJson(self, max_bytes=None, shared=False):
         """
         Serialize this Event to a string
+        :param max_bytes: if given, pack the properties of a large event to stay under this size
+        :param shared: whether the event is read on other machines (see payload.pack)
         :return: a JSON string
         """
-        return json.dumps({'type': self.type,
-                           'properties': self._properties})
+        serialized = {'type': self.type,
+                      'properties': self._properties}
+        if max_bytes is not None:
+            packed = self._pack(max_bytes, shared)
+            if packed is not None:
+                serialized = {'type': self.type,
+                              'packed': packed}
+        if self.trace is not None:
+            serialized['trace'] = self.trace
+        if self.seq is not None:
+            serialized['seq'] = self.seq
+        return json.dumps(serialized)
 
 
 class PlayerJoined(Event):
@@ -107,20 +214,59 @@ class Done(Event):
         super(Done, self).__init__(self.__class__.__name__, winner=winner, story=story)
 
 
+class GetGameState(Event):
+    """
+    Event that requests the current state of the game, e.g. after reconnecting
+    """
+
+    def __init__(self, if_none_match=None):
+        super(GetGameState, self).__init__(self.__class__.__name__, if_none_match=if_none_match)
+
+
+class GameState(Event):
+    """
+    Event that answers a GetGameState request. The state is None
+    if it has not changed since the etag given in the request, and
+    both the etag and the state are None if there is no game yet.
+    """
+
+    def __init__(self, etag, state=None, not_modified=False):
+        super(GameState, self).__init__(self.__class__.__name__, etag=etag, state=state, not_modified=not_modified)
+
+
+class Heartbeat(Event):
+    """
+    Event a client sends now and then to show that it is still connected
+    """
+
+    def __init__(self):
+        super(Heartbeat, self).__init__(self.__class__.__name__)
+
+
 _EVENT_SUBCLASSES = {name: cls for (name, cls) in [(cls.__name__, cls) for cls in Event.__subclasses__()]}
 
 
 def from_json(str):
     """
     Deserializes a JSON string into an Event, attempting to construct
-    an Event subclass of the appropriate type.
+    an Event subclass of the appropriate type. Packed properties are
+    left to be unpacked when they are first used.
     """
 
     deserialized = json.loads(str)
     event_type = deserialized['type']
-    event_properties = deserialized['properties']
 
-    if event_type in _EVENT_SUBCLASSES:
-        return _EVENT_SUBCLASSES[event_type](**event_properties)
+    if 'packed' in deserialized:
+        cls = _EVENT_SUBCLASSES.get(event_type, Event)
+        event = cls.__new__(cls)
+        event.type = event_type
+        event._packed = deserialized['packed']
     else:
-        return Event(event_type, **event_properties)
+        event_properties = deserialized['properties']
+        if event_type in _EVENT_SUBCLASSES:
+            event = _EVENT_SUBCLASSES[event_type](**event_properties)
+        else:
+            event = Event(event_type, **event_properties)
+    event.trace = deserialized.get('trace')
+    event.seq = deserialized.get('seq')
+    return event
@@ -1,11 +1,23 @@
 """
 Module for modeling a game of Groupweave
 """
+import os
+import threading
+import time
 from abc import ABCMeta, abstractmethod, abstractproperty
+from collections import namedtuple
+from contextlib import contextmanager
 
+import metrics
+import moderation
 from events import *
 
 TOTAL_ROUNDS = 10
+# Seconds players have to submit prompts, and the host has to choose one, each round (0 for no limit)
+SUBMISSION_SECONDS = int(os.environ.get("GROUPWEAVE_SUBMISSION_SECONDS", "180"))
+CHOICE_SECONDS = int(os.environ.get("GROUPWEAVE_CHOICE_SECONDS", "120"))
+# Callables each round's prompts, by player name, pass through before the host sees them
+PROMPT_STAGES = moderation.configured_stages()
 
 
 class NotificationManager(object):
@@ -16,6 +28,7 @@ class NotificationManager(object):
     def __init__(self):
         super(NotificationManager, self).__init__()
         self._registry = {}
+        self._muted = False
 
     def subscribe(self, player, *event_types):
         """
@@ -34,8 +47,117 @@ class NotificationManager(object):
         Publish an event, notify all players who are subscribed to that event type
         :param event: the events.Event instance to publish
         """
-        for player in self._registry[type(event)]:
-            player.notify(event)
+        if getattr(self, '_muted', False):
+            for player in self._registry.get(type(event), ()):
+                player.skipped(event)
+            return
+        event.mark("publish")
+        with metrics.phase("Publish"):
+            subscribers = self._registry[type(event)]
+            for player in subscribers:
+                player.notify(event)
+        metrics.increment("Notifications", len(subscribers))
+
+    def unsubscribe(self, player):
+        """
+        Stop notifying the given player of any event
+        """
+        for subscribers in self._registry.values():
+            while player in subscribers:
+                subscribers.remove(player)
+
+    @contextmanager
+    def muted(self):
+        """
+        Context manager within which published events are
+        not delivered, e.g. while replaying past actions;
+        subscribers are told that they skipped them instead
+        """
+        self._muted = True
+        try:
+            yield
+        finally:
+            self._muted = False
+
+
+_clock = threading.local()
+
+
+def now():
+    """
+    :return: the time of the transition being applied: the current time,
+             or the recorded time of a replayed transition (None if unknown)
+    """
+    if getattr(_clock, "replaying", False):
+        return _clock.at
+    return time.time()
+
+
+@contextmanager
+def replayed_at(timestamp):
+    """
+    Context manager within which transitions are timed as
+    if they happened at the given time, e.g. while replaying
+    past actions; None if the time was not recorded
+    """
+    _clock.replaying, _clock.at = True, timestamp
+    try:
+        yield
+    finally:
+        _clock.replaying, _clock.at = False, None
+
+
+class GameStats(object):
+    """
+    Gameplay statistics of a single game, kept up to date by its transitions
+    """
+
+    def __init__(self):
+        self.players = 0
+        self.round_started_at = None
+        self.round_durations = []
+        self.prompts = {}
+        self.chosen = {}
+        self.default_choices = 0
+        self.completed = False
+
+    def started(self, at, players):
+        self.players = players
+        self.round_started_at = at
+
+    def prompt_submitted(self, player_name):
+        self.prompts[player_name] = self.prompts.get(player_name, 0) + 1
+
+    def round_completed(self, at, chosen_player=None, default=False):
+        """
+        :param chosen_player: the name of the player whose prompt was chosen, if any
+        :param default: whether the prompt was chosen on behalf of the host
+        """
+        if at is not None and self.round_started_at is not None:
+            self.round_durations.append(round(at - self.round_started_at, 3))
+        self.round_started_at = at
+        if chosen_player is not None:
+            self.chosen[chosen_player] = self.chosen.get(chosen_player, 0) + 1
+        if default:
+            self.default_choices += 1
+
+    def game_completed(self):
+        self.completed = True
+
+    def totals(self):
+        """
+        :return: a dict of the counters this game adds to the global statistics
+        """
+        return {
+            'GamesStarted': 1 if self.players else 0,
+            'GamesCompleted': 1 if self.completed else 0,
+            'Players': self.players,
+            'Rounds': len(self.round_durations),
+            'RoundMillis': int(sum(self.round_durations) * 1000),
+            'Prompts': sum(self.prompts.values()),
+            'PromptsChosen': sum(self.chosen.values()),
+            'DefaultChoices': self.default_choices
+        }
 
 
 class GameFactory(object):
@@ -43,16 +165,20 @@ class GameFactory(object):
     Factory for creating a new game
     """
 
-    def __init__(self, id_generator, notification_manager=NotificationManager()):
+    def __init__(self, id_generator, notification_manager=None):
         self.id_generator = id_generator
         self.notification_manager = notification_manager
 
     def new_game(self, host):
         """
-        :return: a new CreatedGame
+        :return: a new CreatedGame, with its own NotificationManager
+                 unless this factory was given one to use
         """
-        self.notification_manager.subscribe(host, PlayerJoined, NewPrompts, Done)
-        return CreatedGame(host, self.id_generator.new_id(), self.notification_manager)
+        notification_manager = self.notification_manager
+        if notification_manager is None:
+            notification_manager = NotificationManager()
+        notification_manager.subscribe(host, PlayerJoined, NewPrompts, Done)
+        return CreatedGame(host, self.id_generator.new_id(), notification_manager)
 
 
 def copy_value(override_value, copy_from, attr_name):
@@ -86,7 +212,7 @@ class Game(object):
 
     def __init__(self, host=None, game_id=None, players=None, story=None,
                  current_round=None, spectators=None, notification_manager=None,
-                 copy_from=None):
+                 rounds=None, copy_from=None):
         self._current_round = copy_value(current_round, copy_from, "_current_round")
         self._players = copy_value(players, copy_from, "_players")
         self._host = copy_value(host, copy_from, "_host")
@@ -94,6 +220,9 @@ class Game(object):
         self._story = copy_value(story, copy_from, "_story")
         self._spectators = copy_value(spectators, copy_from, "_spectators")
         self._notification_manager = copy_value(notification_manager, copy_from, "_notification_manager")
+        # Games stored before rounds were recorded have no history to copy
+        self._rounds = rounds if rounds is not None else getattr(copy_from, "_rounds", ())
+        self._stats = getattr(copy_from, "_stats", None)
 
     @property
     def host(self):
@@ -119,6 +248,37 @@ class Game(object):
     def round_number(self):
         return self._current_round
 
+    @property
+    def rounds(self):
+        """
+        :return: a tuple of the completed rounds, each a dict of the
+                 round number, the submitted prompts and the chosen prompt
+        """
+        return getattr(self, "_rounds", ())
+
+    @property
+    def stats(self):
+        """
+        :return: the GameStats of this game
+        """
+        # Games stored before statistics were kept start counting from when they are next loaded
+        if getattr(self, "_stats", None) is None:
+            self._stats = GameStats()
+        return self._stats
+
+    def evict(self, participant):
+        """
+        Stop notifying a participant who has left the game, and drop them
+        from its players or spectators. The host stays the host.
+        :return: the game, which may have moved on if it was only waiting for the participant
+        """
+        self._notification_manager.unsubscribe(participant)
+        if participant in self._players:
+            self._players.remove(participant)
+        if participant in self._spectators:
+            self._spectators.remove(participant)
+        return self
+
 
 class CreatedGame(Game):
     """
@@ -161,6 +321,7 @@ class CreatedGame(Game):
         :return: a WaitForSubmissionsGame
         """
         self._notification_manager.publish(GameStarted())
+        self.stats.started(now(), len(self.players))
         return WaitForSubmissionsGame(copy_from=self)
 
 
@@ -182,12 +343,51 @@ class WaitForSubmissionsGame(Game):
         if player_name in self.prompts:
             raise RuntimeError("{} has already submitted a prompt this round!".format(player_name))
         self._prompts[player_name] = prompt["prompt"]
+        self.stats.prompt_submitted(player_name)
+
+        if len(self.prompts) >= len(self.players):
+            return self._present_prompts(prompt)
+        return self
 
-        if len(self.prompts) == len(self.players):
-            self._notification_manager.publish(NewPrompts(prompts=self.prompts.values()))
-            return ChoosingGame(copy_from=self)
+    def evict(self, participant):
+        """
+        Drop the prompt of a player who has left, so that the round
+        only waits for the players who remain
+        :return: this game, or if every remaining player has submitted
+                 a prompt, the game close_round returns
+        """
+        if participant in self._players:
+            self._prompts.pop(participant.name, None)
+        super(WaitForSubmissionsGame, self).evict(participant)
+        if len(self.prompts) >= len(self.players):
+            return self.close_round()
         return self
 
+    def close_round(self):
+        """
+        Stop waiting for submissions once the round's deadline has passed
+        :return: a ChoosingGame of the prompts that did arrive, or a
+                 CompleteGame if nobody submitted a prompt at all
+        """
+        if not self.prompts:
+            self._notification_manager.publish(Done(winner="Nobody", story=self.story))
+            self.stats.round_completed(now())
+            self.stats.game_completed()
+            return CompleteGame(copy_from=self)
+        return self._present_prompts()
+
+    def _present_prompts(self, cause=None):
+        """
+        Pass the round's prompts through the prompt stages and present them to the host
+        :param cause: the event that closed submissions, whose trace is continued
+        :return: a ChoosingGame of the prompts as presented
+        """
+        prompts = self.prompts
+        for stage in PROMPT_STAGES:
+            prompts = stage(prompts)
+        self._notification_manager.publish(NewPrompts(prompts=prompts.values()).continue_trace(cause, "transition"))
+        return ChoosingGame(copy_from=self, prompts=prompts)
+
     @property
     def prompts(self):
         return dict(self._prompts)
@@ -198,16 +398,46 @@ class ChoosingGame(Game):
     A game in the CHOOSING state
     """
 
-    def choose_prompt(self, choice):
+    def __init__(self, *args, **kwargs):
+        """
+        :param prompts: keyword only, the prompts submitted this round by player name
+        """
+        prompts = kwargs.pop("prompts", None)
+        super(ChoosingGame, self).__init__(*args, **kwargs)
+        self._prompts = prompts if prompts is not None else {}
+
+    def choose_prompt(self, choice, default=False):
+        """
+        :param default: whether the prompt is chosen on behalf of the host
+        """
         updated_story = "{} {}".format(self.story, choice['choice'])
+        rounds = self.rounds + ({'round': self.round_number, 'prompts': self.prompts, 'choice': choice['choice']},)
+        chosen_players = sorted(name for name, prompt in self.prompts.items() if prompt == choice['choice'])
+        self.stats.round_completed(now(), chosen_players[0] if chosen_players else None, default)
 
         if self.round_number == TOTAL_ROUNDS:
-            self._notification_manager.publish(Done(winner="Everybody!", story=updated_story))
-            return CompleteGame(copy_from=self, story=updated_story, current_round=TOTAL_ROUNDS)
+            self.stats.game_completed()
+            self._notification_manager.publish(Done(winner="Everybody!", story=updated_story)
+                                               .continue_trace(choice, "transition"))
+            return CompleteGame(copy_from=self, story=updated_story, current_round=TOTAL_ROUNDS, rounds=rounds)
         else:
             is_final_round = self.round_number == (TOTAL_ROUNDS - 1)
-            self._notification_manager.publish(StoryUpdate(updated_story, is_final_round=is_final_round))
-            return WaitForSubmissionsGame(copy_from=self, story=updated_story, current_round=self.round_number + 1)
+            self._notification_manager.publish(StoryUpdate(updated_story, is_final_round=is_final_round)
+                                               .continue_trace(choice, "transition"))
+            return WaitForSubmissionsGame(copy_from=self, story=updated_story, current_round=self.round_number + 1,
+                                          rounds=rounds)
+
+    def choose_default(self):
+        """
+        Choose a prompt on behalf of the host once the round's deadline has passed
+        :return: the game returned by choose_prompt
+        """
+        return self.choose_prompt(ChoosePrompt(self.prompts[sorted(self.prompts)[0]]), default=True)
+
+    @property
+    def prompts(self):
+        # Games stored before prompts were kept while choosing have none
+        return dict(getattr(self, "_prompts", {}))
 
 
 class CompleteGame(Game):
@@ -216,6 +446,74 @@ class CompleteGame(Game):
     """
 
 
+_PHASES = {
+    CreatedGame: "CREATED",
+    WaitForSubmissionsGame: "WAIT_FOR_SUBMISSIONS",
+    ChoosingGame: "CHOOSING",
+    CompleteGame: "COMPLETE"
+}
+
+
+RoundDeadline = namedtuple("RoundDeadline", ["phase", "round", "seconds", "action"])
+
+_DEADLINES = {
+    WaitForSubmissionsGame: lambda: (SUBMISSION_SECONDS, "close_round"),
+    ChoosingGame: lambda: (CHOICE_SECONDS, "choose_default")
+}
+
+
+def round_deadline(game):
+    """
+    :return: the RoundDeadline the game is currently waiting on, or None.
+             Its action names the game method to call once it has passed;
+             the phase and round identify it, so that a deadline which
+             fires after the game has moved on can be ignored.
+    """
+    if type(game) not in _DEADLINES:
+        return None
+    seconds, action = _DEADLINES[type(game)]()
+    if seconds <= 0:
+        return None
+    return RoundDeadline(_PHASES[type(game)], game.round_number, seconds, action)
+
+
+def state_view(game):
+    """
+    Project a game onto the state a (re)connecting client needs to catch up
+    :return: a JSON-serializable dict
+    """
+    view = {
+        'gameId': game.id,
+        'phase': _PHASES[type(game)],
+        'round': game.round_number,
+        'totalRounds': TOTAL_ROUNDS,
+        'story': game.story,
+        'host': game.host.name,
+        'players': [player.name for player in game.players],
+        'spectators': len(game.spectators)
+    }
+    if isinstance(game, WaitForSubmissionsGame):
+        view['submitted'] = sorted(game.prompts)
+    view['stats'] = stats_view(game)
+    return view
+
+
+def stats_view(game):
+    """
+    Summarize the statistics of a game
+    :return: a JSON-serializable dict
+    """
+    stats = game.stats
+    durations = stats.round_durations
+    return {
+        'rounds': len(durations),
+        'averageRoundSeconds': round(sum(durations) / len(durations), 3) if durations else None,
+        'promptsPerPlayer': dict(stats.prompts),
+        'chosenPerPlayer': dict(stats.chosen),
+        'defaultChoices': stats.default_choices
+    }
+
+
 class Player(object):
     """
     A single player in a game of Groupweave
@@ -223,6 +521,8 @@ class Player(object):
 
     __metaclass__ = ABCMeta
 
+    __slots__ = ()
+
     @abstractmethod
     def join(self, game):
         pass
@@ -236,6 +536,14 @@ class Player(object):
         """
         pass
 
+    def skipped(self, event):
+        """
+        Called instead of notify for an event published while
+        notifications are muted, i.e. one the player was already
+        notified of when the action that caused it first happened
+        """
+        pass
+
     @abstractproperty
     def name(self):
         pass
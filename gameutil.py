@@ -11,8 +11,14 @@ class GameReference(object):
     transitions happen in multiple places
     """
 
-    def __init__(self, initialGame):
+    def __init__(self, initialGame, listener=None):
+        """
+        :param listener: optional callable that is told the name,
+                         args and kwargs of every game method called
+                         through this reference, after it returns
+        """
         self.game = initialGame
+        self.listener = listener
 
     def __getattr__(self, item):
         game_attr = getattr(self.game, item)
@@ -30,4 +36,6 @@ class MethodReference(object):
         return_val = self.originalMethod(*args, **kwargs)
         if issubclass(return_val.__class__, game.Game):
             self.gameReference.game = return_val
+        if self.gameReference.listener is not None:
+            self.gameReference.listener(self.originalMethod.__name__, args, kwargs)
         return return_val
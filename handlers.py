@@ -2,12 +2,24 @@
 Handlers for calling into the game backend via AWS Lambda
 """
 import json
+import time
 import uuid
 
 import sys
 
-from aws import GameWrapperFactory, Host, Player, dynamo, sqs, Spectator
+import metrics
+from metrics import HandlerMetrics
+from profiling import HandlerProfile
+from recording import recorded
+from aws import GameWrapperFactory, Host, Player, deadlines, dynamo, eventlog, gamestats, participants, s3archive, sqs, \
+    Spectator
+from aws.admission import Admission, RejectedError
+from aws.idempotency import IdempotentRequest
 from events import Prompt, ChoosePrompt
+from game import CompleteGame, round_deadline, state_view
+
+# The most games create_games provisions in one invocation
+MAX_GAMES_PER_REQUEST = 200
 
 
 class AuthorizationError(StandardError):
@@ -31,21 +43,35 @@ class ErrorHandler(object):
         pass
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type is AuthorizationError:
-            raise RuntimeError("Authorization Error: {}".format(exc_val))
+        if exc_type in (AuthorizationError, RejectedError):
+            raise RuntimeError(describe_error(exc_type, exc_val))
         elif exc_type is not None:
             print >> sys.stderr, exc_tb
-            raise RuntimeError("Server Error: {}".format(exc_val))
+            raise RuntimeError(describe_error(exc_type, exc_val))
         else:
             pass
 
 
+def describe_error(exc_type, exc_val):
+    """
+    :return: the message reported to callers for an error raised by a handler
+    """
+    if exc_type is AuthorizationError:
+        return "Authorization Error: {}".format(exc_val)
+    if exc_type is RejectedError:
+        return "Rejected: {}".format(exc_val)
+    return "Server Error: {}".format(exc_val)
+
+
+@recorded
 def create_game(event, context):
     """
     Called when somebody wants to create a new game.
 
     The event is expected to contain the following parameter(s):
     - name: the name of the player hosting the game
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the action being applied again
 
     Returns the following:
     - gameId: the unique four-letter ID of the new game
@@ -54,15 +80,52 @@ def create_game(event, context):
                  to identify the requester as the host
     - queueUrl: the URL of the SQS queue for host notifications
     """
-    with ErrorHandler():
+    with HandlerMetrics("create_game", event), HandlerProfile("create_game", event), ErrorHandler(), \
+            Admission("create_game", event), IdempotentRequest("create_game", event) as request:
+        if request.replayed:
+            return request.response
         host = Host(event["name"], uuid.uuid4())
         with GameWrapperFactory.new_game(host) as game:
             host.join(game)
-            return json.dumps({'gameId': game.id,
-                               'hostToken': game.host.token.hex,
-                               'queueUrl': game.host.queueUrl})
+            request.response = json.dumps({'gameId': game.id,
+                                           'hostToken': game.host.token.hex,
+                                           'queueUrl': game.host.queueUrl})
+            return request.response
 
 
+@recorded
+def create_games(event, context):
+    """
+    Called when somebody wants to provision several games at once,
+    e.g. for a tournament or a classroom.
+
+    The event is expected to contain the following parameter(s):
+    - hosts: the names of the players hosting the games, one game per name,
+             at most MAX_GAMES_PER_REQUEST of them
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the games being created again
+
+    Returns the following:
+    - games: a list with, for each host in order, the gameId, hostToken
+             and queueUrl that create_game returns for a single game
+    """
+    with HandlerMetrics("create_games", event), HandlerProfile("create_games", event), ErrorHandler(), \
+            Admission("create_games", event), IdempotentRequest("create_games", event) as request:
+        if request.replayed:
+            return request.response
+        names = event["hosts"]
+        if not names or len(names) > MAX_GAMES_PER_REQUEST:
+            raise ValueError("Between 1 and {} games can be created at once".format(MAX_GAMES_PER_REQUEST))
+        hosts = [Host(name, uuid.uuid4()) for name in names]
+        games = GameWrapperFactory.new_games(hosts)
+        metrics.increment("GamesCreated", len(games))
+        request.response = json.dumps({'games': [{'gameId': game.id,
+                                                  'hostToken': game.host.token.hex,
+                                                  'queueUrl': game.host.queueUrl} for game in games]})
+        return request.response
+
+
+@recorded
 def join_game(event, context):
     """
     Called when somebody wants to join an existing game.
@@ -70,6 +133,8 @@ def join_game(event, context):
     The event is expected to contain the following parameter(s):
     - name: the name of the player joining the game
     - gameId: the four-letter ID of the game to join
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the action being applied again
 
     Returns the following:
     - playerToken: token that identifies the caller as a player in the game
@@ -77,14 +142,19 @@ def join_game(event, context):
                    in order to identify the requester as this player
     - queueUrl: the URL of the SQS queue for player notifications
     """
-    with ErrorHandler():
+    with HandlerMetrics("join_game", event), HandlerProfile("join_game", event), ErrorHandler(), \
+            Admission("join_game", event), IdempotentRequest("join_game", event) as request:
+        if request.replayed:
+            return request.response
         with GameWrapperFactory.load_game(event["gameId"]) as game:
             player = Player(event["name"], uuid.uuid4())
             player.join(game)
-            return json.dumps({'playerToken': player.token.hex,
-                               'queueUrl': player.queueUrl})
+            request.response = json.dumps({'playerToken': player.token.hex,
+                                           'queueUrl': player.queueUrl})
+            return request.response
 
 
+@recorded
 def spectate_game(event, context):
     """
     Called when somebody wants to spectate an existing game.
@@ -95,13 +165,15 @@ def spectate_game(event, context):
     Returns the following:
     - queueUrl: the URL of the SQS queue for spectator notifications
     """
-    with ErrorHandler():
+    with HandlerMetrics("spectate_game", event), HandlerProfile("spectate_game", event), ErrorHandler(), \
+            Admission("spectate_game", event):
         with GameWrapperFactory.load_game(event["gameId"]) as game:
             spectator = Spectator(uuid.uuid4())
             spectator.join(game)
             return json.dumps({'queueUrl': spectator.queueUrl})
 
 
+@recorded
 def start_game(event, context):
     """
     Called when the host wants to start an existing game.
@@ -113,14 +185,20 @@ def start_game(event, context):
     Returns nothing if successful, or an error if the game
     could not be started for some reason.
     """
-    with ErrorHandler():
+    with HandlerMetrics("start_game", event), HandlerProfile("start_game", event), ErrorHandler(), \
+            Admission("start_game", event):
         with GameWrapperFactory.load_game(event["gameId"]) as game:
-            host = game.host
-            if event["token"] != host.token.hex:
-                raise AuthorizationError("start_game", "player with token {}".format(event["token"]))
-            game.start()
+            _start_game(game, event, time.time())
+
+
+def _start_game(game, action, received_at):
+    host = game.host
+    if action["token"] != host.token.hex:
+        raise AuthorizationError("start_game", "player with token {}".format(action["token"]))
+    game.start()
 
 
+@recorded
 def submit_prompt(event, context):
     """
     Called when a player submits a prompt for an existing game.
@@ -129,18 +207,31 @@ def submit_prompt(event, context):
     - gameId: the id of the game
     - token: the token identifying this player
     - prompt: the text of the prompt to be submitted
+    - traceId (optional): correlation id for tracing the resulting notifications
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the action being applied again
 
     Returns nothing if successful, or an error if the prompt could
     not be submitted.
     """
-    with ErrorHandler():
+    received_at = time.time()
+    with HandlerMetrics("submit_prompt", event), HandlerProfile("submit_prompt", event), ErrorHandler(), \
+            Admission("submit_prompt", event), IdempotentRequest("submit_prompt", event) as request:
+        if request.replayed:
+            return request.response
         with GameWrapperFactory.load_game(event["gameId"]) as game:
-            token_to_player = {player.token.hex: player for player in game.players}
-            if event["token"] not in token_to_player.keys():
-                raise AuthorizationError("submit_prompt", "player with token {}".format(event["token"]))
-            game.receive_prompt(Prompt(event["prompt"], token_to_player[event["token"]].name))
+            _submit_prompt(game, event, received_at)
 
 
+def _submit_prompt(game, action, received_at):
+    token_to_player = {player.token.hex: player for player in game.players}
+    if action["token"] not in token_to_player.keys():
+        raise AuthorizationError("submit_prompt", "player with token {}".format(action["token"]))
+    prompt = Prompt(action["prompt"], token_to_player[action["token"]].name)
+    game.receive_prompt(prompt.start_trace("submit_prompt", action.get("traceId"), received_at))
+
+
+@recorded
 def choose_prompt(event, context):
     """
     Called when the host chooses a prompt for an existing game.
@@ -149,31 +240,288 @@ def choose_prompt(event, context):
     - gameId: the id of the game
     - token: the token identifying this player as the host
     - prompt: the host's chosen prompt
+    - traceId (optional): correlation id for tracing the resulting notifications
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the action being applied again
 
     Returns nothing if successful, or an error if the prompt could
     not be chosen
     """
-    with ErrorHandler():
+    received_at = time.time()
+    with HandlerMetrics("choose_prompt", event), HandlerProfile("choose_prompt", event), ErrorHandler(), \
+            Admission("choose_prompt", event), IdempotentRequest("choose_prompt", event) as request:
+        if request.replayed:
+            return request.response
+        with GameWrapperFactory.load_game(event["gameId"]) as game:
+            _choose_prompt(game, event, received_at)
+
+
+def _choose_prompt(game, action, received_at):
+    host = game.host
+    if action["token"] != host.token.hex:
+        raise AuthorizationError('choose_prompt', "player with token {}".format(action["token"]))
+    choice = ChoosePrompt(action["prompt"]).start_trace("choose_prompt", action.get("traceId"), received_at)
+    game.choose_prompt(choice)
+
+
+_BATCH_ACTIONS = {
+    'start_game': _start_game,
+    'submit_prompt': _submit_prompt,
+    'choose_prompt': _choose_prompt
+}
+
+# The game method each batch action calls, which only the phases that accept the action have
+_BATCH_ACTION_METHODS = {
+    'start_game': 'start',
+    'submit_prompt': 'receive_prompt',
+    'choose_prompt': 'choose_prompt'
+}
+
+# The errors apply_actions reports for a single action: they are raised before the game is changed
+_REJECTED_ACTION_ERRORS = (AuthorizationError, RuntimeError, ValueError)
+
+
+@recorded
+def apply_actions(event, context):
+    """
+    Called to apply several actions to one game at once, loading
+    and saving the game only once for the whole batch.
+
+    The event is expected to contain the following parameter(s):
+    - gameId: the id of the game
+    - actions: a list of actions to apply in order, each containing
+      - action: one of start_game, submit_prompt or choose_prompt
+      - token: the token identifying the caller of this action
+      - prompt: the prompt to submit or choose, if applicable
+      - traceId (optional): correlation id for tracing the resulting notifications
+    - idempotencyKey (optional): a unique key for this request; retries with the
+      same key get the original response without the actions being applied again
+
+    Each action is authorized and applied exactly as it would be by
+    the handler of the same name. An action that is unauthorized,
+    invalid or not accepted in the game's current phase, e.g. a repeated
+    start_game, does not prevent the following actions from being applied.
+    Any other error, e.g. failing to fetch a blocklist, aborts the
+    whole batch without saving the game or sending any notification,
+    as a transition it interrupts may be half applied.
+
+    Returns the following:
+    - results: one result per action, in order, each containing
+      - ok: whether the action was applied
+      - error: the error message, if it was not
+    """
+    received_at = time.time()
+    results = []
+    with HandlerMetrics("apply_actions", event), HandlerProfile("apply_actions", event), ErrorHandler(), \
+            Admission("apply_actions", event), IdempotentRequest("apply_actions", event) as request:
+        if request.replayed:
+            return request.response
         with GameWrapperFactory.load_game(event["gameId"]) as game:
-            host = game.host
-            if event["token"] != host.token.hex:
-                raise AuthorizationError('choose_prompt', "player with token {}".format(event["token"]))
-            game.choose_prompt(ChoosePrompt(event["prompt"]))
+            for action in event["actions"]:
+                try:
+                    if action.get("action") not in _BATCH_ACTIONS:
+                        raise ValueError("Unknown action '{}'".format(action.get("action")))
+                    if not hasattr(game.game, _BATCH_ACTION_METHODS[action["action"]]):
+                        raise ValueError("Cannot {} in this phase of the game".format(action["action"]))
+                    _BATCH_ACTIONS[action["action"]](game, action, received_at)
+                    results.append({'ok': True})
+                except _REJECTED_ACTION_ERRORS as e:
+                    results.append({'ok': False, 'error': describe_error(type(e), e)})
+        metrics.increment("Actions", len(results))
+        request.response = json.dumps({'results': results})
+        return request.response
+
+
+def get_game_state(event, context):
+    """
+    Called when somebody wants the current state of a game,
+    e.g. after reconnecting or when spectating mid-game.
+
+    The event is expected to contain the following parameter(s):
+    - gameId: the id of the game
+    - ifNoneMatch (optional): the etag of the state the caller already has
+
+    Returns the following:
+    - etag: identifies this version of the game state
+    - notModified: true if the state still matches ifNoneMatch, in which case
+                   it is not repeated
+    - state: the game's phase, round, totalRounds, story, host, players,
+             number of spectators, statistics (see get_stats) and, while waiting
+             for submissions, the names of players who have submitted a prompt
+    """
+    with HandlerMetrics("get_game_state", event), HandlerProfile("get_game_state", event), ErrorHandler(), \
+            Admission("get_game_state", event, limit=False):
+        game_id = event["gameId"]
+        # Check the version alone first, so that unchanged state is never fetched
+        if dynamo.VIEWS_ENABLED:
+            version = dynamo.load_view_version(game_id)
+        elif not eventlog.ENABLED:
+            version = dynamo.load_game_version(game_id)
+        else:
+            # The stored version is that of the last snapshot, not of the game
+            version = None
+        if version is not None and event.get("ifNoneMatch") == game_state_etag(game_id, version):
+            metrics.increment("NotModified")
+            return json.dumps({'etag': game_state_etag(game_id, version), 'notModified': True})
+        if dynamo.VIEWS_ENABLED:
+            view, version = dynamo.load_view(game_id)
+        else:
+            wrapper = GameWrapperFactory.load_game(game_id)
+            view, version = json.dumps(state_view(wrapper.game.game), separators=(',', ':')), wrapper.version
+        etag = game_state_etag(game_id, version)
+        if event.get("ifNoneMatch") == etag:
+            metrics.increment("NotModified")
+            return json.dumps({'etag': etag, 'notModified': True})
+        # The projection is JSON already, so it is spliced in rather than decoded and re-encoded
+        return '{{"etag": {}, "notModified": false, "state": {}}}'.format(json.dumps(etag), view)
+
+
+def game_state_etag(game_id, version):
+    return "{}-{}".format(game_id, version)
+
+
+def get_stats(event, context):
+    """
+    Called for gameplay statistics over all games, e.g. by a dashboard.
+    The statistics of a single game are part of its state (see get_game_state).
+
+    Returns the following:
+    - totals: the global counters: GamesStarted, GamesCompleted, Players,
+              Rounds, RoundMillis, Prompts, PromptsChosen and DefaultChoices
+    - averageRoundSeconds, promptsPerPlayer, promptsPerRound, chosenPromptRate,
+      defaultChoiceRate and completionRate, derived from the totals
+      (null until there is anything to derive them from)
+    """
+    with HandlerMetrics("get_stats", event), HandlerProfile("get_stats", event), ErrorHandler():
+        return json.dumps(gamestats.summary(gamestats.totals()))
+
+
+def advance_deadlines(event, context):
+    """
+    Called periodically to advance games whose round deadline has passed:
+    submissions are closed with whatever prompts have arrived, and a prompt
+    is chosen for a host who has not chosen one.
+
+    Returns the following:
+    - advanced_games: ids of the games that were advanced
+    - stale_deadlines: number of due deadlines that games had already moved past
+    """
+    advanced_games = []
+    stale_deadlines = 0
+    with HandlerMetrics("advance_deadlines", event), HandlerProfile("advance_deadlines", event):
+        for item in deadlines.due():
+            key = (item['phase'], int(item['round_number']))
+            if dynamo.VIEWS_ENABLED:
+                try:
+                    # The small projection item is enough to tell whether most deadlines are stale
+                    state = json.loads(dynamo.load_view(item['game_id'])[0])
+                except KeyError:
+                    state = None
+                if state is None or (state['phase'], state['round']) != key:
+                    stale_deadlines += 1
+                    deadlines.remove(item)
+                    continue
+            try:
+                wrapper, deadline = _due_deadline(item['game_id'], key)
+                if deadline is None:
+                    stale_deadlines += 1
+                    deadlines.remove(item)
+                    continue
+                with wrapper as game:
+                    getattr(game, deadline.action)()
+            except Exception as e:
+                # Leave the deadline in place, so the next tick retries it
+                print >> sys.stderr, "Could not advance game {}: {}".format(item['game_id'], e)
+                continue
+            deadlines.remove(item)
+            advanced_games.append(item['game_id'])
+        metrics.increment("DeadlinesAdvanced", len(advanced_games))
+        metrics.increment("StaleDeadlines", stale_deadlines)
+    return json.dumps({
+        'advanced_games': advanced_games,
+        'stale_deadlines': stale_deadlines
+    })
+
+
+def _due_deadline(game_id, key):
+    """
+    :param key: the (phase, round) a deadline was scheduled for
+    :return: a tuple of the loaded game's wrapper and its round deadline,
+             which is None if the game no longer exists or has moved past the key
+    """
+    try:
+        wrapper = GameWrapperFactory.load_game(game_id)
+    except KeyError:
+        return None, None
+    deadline = round_deadline(wrapper.game.game)
+    if deadline is None or (deadline.phase, deadline.round) != key:
+        return wrapper, None
+    return wrapper, deadline
 
 
 def cleanup(event, context):
     """
     Called to clean up old game state.
 
+    Completed games are archived before they are removed,
+    if an archive bucket is configured.
     """
     removed_games = []
     removed_queues = []
-    for game in dynamo.get_old_or_finished_games():
-        removed_queues.append(sqs.delete_queue(game.host.queueUrl))
-        for player in game.players:
-            removed_queues.append(sqs.delete_queue(player.queueUrl))
-        removed_games.append(dynamo.delete_game(game))
+    archived_games = []
+    with HandlerMetrics("cleanup", event), HandlerProfile("cleanup", event):
+        games = dynamo.get_old_or_finished_games()
+        if eventlog.ENABLED:
+            # The stored games are snapshots, which miss whoever joined since they were taken
+            games = [eventlog.load_game(game.id)[0] for game in games]
+        if s3archive.ENABLED:
+            archived_games = s3archive.archive_games([game for game in games if isinstance(game, CompleteGame)])
+        for game in games:
+            for participant in participants(game):
+                removed_queues.append(sqs.delete_queue(participant.queueUrl))
+            if eventlog.ENABLED:
+                eventlog.delete_records(game.id)
+            deadlines.unschedule(game.id)
+            removed_games.append(dynamo.delete_game(game))
     return json.dumps({
         'removed_games': removed_games,
-        'removed_queues': removed_queues
+        'removed_queues': removed_queues,
+        'archived_games': archived_games
     })
+
+
+# The handlers dispatch routes to, by the event's 'action'
+_ROUTES = {
+    'create_game': create_game,
+    'create_games': create_games,
+    'join_game': join_game,
+    'spectate_game': spectate_game,
+    'start_game': start_game,
+    'submit_prompt': submit_prompt,
+    'choose_prompt': choose_prompt,
+    'apply_actions': apply_actions,
+    'get_game_state': get_game_state,
+    'get_stats': get_stats,
+    'advance_deadlines': advance_deadlines,
+    'cleanup': cleanup
+}
+
+
+def dispatch(event, context):
+    """
+    Single entry point for deploying the backend as one Lambda function
+    (see bin/updateFunctions.sh --routed), so that every action keeps the
+    same containers warm rather than each handler warming its own.
+
+    The event is expected to contain the following parameter(s):
+    - action: the name of the handler to call, e.g. "join_game"
+    and otherwise the parameters of that handler, to which it is passed on.
+    Scheduled invocations name advance_deadlines or cleanup as their action.
+
+    Returns what the handler returns.
+    """
+    action = event.get("action")
+    if action not in _ROUTES:
+        with ErrorHandler():
+            raise ValueError("Unknown action '{}'".format(action))
+    return _ROUTES[action](event, context)
@@ -0,0 +1,157 @@
+"""
+Opt-in instrumentation of handler invocations.
+
+When the GROUPWEAVE_METRICS environment variable is set to 1, each
+handler invocation records the wall time of its phases (loading,
+transitioning, publishing, saving), AWS call counts and payload sizes,
+and prints them as a single CloudWatch embedded metric format line.
+The first invocation in a process is counted as a ColdStart.
+When it is not set, every call here returns immediately.
+"""
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import timeit
+
+ENABLED = os.environ.get("GROUPWEAVE_METRICS") == "1"
+NAMESPACE = "Groupweave"
+
+MILLISECONDS = "Milliseconds"
+COUNT = "Count"
+BYTES = "Bytes"
+
+_state = threading.local()
+
+# Whether this process has yet to record an invocation, i.e. is a fresh Lambda container
+_cold = True
+
+
+class Invocation(object):
+    """
+    Metrics recorded over a single handler invocation
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.values = collections.OrderedDict()
+        self.units = {}
+        self.properties = {}
+
+    def add(self, name, value, unit):
+        self.values[name] = self.values.get(name, 0) + value
+        self.units[name] = unit
+
+    def to_emf(self, timestamp=None):
+        """
+        :return: this invocation as an embedded metric format dict
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        record = {
+            "_aws": {
+                "Timestamp": int(timestamp * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Handler"]],
+                    "Metrics": [{"Name": name, "Unit": self.units[name]} for name in self.values]
+                }]
+            },
+            "Handler": self.handler
+        }
+        record.update(self.properties)
+        for name, value in self.values.items():
+            record[name] = round(value, 3) if isinstance(value, float) else value
+        return record
+
+
+def current():
+    """
+    :return: the Invocation being recorded on this thread, or None
+    """
+    return getattr(_state, 'invocation', None) if ENABLED else None
+
+
+def recording():
+    return current() is not None
+
+
+def increment(name, value=1, unit=COUNT):
+    invocation = current()
+    if invocation is not None:
+        invocation.add(name, value, unit)
+
+
+def set_property(name, value):
+    invocation = current()
+    if invocation is not None:
+        invocation.properties[name] = value
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, invocation, name):
+        self.invocation = invocation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.invocation.add(self.name, (timeit.default_timer() - self.start) * 1000.0, MILLISECONDS)
+
+
+def phase(name):
+    """
+    Context manager that adds the wall time spent inside it
+    to the named phase of the current invocation
+    """
+    invocation = current()
+    if invocation is None:
+        return _NULL_PHASE
+    return _Phase(invocation, name)
+
+
+class HandlerMetrics(object):
+    """
+    Context manager that records a handler invocation
+    and prints its metrics when the handler returns
+    """
+
+    def __init__(self, handler, event=None):
+        self.handler = handler
+        self.event = event or {}
+        self.invocation = None
+        self.start = None
+
+    def __enter__(self):
+        global _cold
+        if not ENABLED:
+            return
+        self.invocation = Invocation(self.handler)
+        self.invocation.add("ColdStart", 1 if _cold else 0, COUNT)
+        _cold = False
+        if "gameId" in self.event:
+            self.invocation.properties["GameId"] = self.event["gameId"]
+        _state.invocation = self.invocation
+        self.start = timeit.default_timer()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.invocation is None:
+            return
+        _state.invocation = None
+        self.invocation.add("Total", (timeit.default_timer() - self.start) * 1000.0, MILLISECONDS)
+        self.invocation.add("Errors", 1 if exc_type is not None else 0, COUNT)
+        sys.stdout.write(json.dumps(self.invocation.to_emf()) + "\n")
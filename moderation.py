@@ -0,0 +1,189 @@
+"""
+Moderation of the prompts players submit, before the host sees them.
+
+Each round's prompts pass through the game's prompt stages once, when
+submissions close (see game.PROMPT_STAGES), rather than one by one as
+they arrive. When GROUPWEAVE_BLOCKLIST names a file of blocked terms,
+one per line, the blocklist stage masks every whole-word occurrence of
+a term with asterisks. Matching is case and accent insensitive and sees
+through common letter substitutions such as "h3ll0".
+
+The terms are compiled into an Aho-Corasick automaton, so a prompt is
+scanned once however long the blocklist is. The automaton is compiled
+on first use and kept for as long as the process lives, i.e. for the
+life of a Lambda container, unless the file changes.
+
+Games are replayed from their actions, so a game replayed with another
+blocklist may tell another story.
+"""
+import collections
+import os
+import unicodedata
+
+import metrics
+
+BLOCKLIST_PATH = os.environ.get("GROUPWEAVE_BLOCKLIST")
+MASK = u"*"
+
+# Characters commonly substituted for the letters they look like
+_SUBSTITUTIONS = {u'0': u'o', u'1': u'i', u'3': u'e', u'4': u'a', u'5': u's', u'7': u't', u'@': u'a', u'$': u's'}
+
+_folded = {}
+_matchers = {}
+
+
+def _fold(char):
+    folded = _folded.get(char)
+    if folded is None:
+        folded = (unicodedata.normalize('NFKD', char)[:1] or char).lower()
+        folded = _SUBSTITUTIONS.get(folded, folded)
+        if len(folded) != 1:
+            folded = char
+        _folded[char] = folded
+    return folded
+
+
+def normalize(text):
+    """
+    Fold text for matching, one character for each character of the text,
+    so that positions in the normalized text are positions in the text
+    :return: the normalized text, as unicode
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8', 'replace')
+    return u"".join([_fold(char) for char in text])
+
+
+class Matcher(object):
+    """
+    Aho-Corasick automaton matching many terms in a single pass over a text
+    """
+
+    def __init__(self, terms):
+        goto = [{}]
+        lengths = [()]
+        for term in terms:
+            term = u" ".join(normalize(term).split())
+            if not term:
+                continue
+            node = 0
+            for char in term:
+                child = goto[node].get(char)
+                if child is None:
+                    child = len(goto)
+                    goto[node][char] = child
+                    goto.append({})
+                    lengths.append(())
+                node = child
+            lengths[node] = (len(term),)
+
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(char, 0)
+                # A node also ends every term that its longest proper suffix ends
+                lengths[child] += lengths[fail[child]]
+
+        self._goto = goto
+        self._fail = fail
+        self._lengths = lengths
+        self.states = len(goto)
+
+    def matches(self, normalized):
+        """
+        :param normalized: text as returned by normalize
+        :return: a list of (start, end) of every whole-word match
+        """
+        goto, fail, lengths = self._goto, self._fail, self._lengths
+        found = []
+        node = 0
+        for end, char in enumerate(normalized, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in lengths[node]:
+                start = end - length
+                if (start == 0 or not normalized[start - 1].isalnum()) and \
+                        (end == len(normalized) or not normalized[end].isalnum()):
+                    found.append((start, end))
+        return found
+
+    def mask(self, text):
+        """
+        :return: the text with every match masked, or the text itself if nothing matched
+        """
+        normalized = normalize(text)
+        found = self.matches(normalized)
+        if not found:
+            return text
+        chars = list(text if isinstance(text, unicode) else text.decode('utf-8', 'replace'))
+        for start, end in found:
+            chars[start:end] = MASK * (end - start)
+        return u"".join(chars)
+
+
+def read_terms(path):
+    """
+    :return: the terms listed in a blocklist file, skipping blank lines and # comments
+    """
+    with open(path) as f:
+        lines = [line.decode('utf-8', 'replace').strip() for line in f]
+    return [line for line in lines if line and not line.startswith(u"#")]
+
+
+def load_matcher(path):
+    """
+    :return: the Matcher for a blocklist file, compiled once for each version of the file
+    """
+    key = (path, os.path.getmtime(path))
+    matcher = _matchers.get(key)
+    if matcher is None:
+        with metrics.phase("CompileBlocklist"):
+            matcher = Matcher(read_terms(path))
+        _matchers.clear()
+        _matchers[key] = matcher
+    return matcher
+
+
+class BlocklistStage(object):
+    """
+    Prompt stage that masks the blocked terms in a round's prompts
+    """
+
+    def __init__(self, path=None, matcher=None):
+        """
+        :param path: the blocklist file, loaded on first use
+        :param matcher: a Matcher to use instead of loading one
+        """
+        self.path = path
+        self.matcher = matcher
+
+    def __call__(self, prompts):
+        """
+        :param prompts: the round's prompts by player name
+        :return: the prompts, masked, by player name
+        """
+        matcher = self.matcher or load_matcher(self.path)
+        moderated = {}
+        masked = 0
+        with metrics.phase("Moderation"):
+            for player, prompt in prompts.items():
+                moderated[player] = matcher.mask(prompt)
+                masked += moderated[player] is not prompt
+        metrics.increment("PromptsMasked", masked)
+        return moderated
+
+
+def configured_stages():
+    """
+    :return: the prompt stages this process is configured with
+    """
+    if BLOCKLIST_PATH:
+        return [BlocklistStage(BLOCKLIST_PATH)]
+    return []
@@ -0,0 +1,167 @@
+"""
+Compression and offloading of large payloads, such as the pickled
+state of a marathon game or a NewPrompts event with many long prompts.
+
+Payloads smaller than COMPRESS_THRESHOLD are stored as they are.
+Larger ones are compressed, and if even the compressed payload is over
+the limit of where it is stored (a DynamoDB item or an SQS message),
+it is put in a content-addressed blob store and replaced by a
+reference to it. Readers only go to the blob store when they meet
+such a reference.
+
+The blob store is a directory (GROUPWEAVE_BLOB_DIR, by default under
+the system temporary directory) unless another store is installed
+with set_blob_store, as aws.blobs does when GROUPWEAVE_BLOB_BUCKET
+is set. A directory is only shared by the processes of one machine,
+so payloads that other machines read, such as the game items and
+messages of deployed functions, are packed with shared=True: they are
+never offloaded to the directory, and are refused with a
+PayloadTooLargeError instead unless a store has been installed.
+Blobs are never deleted by the game; as they are immutable, an expiry
+rule on the bucket is enough to clean them up.
+"""
+import base64
+import hashlib
+import os
+import tempfile
+import zlib
+
+import metrics
+
+COMPRESS_THRESHOLD = int(os.environ.get("GROUPWEAVE_COMPRESS_THRESHOLD", "4096"))
+BLOB_DIR = os.environ.get("GROUPWEAVE_BLOB_DIR") or os.path.join(tempfile.gettempdir(), "groupweave-blobs")
+
+# Pickled games never start with a NUL byte, so these cannot be mistaken for plain payloads
+_COMPRESSED = "\x00z"
+_BLOB = "\x00b"
+
+_blob_store = None
+_directory_store = None
+
+
+class PayloadTooLargeError(StandardError):
+    """
+    Raised when a payload that other machines read is over the limit
+    of where it is stored and there is no shared blob store to offload it to
+    """
+
+    def __init__(self, size, limit):
+        super(PayloadTooLargeError, self).__init__(
+            "A payload of {} bytes is over the limit of {} bytes, and no shared blob store "
+            "is configured to offload it to (see GROUPWEAVE_BLOB_BUCKET)".format(size, limit))
+
+
+class DirectoryBlobStore(object):
+    """
+    Content-addressed blob store that keeps each blob in a file named after its digest
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def put(self, data):
+        """
+        :return: the key of the blob, which is the SHA-256 digest of its data
+        """
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write under a unique name and rename, so readers never see a partial blob
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(temp_path, path)
+        return key
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+
+def blob_store():
+    """
+    :return: the installed blob store, or else the directory store
+    """
+    global _directory_store
+    if _blob_store is not None:
+        return _blob_store
+    if _directory_store is None:
+        _directory_store = DirectoryBlobStore(BLOB_DIR)
+    return _directory_store
+
+
+def set_blob_store(store):
+    global _blob_store
+    _blob_store = store
+
+
+def _put_blob(data, limit, shared):
+    if shared and _blob_store is None:
+        raise PayloadTooLargeError(len(data), limit)
+    with metrics.phase("BlobPut"):
+        key = blob_store().put(data)
+    metrics.increment("BlobBytes", len(data), metrics.BYTES)
+    return key
+
+
+def _get_blob(key):
+    with metrics.phase("BlobGet"):
+        return blob_store().get(key)
+
+
+def pack(data, limit, shared=False):
+    """
+    Compress a binary payload if it is large, and offload it to
+    the blob store if it is still over the limit
+    :param limit: the largest payload, in bytes, that may be returned
+    :param shared: whether the payload is read on other machines, so may
+                   only be offloaded to a blob store that was installed
+    :return: the payload to store in its place
+    :raises: PayloadTooLargeError if the payload is shared, over the limit
+             and no blob store was installed
+    """
+    if len(data) < COMPRESS_THRESHOLD:
+        return data
+    compressed = _COMPRESSED + zlib.compress(data)
+    metrics.increment("CompressedPayloads")
+    if len(compressed) <= limit:
+        return compressed
+    return _BLOB + _put_blob(compressed, limit, shared)
+
+
+def unpack(data):
+    """
+    :return: the original payload of a packed one
+    """
+    if data.startswith(_BLOB):
+        data = _get_blob(data[len(_BLOB):])
+    if data.startswith(_COMPRESSED):
+        return zlib.decompress(data[len(_COMPRESSED):])
+    return data
+
+
+def pack_text(text, limit, shared=False):
+    """
+    Like pack, for payloads that must remain text, such as SQS messages
+    :return: a dict that describes the packed payload, or None if the text should be sent as it is
+    """
+    if len(text) < COMPRESS_THRESHOLD:
+        return None
+    compressed = base64.b64encode(zlib.compress(text))
+    metrics.increment("CompressedPayloads")
+    if len(compressed) <= limit:
+        return {'zlib': compressed}
+    return {'blob': _put_blob(compressed, limit, shared)}
+
+
+def unpack_text(packed):
+    """
+    :return: the original text of a payload packed with pack_text
+    """
+    compressed = packed['zlib'] if 'zlib' in packed else _get_blob(packed['blob'])
+    return zlib.decompress(base64.b64decode(compressed))
@@ -0,0 +1,216 @@
+"""
+Opt-in profiling of handler invocations and CLI server games.
+
+Profiles are written to GROUPWEAVE_PROFILE_DIR (default
+/tmp/groupweave-profiles) as collapsed stacks, which can be fed
+straight into flamegraph.pl or speedscope, plus a JSON file of
+allocation statistics.
+
+A handler invocation is profiled when its event contains
+"profile": true, or with probability GROUPWEAVE_PROFILE_RATE
+(a fraction between 0 and 1, default 0). CLI server games are
+profiled when their id is listed in GROUPWEAVE_PROFILE_GAMES.
+"""
+import collections
+import gc
+import json
+import os
+import random
+import resource
+import signal
+import sys
+import threading
+import time
+import timeit
+
+PROFILE_DIR = os.environ.get("GROUPWEAVE_PROFILE_DIR", "/tmp/groupweave-profiles")
+PROFILE_RATE = float(os.environ.get("GROUPWEAVE_PROFILE_RATE", "0"))
+PROFILE_GAMES = set(game_id for game_id in os.environ.get("GROUPWEAVE_PROFILE_GAMES", "").split(",") if game_id)
+PROFILE_MODE = os.environ.get("GROUPWEAVE_PROFILE_MODE", "sample")
+SAMPLE_INTERVAL_SECONDS = float(os.environ.get("GROUPWEAVE_PROFILE_INTERVAL", "0.001"))
+
+SAMPLE = "sample"
+TRACE = "trace"
+
+
+def should_profile(event=None):
+    """
+    Decide whether to profile a handler invocation
+    """
+    if isinstance(event, dict) and event.get("profile"):
+        return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+def should_profile_game(game_id):
+    return game_id in PROFILE_GAMES
+
+
+def _frame_label(code):
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def _heap_histogram():
+    histogram = collections.Counter()
+    for obj in gc.get_objects():
+        histogram[type(obj).__name__] += 1
+    return histogram
+
+
+class Profiler(object):
+    """
+    Collects collapsed stacks while active. May be started
+    and stopped repeatedly; samples accumulate across runs.
+
+    In 'sample' mode the stack is sampled on a SIGPROF timer, which
+    is cheap but only possible on the main thread. In 'trace' mode
+    every call is recorded with sys.setprofile, and the collapsed
+    stack weights are microseconds rather than sample counts.
+    Sampling falls back to tracing when used off the main thread.
+    """
+
+    def __init__(self, mode=None, interval=None):
+        self.mode = mode or PROFILE_MODE
+        self.interval = interval or SAMPLE_INTERVAL_SECONDS
+        self.stacks = collections.Counter()
+        self.wall_seconds = 0.0
+        self._active_mode = None
+        # The mode actually profiled in, once sampling may have fallen back to tracing
+        self.effective_mode = None
+        self._started = None
+        self._call_stack = []
+        self._heap_before = None
+        self._gc_before = None
+        self._previous_handler = None
+
+    def start(self):
+        if self._heap_before is None:
+            self._heap_before = _heap_histogram()
+            self._gc_before = gc.get_count()
+        self._active_mode = self.mode
+        if self._active_mode == SAMPLE and not isinstance(threading.current_thread(), threading._MainThread):
+            self._active_mode = TRACE
+        self.effective_mode = self._active_mode
+        if self._active_mode == SAMPLE:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._call_stack = []
+            sys.setprofile(self._trace)
+        self._started = timeit.default_timer()
+
+    def stop(self):
+        self.wall_seconds += timeit.default_timer() - self._started
+        if self._active_mode == SAMPLE:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+        else:
+            sys.setprofile(None)
+        self._active_mode = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _sample(self, signum, frame):
+        self.stacks[_collapse(frame)] += 1
+
+    def _trace(self, frame, event, arg):
+        if event == 'call':
+            self._call_stack.append((frame, timeit.default_timer()))
+        elif event == 'return' and self._call_stack:
+            returning, started = self._call_stack.pop()
+            if returning is frame:
+                self.stacks[_collapse(frame)] += int((timeit.default_timer() - started) * 1e6)
+                if self._call_stack:
+                    # Subtract this call's time from its caller so stacks carry self time
+                    caller, caller_started = self._call_stack[-1]
+                    self._call_stack[-1] = (caller, caller_started + (timeit.default_timer() - started))
+
+    def allocation_stats(self):
+        """
+        Python 2 has no allocation tracer, so report the change in live
+        objects by type, garbage collector activity and peak RSS instead
+        """
+        heap_after = _heap_histogram()
+        growth = collections.Counter(heap_after)
+        growth.subtract(self._heap_before or collections.Counter())
+        gc_after = gc.get_count()
+        return {
+            'live_object_growth': dict((name, count) for name, count in growth.most_common(50) if count > 0),
+            'live_objects': sum(heap_after.values()),
+            'gc_generation_counts_before': list(self._gc_before or ()),
+            'gc_generation_counts_after': list(gc_after),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'mode': self.effective_mode or self.mode,
+            'weight_unit': 'samples' if (self.effective_mode or self.mode) == SAMPLE else 'microseconds'
+        }
+
+    def write(self, label, directory=None):
+        """
+        Write collapsed stacks and allocation statistics
+        :return: the path prefix of the written files
+        """
+        directory = directory or PROFILE_DIR
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        prefix = os.path.join(directory, "{}-{}-{}".format(label, int(time.time() * 1000), os.getpid()))
+        with open(prefix + ".collapsed", 'w') as f:
+            for stack, weight in sorted(self.stacks.items()):
+                if weight > 0:
+                    f.write("{} {}\n".format(stack, weight))
+        with open(prefix + ".alloc.json", 'w') as f:
+            json.dump(self.allocation_stats(), f, indent=2, sort_keys=True)
+        return prefix
+
+
+class _NotProfiling(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NOT_PROFILING = _NotProfiling()
+
+
+class HandlerProfile(object):
+    """
+    Context manager that profiles a handler invocation when
+    requested by its event or chosen by the sampling rate
+    """
+
+    def __init__(self, handler, event=None):
+        self.handler = handler
+        self.event = event
+        self.profiler = None
+
+    def __enter__(self):
+        if should_profile(self.event):
+            self.profiler = Profiler()
+            self.profiler.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.profiler is None:
+            return
+        self.profiler.stop()
+        label = self.handler
+        if isinstance(self.event, dict) and "gameId" in self.event:
+            label = "{}-{}".format(self.handler, self.event["gameId"])
+        try:
+            print >> sys.stderr, "Wrote profile {}".format(self.profiler.write(label))
+        except (IOError, OSError) as e:
+            print >> sys.stderr, "Could not write profile: {}".format(e)
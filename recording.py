@@ -0,0 +1,152 @@
+"""
+Opt-in recording of the action streams that drive games, for
+replaying them later with bench.replay.
+
+When GROUPWEAVE_RECORD is set to a file path, every handler invocation
+(its event, response and latency) or, in the CLI server, every
+connection and line received is appended to that file as one compact
+JSON line, together with the final story of every game that completes.
+A path ending in .gz is written gzip-compressed. Setting it to "-"
+writes the records to stdout, prefixed with RECORD_PREFIX, so they can
+be extracted from Lambda logs.
+
+Tokens, and the queue URLs made from them, are replaced by their
+digests before handler invocations are recorded, so a recording
+cannot be used to act for anybody. A token has the same digest
+wherever it appears, which is all bench.replay needs to map the
+tokens of a recording to the ones handed out in the replay.
+"""
+import functools
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import timeit
+
+RECORD_PATH = os.environ.get("GROUPWEAVE_RECORD")
+RECORD_PREFIX = "GROUPWEAVE_RECORD "
+# Fields of handler events and responses that hold tokens, or queue URLs made from them
+_SECRET_FIELDS = ('token', 'hostToken', 'playerToken', 'queueUrl')
+
+_lock = threading.Lock()
+_files = {}
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'ab')
+    return open(path, 'a')
+
+
+def record(entry, path=None):
+    """
+    Append a record, stamped with the current time unless it has
+    a time 't' already, if recording is enabled
+    """
+    path = path or RECORD_PATH
+    if not path:
+        return
+    entry = dict({'t': round(time.time(), 6)}, **entry)
+    line = json.dumps(entry, separators=(',', ':'))
+    with _lock:
+        if path == "-":
+            sys.stdout.write(RECORD_PREFIX + line + "\n")
+            return
+        if path not in _files:
+            _files[path] = _open(path)
+        _files[path].write(line + "\n")
+        _files[path].flush()
+
+
+def close():
+    with _lock:
+        for f in _files.values():
+            f.close()
+        _files.clear()
+
+
+def record_done(game_id, story):
+    record({'op': "done", 'g': game_id, 'story': story})
+
+
+def read(path):
+    """
+    Read the records of a trace file or a log containing prefixed records
+    :return: a list of records, ordered by time
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path) as f:
+        for line in f:
+            if RECORD_PREFIX in line:
+                line = line[line.index(RECORD_PREFIX) + len(RECORD_PREFIX):]
+            line = line.strip()
+            if line.startswith("{"):
+                records.append(json.loads(line))
+    records.sort(key=lambda entry: entry['t'])
+    return records
+
+
+def _digest(secret):
+    if isinstance(secret, unicode):
+        secret = secret.encode('utf-8')
+    return hashlib.sha256(secret).hexdigest()[:32]
+
+
+def _secrets(value):
+    """
+    :return: the tokens and queue URLs in a handler event or response
+    """
+    if isinstance(value, dict):
+        return [secret for key, item in value.items()
+                for secret in ([item] if key in _SECRET_FIELDS and isinstance(item, basestring) else _secrets(item))]
+    if isinstance(value, list):
+        return [secret for item in value for secret in _secrets(item)]
+    return []
+
+
+def redact(value):
+    """
+    :return: a copy of a handler event or response with its tokens and queue URLs replaced by their digests
+    """
+    if isinstance(value, dict):
+        return {key: _digest(item) if key in _SECRET_FIELDS and isinstance(item, basestring) else redact(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _redact_text(text, secrets):
+    for secret in secrets:
+        text = text.replace(secret, _digest(secret))
+    return text
+
+
+def recorded(handler):
+    """
+    Decorator that records a handler's invocations
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not RECORD_PATH:
+            return handler(event, context)
+        start = timeit.default_timer()
+        entry = {'op': "handler", 'h': handler.__name__, 'e': redact(event), 'g': event.get("gameId"),
+                 't': round(time.time(), 6)}
+        try:
+            response = handler(event, context)
+        except Exception as e:
+            # Errors may quote the tokens they were given
+            record(dict(entry, ok=False, err=_redact_text(str(e), _secrets(event)),
+                        ms=round((timeit.default_timer() - start) * 1000.0, 3)))
+            raise
+        if entry['g'] is None and response:
+            entry['g'] = json.loads(response).get("gameId")
+        recorded_response = json.dumps(redact(json.loads(response))) if response else response
+        record(dict(entry, ok=True, r=recorded_response, ms=round((timeit.default_timer() - start) * 1000.0, 3)))
+        return response
+    return wrapper
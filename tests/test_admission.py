@@ -0,0 +1,85 @@
+import json
+import threading
+from unittest import TestCase
+
+from mock import patch
+
+import handlers
+from aws import admission, local
+from aws.admission import Admission, RejectedError, TokenBucket
+
+
+class TestAdmission(TestCase):
+    def setUp(self):
+        self.backend = local.install()
+        admission._blocked_until.clear()
+        patcher = patch.object(admission, "ENABLED", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_allows_bursts_up_to_its_limit(self):
+        bucket = TokenBucket("caller:abc", rate=10, burst=3)
+
+        self.assertEqual([bucket.take(now=100.0) for _ in range(4)], [0, 0, 0, 0.1])
+        self.assertEqual(bucket.take(now=100.05), 0.1)
+        self.assertEqual(bucket.take(now=100.1), 0)
+        # A bucket left alone fills up again, but no further than its burst
+        self.assertEqual([bucket.take(now=200.0) for _ in range(4)], [0, 0, 0, 0.1])
+        self.assertEqual(bucket.take(cost=2, now=300.0), 0)
+        self.assertEqual(bucket.take(cost=2, now=300.0), 0.2)
+
+    def test_abusive_caller_is_rejected_before_the_game_is_loaded(self):
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        game_id = created["gameId"]
+        player = json.loads(handlers.join_game({"name": "Jeb", "gameId": game_id}, None))
+        handlers.start_game({"gameId": game_id, "token": created["hostToken"]}, None)
+
+        errors = []
+        with patch.object(admission, "CALLER_BURST", 3), \
+                patch.object(handlers.GameWrapperFactory, "load_game",
+                             wraps=handlers.GameWrapperFactory.load_game) as load_game:
+            for _ in range(6):
+                try:
+                    handlers.submit_prompt({"gameId": game_id, "token": "not a player", "prompt": "Spam"}, None)
+                except RuntimeError as e:
+                    errors.append(str(e).partition(":")[0])
+            self.assertEqual(load_game.call_count, 3)
+            handlers.submit_prompt({"gameId": game_id, "token": player["playerToken"], "prompt": "Fine"}, None)
+
+        self.assertEqual(errors, ["Authorization Error"] * 3 + ["Rejected"] * 3)
+
+    def test_made_up_tokens_do_not_spend_the_games_tokens(self):
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        game_id = created["gameId"]
+        player = json.loads(handlers.join_game({"name": "Jeb", "gameId": game_id}, None))
+        handlers.start_game({"gameId": game_id, "token": created["hostToken"]}, None)
+
+        errors = []
+        with patch.object(admission, "SOURCE_BURST", 3), patch.object(admission, "GAME_BURST", 6):
+            for n in range(10):
+                try:
+                    handlers.submit_prompt({"gameId": game_id, "token": "made up {}".format(n), "prompt": "Spam",
+                                            "requestContext": {"identity": {"sourceIp": "203.0.113.7"}}}, None)
+                except RuntimeError as e:
+                    errors.append(str(e).partition(":")[0])
+            handlers.submit_prompt({"gameId": game_id, "token": player["playerToken"], "prompt": "Fine",
+                                    "requestContext": {"identity": {"sourceIp": "198.51.100.2"}}}, None)
+
+        self.assertEqual(errors, ["Authorization Error"] * 3 + ["Rejected"] * 7)
+        limit_keys = [item['limit_key'] for item in self.backend.rate_limit_table.scan()['Items']]
+        self.assertNotIn("caller:{}".format(player["playerToken"]), limit_keys)
+        self.assertFalse([key for key in limit_keys if "made up" in key])
+
+    def test_invocations_over_the_concurrency_cap_are_shed(self):
+        with patch.object(admission, "_in_flight", threading.BoundedSemaphore(1)):
+            with Admission("get_game_state", {"gameId": "ABCD"}, limit=False):
+                with self.assertRaises(RejectedError):
+                    with Admission("get_game_state", {"gameId": "ABCD"}, limit=False):
+                        pass
+            with Admission("get_game_state", {"gameId": "ABCD"}, limit=False):
+                pass
+
+    def test_limiter_outage_admits_invocations(self):
+        with patch.object(TokenBucket, "take", side_effect=IOError("unreachable")):
+            with Admission("submit_prompt", {"gameId": "ABCD", "token": "abc"}):
+                pass
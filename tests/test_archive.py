@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import patch
+
+import archive
+import handlers
+from aws import local, s3archive
+from game import TOTAL_ROUNDS
+
+
+def _record(game_id, archived_at=0):
+    return {'gameId': game_id, 'archivedAt': archived_at, 'host': "Host", 'contributors': ["Jeb"],
+            'story': "Once upon a time " * 20, 'rounds': []}
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_segment_streams_record_by_record(self):
+        writer = archive.SegmentWriter("segment")
+        records = [_record("GAME{}".format(i)) for i in range(5)]
+        for record in records:
+            writer.add(record)
+
+        self.assertEqual(list(archive.iter_records(StringIO(writer.getvalue()), chunk_size=7)), records)
+
+    def test_lookup_reads_single_record(self):
+        directory_archive = archive.DirectoryArchive(self.directory, segment_bytes=200)
+        for i in range(6):
+            directory_archive.append([_record("GAME{}".format(i), archived_at=i * 86400)])
+
+        reopened = archive.DirectoryArchive(self.directory)
+
+        self.assertEqual(reopened.lookup("GAME3"), _record("GAME3", archived_at=3 * 86400))
+        self.assertIsNone(reopened.lookup("NONE"))
+        self.assertEqual(reopened.games_archived_on("1970-01-02"), ["GAME1"])
+        self.assertEqual([record['gameId'] for record in reopened.stream()],
+                         ["GAME{}".format(i) for i in range(6)])
+        self.assertGreater(len([name for name in os.listdir(self.directory) if name.startswith("segment-")]), 1)
+
+
+class TestCleanupArchive(TestCase):
+    def setUp(self):
+        local.install()
+        for patcher in (patch.object(s3archive, "ENABLED", True),
+                        patch.object(s3archive, "ARCHIVE_BUCKET", "archive")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def play_game(self):
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        game_id, host_token = created["gameId"], created["hostToken"]
+        player = json.loads(handlers.join_game({"name": "Jeb", "gameId": game_id}, None))
+        handlers.start_game({"gameId": game_id, "token": host_token}, None)
+        for round_number in range(TOTAL_ROUNDS):
+            handlers.submit_prompt({"gameId": game_id, "token": player["playerToken"],
+                                    "prompt": "word{}".format(round_number)}, None)
+            handlers.choose_prompt({"gameId": game_id, "token": host_token,
+                                    "prompt": "word{}".format(round_number)}, None)
+        return game_id
+
+    def test_cleanup_archives_complete_games(self):
+        finished = self.play_game()
+        unfinished = json.loads(handlers.create_game({"name": "Host"}, None))["gameId"]
+
+        with patch.object(handlers.dynamo, "GAME_AGE_THRESHOLD_SECONDS", -1):
+            response = json.loads(handlers.cleanup({}, None))
+
+        self.assertEqual(response["archived_games"], [finished])
+        self.assertEqual(sorted(response["removed_games"]), sorted([finished, unfinished]))
+        record = s3archive.load_archived_game(finished)
+        self.assertEqual(record["contributors"], ["Jeb"])
+        self.assertEqual(len(record["rounds"]), TOTAL_ROUNDS)
+        self.assertEqual(record["rounds"][0], {'round': 1, 'prompts': {'Jeb': 'word0'}, 'choice': 'word0'})
+        self.assertEqual(record["story"], "".join(" word{}".format(i) for i in range(TOTAL_ROUNDS)))
+        self.assertEqual([r["gameId"] for r in s3archive.stream_archived_games(archive.archive_date())],
+                         [finished])
+        self.assertIsNone(s3archive.load_archived_game(unfinished))
@@ -0,0 +1,64 @@
+from unittest import TestCase
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.test import iosim
+
+from cli import bots
+from cli.server import CommandLineGroupweaveFactory
+from game import TOTAL_ROUNDS
+
+
+class TestBots(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.server = CommandLineGroupweaveFactory()
+        self.pumps = []
+
+    def connect(self, protocol):
+        server_protocol = self.server.buildProtocol(None)
+        self.pumps.append(iosim.connect(server_protocol, iosim.makeFakeServer(server_protocol),
+                                        protocol, iosim.makeFakeClient(protocol), greet=False))
+        self.pump()
+        return defer.succeed(protocol)
+
+    def pump(self):
+        for _ in range(TOTAL_ROUNDS * 10):
+            for pump in self.pumps:
+                pump.pump()
+            self.clock.advance(1)
+
+    def play(self, host, players):
+        stories = []
+        bots.play_game(self.connect, host, players, self.clock).addCallback(stories.append)
+        self.pump()
+        return stories
+
+    def test_scripted_game(self):
+        host = bots.ScriptedHost(choices=[1], think=0.5)
+        players = [bots.ScriptedPlayer(["a{}".format(n), "b{}".format(n)], think=0.5) for n in range(2)]
+
+        stories = self.play(host, players)
+
+        # The host picks the second of the sorted prompts, which is player 1's
+        self.assertEqual(stories, ["".join(" {}1".format("ab"[i % 2]) for i in range(TOTAL_ROUNDS))])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_replayed_game_tells_the_same_story(self):
+        record = {'rounds': [{'round': n, 'prompts': {"Player 0": "zero{}".format(n), "Player 1": "one{}".format(n)},
+                              'choice': "one{}".format(n) if n % 2 else "zero{}".format(n)}
+                             for n in range(1, TOTAL_ROUNDS + 1)]}
+
+        stories = self.play(bots.ReplayHost(record), [bots.ReplayPlayer(record) for _ in range(2)])
+
+        self.assertEqual(stories, ["".join(" " + entry['choice'] for entry in record['rounds'])])
+
+    def test_incomplete_strategies_cannot_be_created(self):
+        class Silent(bots.PlayerStrategy):
+            pass
+
+        class Undecided(bots.HostStrategy):
+            pass
+
+        self.assertRaises(TypeError, Silent)
+        self.assertRaises(TypeError, Undecided)
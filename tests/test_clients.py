@@ -0,0 +1,44 @@
+import os
+from unittest import TestCase
+
+from mock import patch
+
+from aws import clients
+
+
+class TestClients(TestCase):
+    def test_clients_are_built_when_first_used(self):
+        with patch.object(clients, "_client") as build:
+            sqs = clients.client('sqs', read_timeout=25)
+            build.assert_not_called()
+
+            sqs.send_message(QueueUrl="url", MessageBody="{}")
+
+            build.assert_called_once_with('sqs', {'read_timeout': 25})
+            build.return_value.send_message.assert_called_once_with(QueueUrl="url", MessageBody="{}")
+
+    def test_clients_share_tuned_config(self):
+        with patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1"}):
+            sqs = clients._client('sqs', {'read_timeout': 25})
+            s3 = clients._client('s3', {})
+
+        self.assertIs(clients._client('s3', {}), s3)
+        self.assertEqual(s3.meta.config.max_pool_connections, clients.POOL_SIZE)
+        self.assertEqual(s3.meta.config.read_timeout, clients.READ_TIMEOUT_SECONDS)
+        self.assertEqual(s3.meta.config.retries['mode'], "adaptive")
+        self.assertEqual(sqs.meta.config.read_timeout, 25)
+        self.assertEqual(sqs.meta.config.max_pool_connections, clients.POOL_SIZE)
+
+    def test_retries_and_throttles_are_counted(self):
+        before = clients.counters()
+        throttled = ({}, {'Error': {'Code': 'ProvisionedThroughputExceededException'}})
+
+        clients._on_needs_retry(response=throttled, attempts=1)
+        clients._on_needs_retry(response=({}, {'Error': {'Code': 'ValidationException'}}), attempts=1)
+        clients._on_needs_retry(response=None, caught_exception=IOError(), attempts=1)
+        clients._on_after_call(parsed={'ResponseMetadata': {'RetryAttempts': 2}})
+        clients._on_after_call(parsed={'ResponseMetadata': {}})
+
+        after = clients.counters()
+        self.assertEqual(after['AwsThrottles'] - before['AwsThrottles'], 1)
+        self.assertEqual(after['AwsRetries'] - before['AwsRetries'], 2)
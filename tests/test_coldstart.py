@@ -0,0 +1,33 @@
+import random
+from unittest import TestCase
+
+from bench.coldstart import LocalInvoker, compare, synthetic_invocations
+
+
+class TestColdStart(TestCase):
+    def test_idle_containers_are_reused_until_they_expire(self):
+        invoker = LocalInvoker(lambda handler: handler, keep_alive=10, init_seconds=1)
+
+        self.assertTrue(invoker.invoke(0, "join_game", 0.5))
+        # The only container is still starting, so a second one is needed
+        self.assertTrue(invoker.invoke(1, "join_game", 0.5))
+        self.assertFalse(invoker.invoke(5, "join_game", 0.5))
+        self.assertTrue(invoker.invoke(20, "join_game", 0.5))
+        self.assertEqual(invoker.report()['peak_containers'], 2)
+
+    def test_routing_shares_warm_containers(self):
+        invocations = [(0, "create_game", 0.1), (30, "join_game", 0.1), (60, "start_game", 0.1)]
+
+        report = compare(invocations, keep_alive=120, init_seconds=0.2)
+
+        self.assertEqual(report['per_handler']['cold_starts'], 3)
+        self.assertEqual(report['routed']['cold_starts'], 1)
+
+    def test_synthetic_games_are_never_colder_when_routed(self):
+        invocations = synthetic_invocations(random.Random(1), games=20, rate=0.5, players=3, think=10,
+                                            duration=0.05, tick=60)
+
+        report = compare(invocations, keep_alive=300, init_seconds=0.2)
+
+        self.assertEqual(report['routed']['invocations'], len(invocations))
+        self.assertLessEqual(report['routed']['cold_starts'], report['per_handler']['cold_starts'])
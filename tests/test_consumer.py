@@ -0,0 +1,70 @@
+import json
+from unittest import TestCase
+
+import handlers
+from aws import local, sqs
+from aws.consumer import QueueConsumer
+from events import Event, PlayerJoined
+
+
+class TestQueueConsumer(TestCase):
+    def setUp(self):
+        self.backend = local.install()
+        self.now = 0
+        self.queue_url = sqs.create_queue("ABCD", "consumer")
+        self.consumer = QueueConsumer(self.queue_url, wait_seconds=0, gap_seconds=30, clock=lambda: self.now)
+
+    def send(self, *seqs):
+        for seq in seqs:
+            sqs.send_message(self.queue_url, Event("Numbered", n=seq).sequenced(seq))
+
+    def test_game_events_are_received_in_batches(self):
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        for n in range(12):
+            handlers.join_game({"name": "Player {}".format(n), "gameId": created["gameId"]}, None)
+        consumer = QueueConsumer(created["queueUrl"], wait_seconds=0)
+
+        events = consumer.poll() + consumer.poll()
+
+        self.assertEqual([event["player_name"] for event in events], ["Player {}".format(n) for n in range(12)])
+        self.assertEqual([event.seq for event in events], range(1, 13))
+        # A receive and a batch delete for each batch of ten
+        self.assertEqual(consumer.requests, 4)
+        self.assertEqual(consumer.poll(), [])
+
+    def test_only_decoded_messages_are_deleted(self):
+        self.send(1)
+        self.backend.sqs.send_message(QueueUrl=self.queue_url, MessageBody="not an event")
+        self.send(2)
+
+        self.assertEqual([event.seq for event in self.consumer.poll()], [1, 2])
+
+        self.assertEqual(self.consumer.malformed, 1)
+        self.assertEqual([body for _, body in self.backend.sqs._in_flight.values()], ["not an event"])
+
+    def test_events_are_put_back_in_order_without_duplicates(self):
+        self.send(2, 1, 2, 4)
+        self.assertEqual([event.seq for event in self.consumer.poll()], [1, 2])
+
+        self.send(3, 1, 5)
+        self.assertEqual([event.seq for event in self.consumer.poll()], [3, 4, 5])
+        self.assertEqual(self.consumer.duplicates, 2)
+        self.assertEqual(self.consumer.received, 7)
+
+    def test_missing_event_is_given_up_on(self):
+        self.send(1, 3, 4)
+        self.assertEqual([event.seq for event in self.consumer.poll()], [1])
+        self.now = 29
+        self.assertEqual(self.consumer.poll(), [])
+
+        self.now = 30
+        self.assertEqual([event.seq for event in self.consumer.poll()], [3, 4])
+        self.assertEqual(self.consumer.skipped, 1)
+        self.send(2)
+        self.assertEqual(self.consumer.poll(), [])
+
+    def test_unnumbered_events_are_delivered_as_they_arrive(self):
+        self.send(2)
+        sqs.send_message(self.queue_url, PlayerJoined("Jeb"))
+
+        self.assertEqual([event.type for event in self.consumer.poll()], ["PlayerJoined"])
@@ -28,4 +28,44 @@ class TestEvent(TestCase):
 
         event_subclass = PlayerJoined("Jeb")
 
-        self.assertEqual(from_json(event_subclass.toJson()), event_subclass)
\ No newline at end of file
+        self.assertEqual(from_json(event_subclass.toJson()), event_subclass)
+
+    def test_trace_serialization(self):
+        event = PlayerJoined("Jeb").start_trace("submit_prompt", trace_id="abc", at=1.0)
+        event.mark("publish")
+
+        deserialized = from_json(event.toJson())
+
+        self.assertEqual(deserialized, event)
+        self.assertEqual(deserialized.trace['id'], "abc")
+        self.assertEqual([hop for hop, _ in deserialized.trace['hops']], ["submit_prompt", "publish"])
+        self.assertIsNone(from_json(PlayerJoined("Zedd").toJson()).trace)
+
+    def test_sequence_number_serialization(self):
+        event = PlayerJoined("Jeb")
+        sequenced = event.sequenced(3)
+
+        self.assertIsNone(event.seq)
+        self.assertEqual(from_json(sequenced.toJson()).seq, 3)
+        self.assertEqual(from_json(sequenced.toJson()), event)
+        self.assertIsNone(from_json(event.toJson()).seq)
+
+    def test_trace_continuation(self):
+        cause = Event("Prompt").start_trace("submit_prompt")
+        effect = Event("NewPrompts").continue_trace(cause, "transition")
+        untraced = Event("NewPrompts").continue_trace(Event("Prompt"), "transition")
+
+        self.assertEqual(effect.trace['id'], cause.trace['id'])
+        self.assertEqual([hop for hop, _ in effect.trace['hops']], ["submit_prompt", "transition"])
+        self.assertEqual(len(cause.trace['hops']), 1)
+        self.assertIsNone(untraced.trace)
+
+    def test_stamped_copies_trace(self):
+        event = Event("StoryUpdate", story="Once").start_trace("choose_prompt")
+
+        stamped = event.stamped("sqs_send")
+
+        self.assertEqual([hop for hop, _ in stamped.trace['hops']], ["choose_prompt", "sqs_send"])
+        self.assertEqual(len(event.trace['hops']), 1)
+        untraced = Event("StoryUpdate")
+        self.assertIs(untraced.stamped("sqs_send"), untraced)
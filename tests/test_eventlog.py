@@ -0,0 +1,116 @@
+import json
+from unittest import TestCase
+
+from mock import patch
+
+import aws
+import handlers
+from aws import admission, dynamo, eventlog, local
+from aws.cache import GameCache
+from game import CompleteGame, TOTAL_ROUNDS
+
+
+class TestEventLog(TestCase):
+    def setUp(self):
+        self.backend = local.install()
+        for patcher in (patch.object(eventlog, "ENABLED", True),
+                        patch.object(eventlog, "SNAPSHOT_EVERY", 1000),
+                        patch.object(aws, "game_cache", GameCache(max_size=0))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        self.game_id = created["gameId"]
+        self.host_token = created["hostToken"]
+        self.host_queue = created["queueUrl"]
+        self.players = [json.loads(handlers.join_game({"name": name, "gameId": self.game_id}, None))
+                        for name in ("Jeb", "Zedd")]
+
+    def play_round(self, choice):
+        for player in self.players:
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"],
+                                    "prompt": "{} from {}".format(choice, player["playerToken"])}, None)
+        handlers.choose_prompt({"gameId": self.game_id, "token": self.host_token, "prompt": choice}, None)
+
+    def queued_messages(self):
+        return sum(len(queue) for queue in self.backend.sqs._queues.values())
+
+    @patch.object(admission, "ENABLED", False)
+    def test_replay_matches_live_game(self):
+        with patch("time.time", return_value=100.0):
+            handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        with patch("time.time", return_value=130.0):
+            self.play_round("Once")
+        handlers.submit_prompt({"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                                "prompt": "upon"}, None)
+
+        loaded, seq = eventlog.load_game(self.game_id)
+        rebuilt, rebuilt_seq = eventlog.rebuild_game(self.game_id)
+
+        self.assertEqual(seq, rebuilt_seq)
+        for game in (loaded, rebuilt):
+            self.assertEqual(game.story, " Once")
+            self.assertEqual(game.round_number, 2)
+            self.assertEqual(game.prompts, {"Jeb": "upon"})
+            self.assertEqual([player.name for player in game.players], ["Jeb", "Zedd"])
+            self.assertEqual(game.host.queueUrl, self.host_queue)
+            self.assertEqual(game.stats.round_durations, [30.0])
+            self.assertEqual(game.stats.prompts, {"Jeb": 2, "Zedd": 1})
+
+    def test_snapshots_are_written_per_round(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        self.play_round("Once")
+        handlers.submit_prompt({"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                                "prompt": "upon"}, None)
+
+        snapshot_seq = dynamo.load_game_version(self.game_id)
+        replayed = eventlog.records_after(self.game_id, snapshot_seq)
+
+        self.assertEqual([actions for _, actions in replayed], [[{"a": "prompt", "player": "Jeb", "prompt": "upon"}]])
+
+    def test_complete_game_is_snapshotted(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        for round_number in range(TOTAL_ROUNDS):
+            self.play_round("Word{}".format(round_number))
+
+        self.assertIsInstance(dynamo.load_game(self.game_id), CompleteGame)
+        self.assertEqual(eventlog.records_after(self.game_id, dynamo.load_game_version(self.game_id)), [])
+
+    def test_replay_does_not_notify(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        messages = self.queued_messages()
+
+        eventlog.rebuild_game(self.game_id)
+
+        self.assertEqual(self.queued_messages(), messages)
+
+    def test_replay_keeps_numbering_notifications(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        for player in self.players:
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"], "prompt": "Once"}, None)
+
+        # Every load replays the joins from the creation snapshot, without reusing their numbers
+        host_events = [json.loads(body) for body in self.backend.sqs.drain(self.host_queue)]
+        self.assertEqual([(event["type"], event["seq"]) for event in host_events],
+                         [("PlayerJoined", 1), ("PlayerJoined", 2), ("NewPrompts", 3)])
+
+    def test_concurrent_append_is_rejected(self):
+        _, seq = eventlog.load_game(self.game_id)
+
+        eventlog.append(self.game_id, seq + 1, [{"a": "start"}])
+
+        with self.assertRaises(dynamo.ConcurrentModificationError):
+            eventlog.append(self.game_id, seq + 1, [{"a": "start"}])
+
+    def test_cleanup_deletes_records(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        with patch.object(dynamo, "GAME_AGE_THRESHOLD_SECONDS", -1):
+            handlers.cleanup({}, None)
+
+        self.assertEqual(eventlog.records_after(self.game_id, 0), [])
+
+    def test_cleanup_deletes_the_queues_of_players_who_joined_after_the_snapshot(self):
+        with patch.object(dynamo, "GAME_AGE_THRESHOLD_SECONDS", -1):
+            response = json.loads(handlers.cleanup({}, None))
+
+        self.assertEqual(len(response["removed_queues"]), 3)
+        self.assertEqual(self.backend.sqs._queues, {})
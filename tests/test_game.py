@@ -2,8 +2,8 @@ from unittest import TestCase
 
 from events import PlayerJoined, GameStarted, Prompt, NewPrompts, StoryUpdate, ChoosePrompt, Done
 from game import Player, GameFactory, WaitForSubmissionsGame, ChoosingGame, TOTAL_ROUNDS, CompleteGame, \
-    NotificationManager
-from mock import Mock
+    NotificationManager, round_deadline, stats_view
+from mock import Mock, patch
 
 MOCK_GAME_ID = "ASDF"
 
@@ -26,6 +26,17 @@ class TestGame(TestCase):
         self.assertNotIn(self.host, game.players)
         self.notification_manager.subscribe.assert_called_with(self.host, PlayerJoined, NewPrompts, Done)
 
+    def test_games_do_not_share_notifications(self):
+        game_factory = GameFactory(Mock(new_id=Mock(return_value=MOCK_GAME_ID)))
+        other_host = self.create_player("Other Host")
+
+        game_factory.new_game(self.host)
+        other_game = game_factory.new_game(other_host)
+        other_game.register_player(self.first_player)
+
+        other_host.notify.assert_called_with(PlayerJoined(self.first_player.name))
+        self.host.notify.assert_not_called()
+
     def test_player_joins_game(self):
         game = self.create_game_with_player(self.first_player)
 
@@ -162,6 +173,86 @@ class TestGame(TestCase):
         self.notification_manager.publish.assert_called_with(expected_event)
         self.assertIs(type(result_game), CompleteGame)
 
+    def test_round_deadline_closes_submissions(self):
+        game = WaitForSubmissionsGame(self.host, MOCK_GAME_ID,
+                                      players=[self.first_player, self.second_player],
+                                      story="", current_round=2, spectators=[],
+                                      notification_manager=self.notification_manager)
+        self.assertEqual(round_deadline(game)[:2], ("WAIT_FOR_SUBMISSIONS", 2))
+        game.receive_prompt(Prompt("Only prompt", self.first_player.name))
+
+        result_game = game.close_round()
+
+        self.notification_manager.publish.assert_called_with(NewPrompts(prompts=["Only prompt"]))
+        self.assertIs(type(result_game), ChoosingGame)
+        self.assertEqual(result_game.prompts, {self.first_player.name: "Only prompt"})
+        self.assertEqual(round_deadline(result_game).action, "choose_default")
+
+        result_game = result_game.choose_default()
+
+        self.assertIs(type(result_game), WaitForSubmissionsGame)
+        self.assertEqual(result_game.story, " Only prompt")
+
+    def test_round_deadline_without_prompts_ends_game(self):
+        game = WaitForSubmissionsGame(self.host, MOCK_GAME_ID,
+                                      players=[self.first_player], story="Story", current_round=3,
+                                      spectators=[], notification_manager=self.notification_manager)
+
+        result_game = game.close_round()
+
+        self.notification_manager.publish.assert_called_with(Done(winner="Nobody", story="Story"))
+        self.assertIs(type(result_game), CompleteGame)
+        self.assertIsNone(round_deadline(result_game))
+
+    def test_transitions_keep_statistics(self):
+        game = self.create_game_with_player(self.first_player)
+        game.register_player(self.second_player)
+        with patch("time.time", return_value=100.0):
+            game = game.start()
+        game.receive_prompt(Prompt("First", self.first_player.name))
+        game = game.receive_prompt(Prompt("Second", self.second_player.name))
+        with patch("time.time", return_value=130.0):
+            game = game.choose_prompt(ChoosePrompt("Second"))
+        game.receive_prompt(Prompt("Third", self.first_player.name))
+        game = game.close_round()
+        with patch("time.time", return_value=190.0):
+            game = game.choose_default()
+
+        self.assertEqual(stats_view(game), {
+            'rounds': 2,
+            'averageRoundSeconds': 45.0,
+            'promptsPerPlayer': {"Jeb": 2, "Zedd": 1},
+            'chosenPerPlayer': {"Jeb": 1, "Zedd": 1},
+            'defaultChoices': 1
+        })
+        self.assertEqual(game.stats.totals(), {
+            'GamesStarted': 1, 'GamesCompleted': 0, 'Players': 2, 'Rounds': 2, 'RoundMillis': 90000,
+            'Prompts': 3, 'PromptsChosen': 2, 'DefaultChoices': 1
+        })
+
+    def test_evicted_player_is_not_waited_for(self):
+        third_player = self.create_player("Kip")
+        game = WaitForSubmissionsGame(self.host, MOCK_GAME_ID,
+                                      players=[self.first_player, self.second_player, third_player],
+                                      story="", current_round=1, spectators=[self.spectator],
+                                      notification_manager=self.notification_manager)
+        game.receive_prompt(Prompt("Leaving soon", third_player.name))
+        game.receive_prompt(Prompt("First", self.first_player.name))
+
+        game = game.evict(third_player)
+        self.assertIs(type(game), WaitForSubmissionsGame)
+        self.assertEqual(game.prompts, {self.first_player.name: "First"})
+        game = game.evict(self.spectator)
+        self.assertIs(type(game), WaitForSubmissionsGame)
+
+        game = game.evict(self.second_player)
+
+        self.notification_manager.unsubscribe.assert_any_call(third_player)
+        self.notification_manager.publish.assert_called_with(NewPrompts(prompts=["First"]))
+        self.assertIs(type(game), ChoosingGame)
+        self.assertEqual(game.players, (self.first_player,))
+        self.assertEqual(game.spectators, ())
+
     def create_player(self, name):
         new_player = Mock(spec=Player)
         new_player.name = name
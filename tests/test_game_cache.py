@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+import aws
+from aws import dynamo, eventlog
+from aws.cache import GameCache
+
+
+class TestGameCache(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = GameCache(max_size=2, ttl_seconds=60, clock=lambda: self.now)
+
+    def test_lru_eviction(self):
+        self.cache.put("AAAA", "game a", 1)
+        self.cache.put("BBBB", "game b", 1)
+        self.cache.get("AAAA")
+        self.cache.put("CCCC", "game c", 1)
+
+        self.assertEqual(self.cache.get("AAAA"), ("game a", 1))
+        self.assertIsNone(self.cache.get("BBBB"))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl_expiry(self):
+        self.cache.put("AAAA", "game a", 3)
+        self.now += 61
+
+        self.assertIsNone(self.cache.get("AAAA"))
+
+    def test_disabled_cache(self):
+        cache = GameCache(max_size=0)
+        cache.put("AAAA", "game a", 1)
+
+        self.assertIsNone(cache.get("AAAA"))
+
+
+class TestCachedLoading(TestCase):
+    def setUp(self):
+        self.cache = GameCache()
+        patcher = patch.object(aws, 'game_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch.object(dynamo, 'load_versioned_game')
+    @patch.object(dynamo, 'load_game_version')
+    def test_hit_validated_by_version(self, load_game_version, load_versioned_game):
+        game = Mock(id="ABCD")
+        self.cache.put("ABCD", game, 4)
+        load_game_version.return_value = 4
+
+        wrapper = aws.GameWrapperFactory.load_game("ABCD")
+
+        self.assertIs(wrapper.game.game, game)
+        self.assertEqual(wrapper.version, 4)
+        load_versioned_game.assert_not_called()
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    @patch.object(dynamo, 'load_versioned_game')
+    @patch.object(dynamo, 'load_game_version')
+    def test_stale_entry_is_reloaded(self, load_game_version, load_versioned_game):
+        fresh_game = Mock(id="ABCD")
+        self.cache.put("ABCD", Mock(id="ABCD"), 4)
+        load_game_version.return_value = 5
+        load_versioned_game.return_value = (fresh_game, 5)
+
+        wrapper = aws.GameWrapperFactory.load_game("ABCD")
+
+        self.assertIs(wrapper.game.game, fresh_game)
+        self.assertEqual(self.cache.stats()['stale'], 1)
+
+    @patch.object(dynamo, 'save_game')
+    def test_failed_save_invalidates(self, save_game):
+        game = Mock(id="ABCD")
+        self.cache.put("ABCD", game, 4)
+        save_game.side_effect = dynamo.ConcurrentModificationError("ABCD")
+
+        self.assertRaises(dynamo.ConcurrentModificationError, aws.GameWrapper(game, 4).save)
+        self.assertIsNone(self.cache.get("ABCD"))
+
+    @patch.object(dynamo, 'VIEWS_ENABLED', False)
+    @patch.object(dynamo, 'save_view')
+    @patch.object(dynamo, 'save_game')
+    def test_save_caches_new_version(self, save_game, save_view):
+        game = Mock(id="ABCD", **{'stats.totals.return_value': {}})
+        save_game.return_value = 5
+
+        aws.GameWrapper(game, 4).save()
+
+        save_game.assert_called_with(game, 4)
+        save_view.assert_not_called()
+        self.assertEqual(self.cache.get("ABCD"), (game, 5))
+
+    @patch.object(eventlog, 'ENABLED', False)
+    @patch.object(dynamo, 'VIEWS_ENABLED', True)
+    @patch.object(dynamo, 'save_view')
+    @patch.object(dynamo, 'save_game')
+    def test_save_stores_view_when_enabled(self, save_game, save_view):
+        game = Mock(id="ABCD", **{'stats.totals.return_value': {}})
+        save_game.return_value = 5
+
+        aws.GameWrapper(game, 4).save()
+
+        save_view.assert_called_with(game, 5)
@@ -39,3 +39,7 @@ class TestGameIntegration(TestCase):
 
         self.assertIs(type(game), CompleteGame)
         self.assertEqual(game.story, expected_story)
+        self.assertEqual(len(game.rounds), TOTAL_ROUNDS)
+        self.assertEqual(game.rounds[0], {'round': 1, 'choice': first_player_prompt,
+                                          'prompts': {player1.name: first_player_prompt,
+                                                      player2.name: second_player_prompt}})
@@ -0,0 +1,285 @@
+import json
+import time
+import uuid
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+from mock import patch
+
+import game
+import handlers
+from aws import GameWrapper, Player, deadlines, dynamo, eventlog, local
+from events import from_json
+
+
+class TestHandlers(TestCase):
+    def setUp(self):
+        self.backend = local.install()
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        self.game_id = created["gameId"]
+        self.host_token = created["hostToken"]
+        self.host_queue = created["queueUrl"]
+        self.players = [json.loads(handlers.join_game({"name": name, "gameId": self.game_id}, None))
+                        for name in ("Jeb", "Zedd")]
+
+    def host_events(self):
+        return [from_json(body) for body in self.backend.sqs.drain(self.host_queue)]
+
+    def test_apply_actions(self):
+        actions = [
+            {"action": "start_game", "token": self.host_token},
+            {"action": "submit_prompt", "token": self.players[0]["playerToken"], "prompt": "First"},
+            {"action": "submit_prompt", "token": "not a player", "prompt": "Intruder"},
+            {"action": "submit_prompt", "token": self.players[0]["playerToken"], "prompt": "Again"},
+            {"action": "submit_prompt", "token": self.players[1]["playerToken"], "prompt": "Second"},
+            {"action": "choose_prompt", "token": self.host_token, "prompt": "Second"},
+            {"action": "explode"}
+        ]
+        version_before = dynamo.load_game_version(self.game_id)
+
+        response = json.loads(handlers.apply_actions({"gameId": self.game_id, "actions": actions}, None))
+
+        results = response["results"]
+        self.assertEqual([result["ok"] for result in results], [True, True, False, False, True, True, False])
+        self.assertTrue(results[2]["error"].startswith("Authorization Error"))
+        self.assertIn("already submitted", results[3]["error"])
+        new_prompts = [event for event in self.host_events() if event.type == "NewPrompts"]
+        self.assertEqual(sorted(new_prompts[0]["prompts"]), ["First", "Second"])
+        self.assertEqual(dynamo.load_game_version(self.game_id), version_before + 1)
+
+        player_events = [from_json(body) for body in self.backend.sqs.drain(self.players[1]["queueUrl"])]
+        self.assertEqual(player_events[-1].type, "StoryUpdate")
+        self.assertEqual(player_events[-1]["story"], " Second")
+
+    def test_actions_out_of_phase_are_rejected_alone(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        actions = [
+            {"action": "submit_prompt", "token": self.players[0]["playerToken"], "prompt": "First"},
+            {"action": "start_game", "token": self.host_token},
+            {"action": "choose_prompt", "token": self.host_token, "prompt": "First"},
+            {"action": "submit_prompt", "token": self.players[1]["playerToken"], "prompt": "Second"}
+        ]
+
+        response = json.loads(handlers.apply_actions({"gameId": self.game_id, "actions": actions}, None))
+
+        self.assertEqual([result["ok"] for result in response["results"]], [True, False, False, True])
+        self.assertIn("Cannot start_game", response["results"][1]["error"])
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["phase"], "CHOOSING")
+
+    def test_failed_transition_aborts_the_batch(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        self.host_events()
+        version_before = dynamo.load_game_version(self.game_id)
+        actions = [{"action": "submit_prompt", "token": player["playerToken"], "prompt": "Once"}
+                   for player in self.players]
+        error = ClientError({"Error": {"Code": "InternalError", "Message": "Try again"}}, "GetObject")
+
+        with patch.object(game.WaitForSubmissionsGame, "_present_prompts", side_effect=error), \
+                self.assertRaises(RuntimeError):
+            handlers.apply_actions({"gameId": self.game_id, "actions": actions}, None)
+
+        self.assertEqual(dynamo.load_game_version(self.game_id), version_before)
+        self.assertEqual(self.host_events(), [])
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["submitted"], [])
+
+    def test_change_that_loses_a_race_sends_nothing(self):
+        self.host_events()
+        load = eventlog.load_game if eventlog.ENABLED else dynamo.load_versioned_game
+        first, second = GameWrapper(*load(self.game_id)), GameWrapper(*load(self.game_id))
+
+        with first as game_x:
+            Player("X", uuid.uuid4()).join(game_x)
+        with self.assertRaises(dynamo.ConcurrentModificationError):
+            with second as game_y:
+                Player("Y", uuid.uuid4()).join(game_y)
+
+        joined = [(event.seq, event["player_name"]) for event in self.host_events()]
+        self.assertEqual(joined, [(3, "X")])
+
+    def test_get_game_state(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        handlers.submit_prompt({"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                                "prompt": "First"}, None)
+
+        response = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))
+
+        self.assertFalse(response["notModified"])
+        self.assertEqual(response["state"]["phase"], "WAIT_FOR_SUBMISSIONS")
+        self.assertEqual(response["state"]["round"], 1)
+        self.assertEqual(response["state"]["players"], ["Jeb", "Zedd"])
+        self.assertEqual(response["state"]["submitted"], ["Jeb"])
+
+        unchanged = json.loads(handlers.get_game_state({"gameId": self.game_id,
+                                                        "ifNoneMatch": response["etag"]}, None))
+        self.assertEqual(unchanged, {"etag": response["etag"], "notModified": True})
+
+        handlers.submit_prompt({"gameId": self.game_id, "token": self.players[1]["playerToken"],
+                                "prompt": "Second"}, None)
+        changed = json.loads(handlers.get_game_state({"gameId": self.game_id,
+                                                      "ifNoneMatch": response["etag"]}, None))
+        self.assertFalse(changed["notModified"])
+        self.assertEqual(changed["state"]["phase"], "CHOOSING")
+
+    def test_get_game_state_from_stored_views(self):
+        with patch.object(dynamo, "VIEWS_ENABLED", True):
+            handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+            first = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))
+            with patch.object(dynamo, "load_view", side_effect=AssertionError("fetched the view")):
+                again = json.loads(handlers.get_game_state({"gameId": self.game_id, "ifNoneMatch": first["etag"]},
+                                                           None))
+
+        self.assertEqual(first["state"]["phase"], "WAIT_FOR_SUBMISSIONS")
+        self.assertTrue(again["notModified"])
+
+    def test_retried_join_returns_original_response(self):
+        event = {"name": "Ana", "gameId": self.game_id, "idempotencyKey": "join-ana"}
+
+        first = handlers.join_game(event, None)
+        retry = handlers.join_game(dict(event), None)
+
+        self.assertEqual(retry, first)
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["players"], ["Jeb", "Zedd", "Ana"])
+
+    def test_retried_submit_is_not_applied_twice(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        event = {"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                 "prompt": "First", "idempotencyKey": "submit-1"}
+        version = dynamo.load_game_version(self.game_id)
+
+        handlers.submit_prompt(event, None)
+        handlers.submit_prompt(dict(event), None)
+
+        self.assertEqual(dynamo.load_game_version(self.game_id), version + 1)
+
+    def test_idempotency_keys_are_scoped_to_the_caller(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        for player, prompt in zip(self.players, ("First", "Second")):
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"], "prompt": prompt,
+                                    "idempotencyKey": "same-key"}, None)
+        hosts = [json.loads(handlers.create_game({"name": name, "idempotencyKey": "same-key"}, None))
+                 for name in ("Ann", "Bob")]
+
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["phase"], "CHOOSING")
+        self.assertNotEqual(hosts[0]["hostToken"], hosts[1]["hostToken"])
+
+    def test_failed_request_can_be_retried(self):
+        event = {"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                 "prompt": "Too early", "idempotencyKey": "submit-early"}
+        self.assertRaises(RuntimeError, handlers.submit_prompt, event, None)
+
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        handlers.submit_prompt(event, None)
+
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["submitted"], ["Jeb"])
+
+    def test_advance_deadlines(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        handlers.submit_prompt({"gameId": self.game_id, "token": self.players[0]["playerToken"],
+                                "prompt": "First"}, None)
+        later = time.time() + game.SUBMISSION_SECONDS + 1
+
+        with patch("time.time", return_value=later):
+            response = json.loads(handlers.advance_deadlines({}, None))
+        self.assertEqual(response["advanced_games"], [self.game_id])
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["phase"], "CHOOSING")
+
+        with patch("time.time", return_value=later + game.CHOICE_SECONDS + 1):
+            response = json.loads(handlers.advance_deadlines({}, None))
+        self.assertEqual(response["advanced_games"], [self.game_id])
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual((state["phase"], state["round"], state["story"]), ("WAIT_FOR_SUBMISSIONS", 2, " First"))
+
+    def test_rescheduling_removes_the_previous_deadline(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        for player in self.players:
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"],
+                                    "prompt": "Prompt"}, None)
+
+        live = [item for item in self.backend.deadline_table.scan()['Items']
+                if item['due_bucket'] != deadlines.SCHEDULED_BUCKET]
+        self.assertEqual([(item['phase'], item['round_number']) for item in live], [("CHOOSING", 1)])
+
+        handlers.choose_prompt({"gameId": self.game_id, "token": self.host_token, "prompt": "Prompt"}, None)
+        for player in self.players:
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"],
+                                    "prompt": "Again"}, None)
+        handlers.choose_prompt({"gameId": self.game_id, "token": self.host_token, "prompt": "Again"}, None)
+        live = [item for item in self.backend.deadline_table.scan()['Items']
+                if item['due_bucket'] != deadlines.SCHEDULED_BUCKET]
+        self.assertEqual(len(live), 1)
+
+    def test_cleanup_removes_the_deadlines_of_abandoned_games(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+
+        with patch.object(dynamo, "GAME_AGE_THRESHOLD_SECONDS", -1):
+            handlers.cleanup({}, None)
+
+        self.assertEqual(self.backend.deadline_table.scan()['Items'], [])
+
+    def test_stale_deadlines_are_dropped(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        # As if removing the submission deadline had failed
+        with patch.object(deadlines, "remove"):
+            for player in self.players:
+                handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"],
+                                        "prompt": "Prompt"}, None)
+
+        later = time.time() + max(game.SUBMISSION_SECONDS, game.CHOICE_SECONDS) + 1
+
+        with patch("time.time", return_value=later):
+            response = json.loads(handlers.advance_deadlines({}, None))
+
+        # Only the host's choice deadline is live; the submission deadline was met
+        self.assertEqual(response, {"advanced_games": [self.game_id], "stale_deadlines": 1})
+
+    def test_create_games(self):
+        response = json.loads(handlers.create_games({"hosts": ["Ann", "Bob", "Cat"]}, None))
+
+        created = response["games"]
+        game_ids = [entry["gameId"] for entry in created]
+        self.assertEqual(len(set(game_ids + [self.game_id])), 4)
+        for entry in created:
+            self.assertEqual(self.backend.sqs.drain(entry["queueUrl"]), [])
+            joined = json.loads(handlers.join_game({"name": "Jeb", "gameId": entry["gameId"]}, None))
+            handlers.start_game({"gameId": entry["gameId"], "token": entry["hostToken"]}, None)
+            handlers.submit_prompt({"gameId": entry["gameId"], "token": joined["playerToken"],
+                                    "prompt": "First"}, None)
+        # With a single player, the game waits for its host to choose
+        state = json.loads(handlers.get_game_state({"gameId": game_ids[0]}, None))["state"]
+        self.assertEqual(state["phase"], "CHOOSING")
+
+    def test_create_games_is_bounded(self):
+        with self.assertRaises(RuntimeError):
+            handlers.create_games({"hosts": ["Host"] * (handlers.MAX_GAMES_PER_REQUEST + 1)}, None)
+
+    def test_stats_are_kept_on_transitions(self):
+        handlers.start_game({"gameId": self.game_id, "token": self.host_token}, None)
+        for player, prompt in zip(self.players, ("First", "Second")):
+            handlers.submit_prompt({"gameId": self.game_id, "token": player["playerToken"], "prompt": prompt}, None)
+        handlers.choose_prompt({"gameId": self.game_id, "token": self.host_token, "prompt": "Second"}, None)
+
+        state = json.loads(handlers.get_game_state({"gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["stats"]["chosenPerPlayer"], {"Zedd": 1})
+        self.assertEqual(state["stats"]["promptsPerPlayer"], {"Jeb": 1, "Zedd": 1})
+        stats = json.loads(handlers.get_stats({}, None))
+        self.assertEqual(stats["totals"]["Prompts"], 2)
+        self.assertEqual(stats["totals"]["Rounds"], 1)
+        self.assertEqual(stats["promptsPerPlayer"], 1.0)
+        self.assertEqual(stats["chosenPromptRate"], 0.5)
+
+    def test_dispatch_routes_by_action(self):
+        joined = json.loads(handlers.dispatch({"action": "join_game", "name": "Ann", "gameId": self.game_id}, None))
+        handlers.dispatch({"action": "start_game", "gameId": self.game_id, "token": self.host_token}, None)
+
+        state = json.loads(handlers.dispatch({"action": "get_game_state", "gameId": self.game_id}, None))["state"]
+        self.assertEqual(state["phase"], "WAIT_FOR_SUBMISSIONS")
+        self.assertIn("Ann", state["players"])
+        self.assertIn("playerToken", joined)
+        with self.assertRaises(RuntimeError):
+            handlers.dispatch({"action": "explode"}, None)
@@ -0,0 +1,63 @@
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+from mock import Mock, patch
+
+import metrics
+from events import GameStarted
+from game import NotificationManager, Player
+
+
+class TestMetrics(TestCase):
+    def test_disabled_records_nothing(self):
+        with patch.object(metrics, 'ENABLED', False), patch('sys.stdout', new_callable=StringIO) as out:
+            with metrics.HandlerMetrics("start_game"):
+                self.assertFalse(metrics.recording())
+                with metrics.phase("LoadGame"):
+                    metrics.increment("DynamoCalls")
+
+        self.assertEqual(out.getvalue(), "")
+
+    def test_handler_invocation_emits_metrics(self):
+        mgr = NotificationManager()
+        mgr.subscribe(Mock(spec=Player), GameStarted)
+        mgr.subscribe(Mock(spec=Player), GameStarted)
+
+        with patch.object(metrics, 'ENABLED', True), patch('sys.stdout', new_callable=StringIO) as out:
+            with metrics.HandlerMetrics("start_game", {"gameId": "ABCD"}):
+                mgr.publish(GameStarted())
+                metrics.increment("GameItemBytes", 100, metrics.BYTES)
+                metrics.increment("GameItemBytes", 50, metrics.BYTES)
+            self.assertFalse(metrics.recording())
+
+        record = json.loads(out.getvalue())
+        self.assertEqual(record["Handler"], "start_game")
+        self.assertEqual(record["GameId"], "ABCD")
+        self.assertEqual(record["Notifications"], 2)
+        self.assertEqual(record["GameItemBytes"], 150)
+        self.assertEqual(record["Errors"], 0)
+        self.assertIn("Publish", record)
+        self.assertIn("Total", record)
+        declared = {metric["Name"]: metric["Unit"] for metric in record["_aws"]["CloudWatchMetrics"][0]["Metrics"]}
+        self.assertEqual(declared["GameItemBytes"], "Bytes")
+        self.assertEqual(declared["Publish"], "Milliseconds")
+
+    def test_errors_are_counted(self):
+        with patch.object(metrics, 'ENABLED', True), patch('sys.stdout', new_callable=StringIO) as out:
+            try:
+                with metrics.HandlerMetrics("submit_prompt"):
+                    raise RuntimeError("boom")
+            except RuntimeError:
+                pass
+
+        self.assertEqual(json.loads(out.getvalue())["Errors"], 1)
+
+    def test_first_invocation_is_a_cold_start(self):
+        with patch.object(metrics, 'ENABLED', True), patch.object(metrics, '_cold', True), \
+                patch('sys.stdout', new_callable=StringIO) as out:
+            for _ in range(2):
+                with metrics.HandlerMetrics("start_game"):
+                    pass
+
+        self.assertEqual([json.loads(line)["ColdStart"] for line in out.getvalue().splitlines()], [1, 0])
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from bench.micro import compare, main, run_benchmarks
+
+
+class TestMicroBenchmarks(TestCase):
+    def test_all_benchmarks_run(self):
+        results = run_benchmarks(players=[2], story_lengths=[3], repeat=1, min_time=0)
+
+        self.assertIn("register_player[players=2]", results)
+        self.assertIn("event_json_round_trip[players=2,story_length=3]", results)
+        self.assertTrue(all(seconds > 0 for seconds in results.values()))
+
+    def test_compare_against_baseline(self):
+        baseline = {"fast": 1.0, "slow": 1.0}
+        results = {"fast": 1.1, "slow": 1.5, "new": 9.0}
+
+        regressions = compare(results, baseline, threshold=0.2)
+
+        self.assertEqual([regression[0] for regression in regressions], ["slow"])
+        self.assertEqual(compare(results, baseline, threshold=0.6), [])
+
+    def test_missing_baseline_fails_the_gate(self):
+        self.assertEqual(main(["--baseline", "/nonexistent/baseline.json"]), 2)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+import game
+import moderation
+from bench import blocklist
+from events import NewPrompts, Prompt, ChoosePrompt
+from game import NotificationManager, Player, WaitForSubmissionsGame
+from moderation import BlocklistStage, Matcher
+
+
+def create_player(name):
+    player = Mock(spec=Player)
+    player.name = name
+    return player
+
+
+class TestMatcher(TestCase):
+    def test_overlapping_terms_are_all_found(self):
+        matcher = Matcher(["he", "she", "hers", "his"])
+
+        self.assertEqual(sorted(matcher.matches(moderation.normalize(u"ushers he"))), [(7, 9)])
+        self.assertEqual(sorted(Matcher(["big", "big bad", "bad wolf"]).matches(u"big bad wolf")),
+                         [(0, 3), (0, 7), (4, 12)])
+
+    def test_only_whole_words_are_masked(self):
+        matcher = Matcher(["ass"])
+
+        self.assertEqual(matcher.mask(u"a class act, you ass!"), u"a class act, you ***!")
+
+    def test_case_accents_and_substitutions_are_seen_through(self):
+        matcher = Matcher(["darn it", u"crème"])
+
+        self.assertEqual(matcher.mask(u"Well D4RN   1t"), u"Well D4RN   1t")
+        self.assertEqual(matcher.mask(u"Well D4RN 1t, CREME"), u"Well *******, *****")
+
+    def test_unmatched_prompts_are_returned_as_they_are(self):
+        prompt = "Nothing to see here"
+
+        self.assertIs(Matcher(["darn"]).mask(prompt), prompt)
+
+    def test_matcher_is_compiled_once_per_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "blocklist.txt")
+        with open(path, 'w') as f:
+            f.write("# Comments and blank lines are skipped\n\ndarn\n")
+
+        stage = BlocklistStage(path)
+        self.assertEqual(stage({"Jeb": "darn"}), {"Jeb": u"****"})
+        self.assertIs(moderation.load_matcher(path), moderation.load_matcher(path))
+
+
+class TestModeratedGame(TestCase):
+    def test_prompts_are_moderated_once_per_round(self):
+        stage = Mock(wraps=BlocklistStage(matcher=Matcher(["darn"])))
+        manager = Mock(spec=NotificationManager)
+        players = [create_player("Jeb"), create_player("Zedd")]
+        waiting = WaitForSubmissionsGame(host=create_player("Host"), game_id="ASDF", players=players, story="",
+                                         current_round=1, spectators=[], notification_manager=manager)
+
+        with patch.object(game, 'PROMPT_STAGES', [stage]):
+            waiting = waiting.receive_prompt(Prompt("Darn it", "Jeb"))
+            choosing = waiting.receive_prompt(Prompt("Fine", "Zedd"))
+
+        self.assertEqual(stage.call_count, 1)
+        manager.publish.assert_called_with(NewPrompts(prompts=[u"**** it", "Fine"]))
+        self.assertEqual(choosing.prompts, {"Jeb": u"**** it", "Zedd": "Fine"})
+        choosing.choose_prompt(ChoosePrompt(u"**** it"))
+        self.assertEqual(dict(choosing.stats.chosen), {"Jeb": 1})
+
+
+class TestBlocklistBenchmark(TestCase):
+    def test_approaches_agree(self):
+        report = blocklist.run(terms=200, prompts=50, repeat=1)
+
+        self.assertEqual(set(report), {"automaton", "regex_alternation", "regex_loop", "masked_prompts"})
+        self.assertGreater(report["masked_prompts"], 0)
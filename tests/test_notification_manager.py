@@ -27,3 +27,16 @@ class TestNotificationManager(TestCase):
 
         player_two.notify.assert_called_with(done_event)
         player_one.notify.assert_called_with(done_event)
+
+    def test_unsubscribe(self):
+        mgr = NotificationManager()
+        player_one = Mock(spec=Player)
+        player_two = Mock(spec=Player)
+        mgr.subscribe(player_one, GameStarted, Done)
+        mgr.subscribe(player_two, GameStarted, Done)
+
+        mgr.unsubscribe(player_one)
+        mgr.publish(Done("Somebody", "Something"))
+
+        player_one.notify.assert_not_called()
+        player_two.notify.assert_called_once()
@@ -0,0 +1,55 @@
+import json
+import pickle
+import uuid
+from unittest import TestCase
+
+from mock import patch
+
+import handlers
+from aws import GameWrapperFactory, Host, Player, Role, dynamo, local, participants
+
+
+class TestParticipants(TestCase):
+    def setUp(self):
+        self.backend = local.install()
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        self.game_id = created["gameId"]
+        self.host_queue = created["queueUrl"]
+        self.player = json.loads(handlers.join_game({"name": "Jeb", "gameId": self.game_id}, None))
+        self.spectator = json.loads(handlers.spectate_game({"gameId": self.game_id}, None))
+
+    def load_game(self):
+        return GameWrapperFactory.load_game(self.game_id).game.game
+
+    def test_queue_urls_are_derived_from_a_shared_prefix(self):
+        game = pickle.loads(pickle.dumps(self.load_game()))
+
+        host, player, spectator = participants(game)
+        self.assertEqual([host.role, player.role, spectator.role], [Role.HOST, Role.PLAYER, Role.SPECTATOR])
+        self.assertEqual([host.queueUrl, player.queueUrl, spectator.queueUrl],
+                         [self.host_queue, self.player["queueUrl"], self.spectator["queueUrl"]])
+        self.assertEqual(player.token.hex, self.player["playerToken"])
+        self.assertIs(player._queue_prefix, host._queue_prefix)
+        self.assertIs(spectator._queue_prefix, host._queue_prefix)
+        self.assertFalse(hasattr(player, "__dict__"))
+
+    def test_participants_stored_before_slotting_can_be_loaded(self):
+        token = uuid.uuid4()
+        player = Player.__new__(Player)
+        player.__setstate__({'_name': "Jeb", 'token': token,
+                             'queueUrl': "https://queue.test/groupweave-ABCD-{}".format(token)})
+
+        self.assertEqual(player.name, "Jeb")
+        self.assertEqual(player.token, token)
+        self.assertEqual(player.queueUrl, "https://queue.test/groupweave-ABCD-{}".format(token))
+
+    def test_cleanup_deletes_every_participants_queue(self):
+        game = self.load_game()
+        with patch.object(dynamo, "get_old_or_finished_games", return_value=[game]):
+            response = json.loads(handlers.cleanup({}, None))
+
+        self.assertEqual(sorted(response["removed_queues"]),
+                         sorted([self.host_queue, self.player["queueUrl"], self.spectator["queueUrl"]]))
+
+    def test_a_host_has_no_queue_until_it_joins(self):
+        self.assertIsNone(Host("Host", uuid.uuid4()).queueUrl)
@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import pickle
+import tempfile
+import uuid
+from unittest import TestCase
+
+import boto3
+from botocore.stub import Stubber
+from mock import patch
+
+import payload
+from aws import Host, dynamo, local, sqs
+import handlers
+from events import NewPrompts, from_json
+
+
+class TestPayload(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = payload.DirectoryBlobStore(self.directory)
+        payload.set_blob_store(self.store)
+
+    def tearDown(self):
+        payload.set_blob_store(None)
+        shutil.rmtree(self.directory)
+
+    def test_small_payloads_are_stored_as_they_are(self):
+        self.assertEqual(payload.pack("small", 100), "small")
+        self.assertEqual(payload.unpack("small"), "small")
+        self.assertIsNone(payload.pack_text("small", 100))
+
+    def test_large_payloads_are_compressed(self):
+        data = "a long story " * 1000
+        packed = payload.pack(data, len(data))
+        self.assertLess(len(packed), len(data))
+        self.assertEqual(payload.unpack(packed), data)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_payloads_over_the_limit_are_offloaded(self):
+        data = os.urandom(20000)
+        packed = payload.pack(data, 1000)
+        self.assertLess(len(packed), 100)
+        self.assertEqual(payload.unpack(packed), data)
+        # Blobs are content-addressed, so packing the same payload again stores nothing new
+        self.assertEqual(payload.pack(data, 1000), packed)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_packed_event_is_unpacked_when_used(self):
+        event = NewPrompts({"Player {}".format(i): os.urandom(100).encode("hex") for i in range(100)})
+        event.start_trace("test")
+
+        message = event.toJson(max_bytes=1000)
+        self.assertLess(len(message), 1000)
+        with patch.object(self.store, "get", wraps=self.store.get) as get:
+            received = from_json(message)
+            self.assertEqual(received.type, "NewPrompts")
+            self.assertEqual(received.trace, event.trace)
+            get.assert_not_called()
+            self.assertEqual(received, event)
+            self.assertEqual(get.call_count, 1)
+
+    def test_large_game_is_offloaded(self):
+        backend = local.install()
+        game_id = json.loads(handlers.create_game({"name": "Host"}, None))["gameId"]
+        game, version = dynamo.load_versioned_game(game_id)
+        game._story = os.urandom(20000).encode("hex")
+
+        with patch.object(dynamo, "_MAX_GAME_STATE_BYTES", 1000):
+            dynamo.save_game(game, version)
+
+        self.assertEqual(len(backend.s3.list_objects_v2(Bucket=local.LOCAL_BLOB_BUCKET)['Contents']), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(dynamo.load_game(game_id).story, game.story)
+
+    def test_shared_payloads_are_not_offloaded_to_a_directory(self):
+        local.install()
+        queue_url = sqs.create_queue("TEST", "Host")
+        payload.set_blob_store(None)
+        event = NewPrompts({"Player {}".format(i): os.urandom(100).encode("hex") for i in range(100)})
+
+        with patch.object(payload, "BLOB_DIR", self.directory):
+            self.assertRaises(payload.PayloadTooLargeError, payload.pack, os.urandom(20000), 1000, shared=True)
+            self.assertRaises(payload.PayloadTooLargeError, event.toJson, 1000, shared=True)
+            with patch.object(sqs, "_MAX_PACKED_BYTES", 1000):
+                self.assertRaises(payload.PayloadTooLargeError, sqs.send_message, queue_url, event)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_event_sent_to_many_recipients_is_packed_and_uploaded_once(self):
+        backend = local.install()
+        recipients = [Host("Host {}".format(n), uuid.uuid4()) for n in range(6)]
+        for recipient in recipients:
+            recipient.use_queue(None, sqs.create_queue("ABCD", recipient.token))
+        event = NewPrompts({"Player {}".format(i): os.urandom(100).encode("hex") for i in range(100)})
+        event.start_trace("test")
+
+        with patch.object(sqs, "_MAX_PACKED_BYTES", 1000), \
+                patch.object(payload, "pack_text", wraps=payload.pack_text) as pack_text, \
+                patch.object(backend.s3, "put_object", wraps=backend.s3.put_object) as put_object:
+            for recipient in recipients:
+                recipient.notify(event)
+            NewPrompts(event["prompts"]).toJson(1000, shared=True)
+
+        self.assertEqual(pack_text.call_count, 2)
+        self.assertEqual(put_object.call_count, 1)
+        for recipient in recipients:
+            received = from_json(backend.sqs.drain(recipient.queueUrl)[0])
+            self.assertEqual((received.seq, received), (1, event))
+
+
+class TestBinaryGameState(TestCase):
+    """
+    Game items serialized by botocore rather than by the local stand-in
+    """
+
+    def setUp(self):
+        local.install()
+        game_id = json.loads(handlers.create_game({"name": "Host"}, None))["gameId"]
+        self.game = dynamo.load_game(game_id)
+
+        table = boto3.resource('dynamodb', region_name='us-east-1', aws_access_key_id='test',
+                               aws_secret_access_key='test').Table('groupweave_game_state')
+        self.stubber = Stubber(table.meta.client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        patcher = patch.object(dynamo, "_GAME_STATE_TABLE", table)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_compressed_game_state_is_stored_as_binary(self):
+        self.game._story = "a long story " * 1000
+        self.stubber.add_response('update_item', {})
+
+        dynamo.save_game(self.game, 1)
+
+        self.stubber.assert_no_pending_responses()
+
+    def test_string_game_state_can_still_be_loaded(self):
+        self.stubber.add_response('get_item', {'Item': {'game_id': {'S': self.game.id},
+                                                        'game_state': {'S': pickle.dumps(self.game)},
+                                                        'game_version': {'N': '3'}}})
+
+        game, version = dynamo.load_versioned_game(self.game.id)
+
+        self.assertEqual((game.id, game.host.name, version), (self.game.id, "Host", 3))
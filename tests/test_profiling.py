@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from mock import patch
+
+import profiling
+
+
+def busy_function():
+    return sum(i * i for i in range(10000))
+
+
+class TestProfiling(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_should_profile(self):
+        with patch.object(profiling, 'PROFILE_RATE', 0):
+            self.assertTrue(profiling.should_profile({"profile": True}))
+            self.assertFalse(profiling.should_profile({"gameId": "ABCD"}))
+        with patch.object(profiling, 'PROFILE_RATE', 1):
+            self.assertTrue(profiling.should_profile({"gameId": "ABCD"}))
+
+    def test_trace_profile_collects_collapsed_stacks(self):
+        profiler = profiling.Profiler(mode=profiling.TRACE)
+
+        with profiler:
+            busy_function()
+
+        stacks = [stack for stack in profiler.stacks if "busy_function" in stack]
+        self.assertTrue(stacks)
+        self.assertTrue(all(";" in stack for stack in stacks))
+
+    def test_write_profile(self):
+        profiler = profiling.Profiler(mode=profiling.TRACE)
+        with profiler:
+            busy_function()
+
+        prefix = profiler.write("submit_prompt-ABCD", self.directory)
+
+        with open(prefix + ".collapsed") as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        stack, weight = lines[0].rsplit(" ", 1)
+        self.assertTrue(int(weight) > 0)
+        with open(prefix + ".alloc.json") as f:
+            stats = json.load(f)
+        self.assertEqual(stats['weight_unit'], 'microseconds')
+        self.assertIn('live_object_growth', stats)
+        self.assertTrue(os.path.basename(prefix).startswith("submit_prompt-ABCD"))
+
+    def test_sampling_off_the_main_thread_reports_tracing(self):
+        profiler = profiling.Profiler(mode=profiling.SAMPLE)
+
+        def profile():
+            with profiler:
+                busy_function()
+        thread = threading.Thread(target=profile)
+        thread.start()
+        thread.join()
+
+        stats = profiler.allocation_stats()
+        self.assertEqual(stats['mode'], profiling.TRACE)
+        self.assertEqual(stats['weight_unit'], 'microseconds')
@@ -0,0 +1,99 @@
+from unittest import TestCase
+
+from twisted.internet.testing import StringTransport
+
+from cli.relay import RelayUpstream, SpectatorRelay
+from cli.server import CommandLineGroupweaveFactory, SpectatorFactory
+from events import from_json, GetGameState, StartGame
+
+
+def connect(protocol):
+    transport = StringTransport()
+    protocol.makeConnection(transport)
+    return transport
+
+
+def deliver(transport, protocol):
+    """
+    Pass the lines written to a transport on to the protocol at its other end
+    """
+    lines = transport.value().split(protocol.delimiter)
+    transport.clear()
+    for line in lines:
+        if line:
+            protocol.lineReceived(line)
+
+
+def received(transport):
+    lines = transport.value().split("\r\n")
+    transport.clear()
+    return [from_json(line) for line in lines if line]
+
+
+class TestSpectatorRelay(TestCase):
+    def setUp(self):
+        self.server = CommandLineGroupweaveFactory()
+        connect(self.server.buildProtocol(None))
+        self.server_side = SpectatorFactory(self.server).buildProtocol(None)
+        self.server_transport = connect(self.server_side)
+        self.relay = SpectatorRelay()
+        self.upstream = RelayUpstream(self.relay)
+        self.upstream_transport = connect(self.upstream)
+        self.relayed = [self.relay.buildProtocol(None) for _ in range(3)]
+        self.spectators = [connect(relayed) for relayed in self.relayed]
+        for spectator in self.spectators:
+            self.assertEqual([event.type for event in received(spectator)], ["YourNameIs"])
+
+    def test_events_are_relayed_to_every_spectator(self):
+        connect(self.server.buildProtocol(None))
+        self.server.handleEvent(StartGame())
+        deliver(self.server_transport, self.upstream)
+
+        # However many spectators the relay has, the server has just the one
+        self.assertEqual(len(self.server.game.spectators), 1)
+        for spectator in self.spectators:
+            self.assertEqual([event.type for event in received(spectator)], ["PlayerJoined", "GameStarted"])
+        self.assertEqual(self.relay.relayedEvents, 2)
+
+    def test_game_state_requests_share_one_upstream_request(self):
+        for relayed in self.relayed[:2]:
+            relayed.lineReceived(GetGameState().toJson())
+        self.assertEqual(self.upstream_transport.value().count("\r\n"), 1)
+        deliver(self.upstream_transport, self.server_side)
+        deliver(self.server_transport, self.upstream)
+
+        for spectator in self.spectators[:2]:
+            state = received(spectator)[0]
+            self.assertEqual(state["state"]["phase"], "CREATED")
+        self.assertEqual(received(self.spectators[2]), [])
+        self.assertEqual(self.server.spectators, [self.server_side])
+
+        self.relayed[0].lineReceived(GetGameState(self.relay.etag()).toJson())
+        deliver(self.upstream_transport, self.server_side)
+        deliver(self.server_transport, self.upstream)
+        self.assertTrue(received(self.spectators[0])[0]["not_modified"])
+
+    def test_game_state_requests_before_the_game_are_answered(self):
+        server = CommandLineGroupweaveFactory()
+        server_side = SpectatorFactory(server).buildProtocol(None)
+        server_transport = connect(server_side)
+        relay = SpectatorRelay()
+        upstream = RelayUpstream(relay)
+        upstream_transport = connect(upstream)
+        relayed = relay.buildProtocol(None)
+        spectator = connect(relayed)
+        received(spectator)
+
+        relayed.lineReceived(GetGameState().toJson())
+        deliver(upstream_transport, server_side)
+        deliver(server_transport, upstream)
+        self.assertIsNone(received(spectator)[0]["etag"])
+        self.assertEqual(relay.pendingStates, [])
+
+        connect(server.buildProtocol(None))
+        deliver(server_transport, upstream)
+        received(spectator)
+        relayed.lineReceived(GetGameState().toJson())
+        deliver(upstream_transport, server_side)
+        deliver(server_transport, upstream)
+        self.assertEqual(received(spectator)[0]["state"]["phase"], "CREATED")
@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import TestCase
+
+from mock import patch
+
+import game
+import handlers
+import recording
+from aws import local
+from bench import replay
+
+
+class TestReplay(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.trace = os.path.join(self.directory, "trace.jsonl.gz")
+
+    def tearDown(self):
+        recording.close()
+        shutil.rmtree(self.directory)
+
+    def play_game(self):
+        created = json.loads(handlers.create_game({"name": "Host"}, None))
+        game_id, host_token = created["gameId"], created["hostToken"]
+        players = [json.loads(handlers.join_game({"name": name, "gameId": game_id}, None))["playerToken"]
+                   for name in ("Jeb", "Zedd")]
+        handlers.start_game({"gameId": game_id, "token": host_token}, None)
+        handlers.apply_actions({"gameId": game_id, "actions": [
+            {"action": "submit_prompt", "token": players[0], "prompt": "First"},
+            {"action": "submit_prompt", "token": players[1], "prompt": "Second"},
+            {"action": "choose_prompt", "token": host_token, "prompt": "Second"}
+        ]}, None)
+        for _ in range(game.TOTAL_ROUNDS - 1):
+            handlers.submit_prompt({"gameId": game_id, "token": players[0], "prompt": "Again"}, None)
+            handlers.submit_prompt({"gameId": game_id, "token": players[1], "prompt": "More"}, None)
+            handlers.choose_prompt({"gameId": game_id, "token": host_token, "prompt": "More"}, None)
+        with self.assertRaises(Exception):
+            handlers.submit_prompt({"gameId": game_id, "token": "not a player", "prompt": "Late"}, None)
+        return game_id
+
+    def test_recordings_hold_no_tokens(self):
+        local.install()
+        with patch.object(recording, "RECORD_PATH", self.trace):
+            created = json.loads(handlers.create_game({"name": "Host"}, None))
+            joined = json.loads(handlers.join_game({"name": "Jeb", "gameId": created["gameId"]}, None))
+            with self.assertRaises(Exception):
+                handlers.start_game({"gameId": created["gameId"], "token": joined["playerToken"]}, None)
+        recording.close()
+
+        with gzip.open(self.trace) as f:
+            trace = f.read()
+        for token in (created["hostToken"], joined["playerToken"]):
+            self.assertNotIn(token, trace)
+            # Nor in the form queue URLs hold it in
+            self.assertNotIn(str(uuid.UUID(token)), trace)
+
+    def test_replayed_game_tells_the_same_story(self):
+        local.install()
+        with patch.object(recording, "RECORD_PATH", self.trace):
+            game_id = self.play_game()
+        recording.close()
+
+        records = recording.read(self.trace)
+        games, stories = replay.handler_games(records)
+        self.assertEqual(list(games), [game_id])
+        self.assertEqual(stories[game_id], " Second" + " More" * (game.TOTAL_ROUNDS - 1))
+
+        report = replay.replay(records, replay.HandlerReplayer(), speed=0)
+
+        self.assertEqual(report["story_mismatches"], [])
+        self.assertEqual(report["outcome_mismatches"], [])
+        self.assertEqual(report["stories"], {game_id: stories[game_id]})
+        self.assertEqual(report["latencies"]["submit_prompt"]["count"], 2 * (game.TOTAL_ROUNDS - 1))
+        self.assertEqual(report["latencies"]["submit_prompt"]["errors"], 1)
+        comparison = replay.compare(report, report)
+        self.assertEqual(comparison["throughput_ratio"], 1.0)
+        self.assertEqual(comparison["story_differences"], [])
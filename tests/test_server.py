@@ -1,7 +1,10 @@
 from unittest import TestCase
 
 from mock.mock import Mock
+from twisted.internet.testing import StringTransport
 
+from cli import server
+from events import ChoosePrompt, from_json, Prompt, StartGame
 from gameutil import GameReference
 from game import Game
 
@@ -34,3 +37,58 @@ class TestGameReference(TestCase):
 
         initialGame.transition.assert_any_call()
         self.assertIs(ref.game, nextGame)
+
+
+class TestPresence(TestCase):
+    def setUp(self):
+        self.factory = server.CommandLineGroupweaveFactory()
+        self.connections = []
+        for _ in range(3):
+            protocol = self.factory.buildProtocol(None)
+            protocol.makeConnection(StringTransport())
+            self.connections.append(protocol)
+        self.host, self.first, self.second = self.connections
+        self.factory.handleEvent(StartGame())
+
+    def received(self, protocol):
+        lines = protocol.transport.value().split("\r\n")
+        protocol.transport.clear()
+        return [from_json(line).type for line in lines if line]
+
+    def test_departed_player_is_evicted(self):
+        self.factory.handleEvent(Prompt("First", self.first.player.name))
+        for protocol in self.connections:
+            self.received(protocol)
+
+        self.second.connectionLost(None)
+
+        self.assertEqual(self.factory.game.players, (self.first.player,))
+        self.assertEqual(self.factory.game.prompts, {self.first.player.name: "First"})
+        self.assertIn("NewPrompts", self.received(self.host))
+        self.factory.handleEvent(ChoosePrompt("First"))
+        self.assertEqual(self.received(self.first), ["StoryUpdate"])
+        self.assertEqual(self.received(self.second), [])
+
+    def test_idle_connections_are_dropped(self):
+        self.first.lastSeen -= server.IDLE_TIMEOUT_SECONDS + 1
+
+        self.factory.dropIdleClients()
+
+        self.assertTrue(self.first.transport.disconnecting)
+        self.assertFalse(self.second.transport.disconnecting)
+
+
+class TestPlayerNames(TestCase):
+    def test_names_are_not_reused_after_a_player_leaves(self):
+        factory = server.CommandLineGroupweaveFactory()
+        connections = []
+        for _ in range(3):
+            protocol = factory.buildProtocol(None)
+            protocol.makeConnection(StringTransport())
+            connections.append(protocol)
+
+        connections[1].connectionLost(None)
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(StringTransport())
+
+        self.assertEqual([player.name for player in factory.game.players], ["Player 1", "Player 2"])
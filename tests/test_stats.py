@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from bench.stats import percentile, summarize, LatencyRecorder
+
+
+class TestStats(TestCase):
+    def test_percentile(self):
+        values = [1, 2, 3, 4, 5]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 100), 5)
+        self.assertEqual(percentile(values, 75), 4)
+        self.assertAlmostEqual(percentile([1, 2], 50), 1.5)
+        self.assertRaises(ValueError, percentile, [], 50)
+
+    def test_summarize(self):
+        summary = summarize([0.001, 0.002, 0.003])
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['p50_ms'], 2.0)
+        self.assertEqual(summary['max_ms'], 3.0)
+        self.assertEqual(summarize([]), {'count': 0})
+
+    def test_recorder(self):
+        recorder = LatencyRecorder()
+        recorder.record("submit_prompt", 0.01)
+        recorder.record("submit_prompt", 0.02)
+        recorder.error("join_game")
+
+        summary = recorder.summary()
+        self.assertEqual(recorder.total, 2)
+        self.assertEqual(summary["submit_prompt"]['count'], 2)
+        self.assertEqual(summary["submit_prompt"]['errors'], 0)
+        self.assertEqual(summary["join_game"], {'count': 0, 'errors': 1})
@@ -0,0 +1,44 @@
+import random
+from unittest import TestCase
+
+from timerwheel import TimerWheel
+
+
+class TestTimerWheel(TestCase):
+    def test_timers_fire_when_due(self):
+        wheel = TimerWheel(tick_seconds=1.0, slots=4, levels=2)
+        fired = []
+        rng = random.Random(7)
+        # Delays beyond slots ** levels ticks exercise the cascade and the overflow list
+        delays = [rng.randint(1, 60) for _ in range(500)]
+        for i, delay in enumerate(delays):
+            wheel.schedule(delay, fired.append, (delay, i))
+
+        for now in range(1, 61):
+            wheel.advance(now)
+            self.assertTrue(all(delay == now for delay, _ in fired), now)
+            del fired[:]
+
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancelled_timer_does_not_fire(self):
+        wheel = TimerWheel(tick_seconds=0.5, start=100.0)
+        fired = []
+        timer = wheel.schedule(2, fired.append, "cancelled")
+        wheel.schedule(2, fired.append, "kept")
+
+        timer.cancel()
+        self.assertEqual(wheel.advance(102.0), 1)
+
+        self.assertEqual(fired, ["kept"])
+
+    def test_timer_is_accurate_to_one_tick(self):
+        wheel = TimerWheel(tick_seconds=1.0)
+        fired = []
+        wheel.advance(0.9)
+        wheel.schedule(1.5, fired.append, "late")
+
+        wheel.advance(1.9)
+        self.assertEqual(fired, [])
+        wheel.advance(2.0)
+        self.assertEqual(fired, ["late"])
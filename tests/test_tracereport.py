@@ -0,0 +1,22 @@
+from unittest import TestCase
+
+from bench.tracereport import analyze
+
+
+class TestTraceReport(TestCase):
+    def test_analyze(self):
+        traces = [
+            {'id': 'a', 'type': 'NewPrompts', 'recipient': 'host',
+             'hops': [['submit_prompt', 10.0], ['publish', 10.5], ['receive', 11.0]]},
+            {'id': 'b', 'type': 'StoryUpdate', 'recipient': 'Jeb',
+             'hops': [['choose_prompt', 20.0], ['publish', 20.25], ['receive', 21.0]]},
+            {'id': 'c', 'type': 'StoryUpdate', 'recipient': 'Zedd', 'hops': [['receive', 21.0]]}
+        ]
+
+        report = analyze(traces)
+
+        self.assertEqual(report['end_to_end']['NewPrompts']['p50_ms'], 1000.0)
+        self.assertEqual(report['end_to_end']['all']['count'], 2)
+        self.assertEqual(report['hops']['submit_prompt->publish']['p50_ms'], 500.0)
+        self.assertEqual(report['hops']['publish->receive']['count'], 2)
+        self.assertEqual(report['hops']['publish->receive']['max_ms'], 750.0)
@@ -0,0 +1,105 @@
+"""
+Hierarchical timing wheel, for keeping very many pending
+deadlines (e.g. one per game round) cheaply.
+
+Scheduling and cancelling a timer are O(1). Advancing the wheel costs
+O(1) per elapsed tick plus the timers that fire or move down a level,
+however many timers are pending. Timers fire on the first tick at or
+after their due time, so they are accurate to one tick.
+"""
+import math
+
+
+class Timer(object):
+    def __init__(self, due_tick, callback, args):
+        self.due_tick = due_tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """
+    'levels' wheels of 'slots' slots each. Level 0 holds timers due in
+    the next 'slots' ticks, level 1 those due in the next slots ** 2
+    ticks and so on; timers due further out than that wait in an
+    overflow list. As the wheel turns, a slot of a higher level is
+    emptied into the levels below it just before its timers are due.
+    """
+
+    def __init__(self, tick_seconds=1.0, slots=64, levels=4, start=0.0):
+        self.tick_seconds = tick_seconds
+        self.slots = slots
+        self.levels = levels
+        self.current_tick = int(start / tick_seconds)
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._overflow = []
+        self._pending = 0
+
+    def __len__(self):
+        """
+        :return: the number of timers scheduled and not yet fired, including cancelled ones
+        """
+        return self._pending
+
+    def schedule(self, delay, callback, *args):
+        """
+        Call callback(*args) once 'delay' seconds have passed
+        :return: a Timer, which can be cancelled
+        """
+        ticks = max(1, int(math.ceil(delay / self.tick_seconds)))
+        timer = Timer(self.current_tick + ticks, callback, args)
+        self._place(timer)
+        self._pending += 1
+        return timer
+
+    def _place(self, timer):
+        remaining = timer.due_tick - self.current_tick
+        span = 1
+        for level in range(self.levels):
+            if remaining < span * self.slots:
+                self._wheels[level][(timer.due_tick // span) % self.slots].append(timer)
+                return
+            span *= self.slots
+        self._overflow.append(timer)
+
+    def advance(self, now):
+        """
+        Turn the wheel to time 'now', firing every timer that has become due
+        :return: the number of timers fired
+        """
+        target_tick = int(now / self.tick_seconds)
+        fired = 0
+        while self.current_tick < target_tick:
+            self.current_tick += 1
+            self._cascade()
+            slot = self._wheels[0][self.current_tick % self.slots]
+            self._wheels[0][self.current_tick % self.slots] = []
+            for timer in slot:
+                self._pending -= 1
+                if not timer.cancelled:
+                    timer.callback(*timer.args)
+                    fired += 1
+        return fired
+
+    def _cascade(self):
+        span = self.slots
+        for level in range(1, self.levels):
+            if self.current_tick % span != 0:
+                return
+            index = (self.current_tick // span) % self.slots
+            timers = self._wheels[level][index]
+            self._wheels[level][index] = []
+            for timer in timers:
+                if not timer.cancelled:
+                    self._place(timer)
+                else:
+                    self._pending -= 1
+            span *= self.slots
+        if self.current_tick % span == 0:
+            timers, self._overflow = self._overflow, []
+            for timer in timers:
+                self._place(timer)
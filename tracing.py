@@ -0,0 +1,30 @@
+"""
+Recording of traced events as they are received, for
+measuring end-to-end latency with bench/tracereport.py
+
+Receivers append one JSON line per traced event to the file
+named by the GROUPWEAVE_TRACE_LOG environment variable.
+"""
+import json
+import os
+import threading
+
+TRACE_LOG = os.environ.get("GROUPWEAVE_TRACE_LOG")
+
+_lock = threading.Lock()
+
+
+def record_receipt(event, recipient, hop="receive", path=None):
+    """
+    Mark a traced event as received and append it to the trace log
+    :param recipient: a name identifying who received the event
+    """
+    path = path or TRACE_LOG
+    if path is None or event.trace is None:
+        return
+    event.mark(hop)
+    line = json.dumps({'id': event.trace['id'], 'type': event.type,
+                       'recipient': recipient, 'hops': event.trace['hops']})
+    with _lock:
+        with open(path, 'a') as f:
+            f.write(line + "\n")